@@ -0,0 +1,210 @@
+import os
+import sys
+import math
+import json
+import time
+import platform
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import cirq
+import numpy as np
+
+from modelling.gaussian1D import Gaussian1DineqBased
+from utils.arithmetics import Adder, ControlAdder, Multiplier
+from utils.inequality_test import Comparator, clear_comparator_cache
+from utils.resource_estimation import generate_circuit_stats
+from experimental import fx_equals_x
+from experimental.sweep import MODELS, build_state_prep
+
+"""
+Benchmark suite of the circuit builders, simulators and resource counters, with JSON baselines.
+
+Every benchmark is timed over a grid of sizes: 'run' writes the best and median wall times of a few repetitions, the
+tracemalloc peak of one extra (untimed) run and the number of operations of the built circuit to a JSON file, and
+'compare' flags the cases of a new run slower or more memory hungry than a baseline beyond a tolerance (exit code 1),
+so a performance change can be checked against the numbers of the previous commit on the same machine.
+"""
+
+MODEL_NAMES = {name: model.__name__ for name, model in MODELS.items()}
+
+
+def get_argparse():
+    parser = argparse.ArgumentParser(description='Benchmarks of the circuit builders, simulators and counters')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='Run the benchmarks and write their results as JSON')
+    run.add_argument('-b', '--benchmarks', nargs='*', default=None,
+                     help='Benchmarks to run (names or prefixes, e.g. Adder BlackBox), all by default')
+    run.add_argument('-r', '--repeat', type=int, default=5, help='Timed repetitions of every case')
+    run.add_argument('-o', '--json_out', default='results/benchmarks.json', help='Output file for the results')
+    compare = commands.add_parser('compare', help='Compare a run against a baseline')
+    compare.add_argument('baseline', help='JSON results of the reference run')
+    compare.add_argument('current', help='JSON results of the run to check')
+    compare.add_argument('-t', '--tolerance', type=float, default=0.2,
+                         help='Allowed relative increase of time and memory before a case is flagged')
+    compare.add_argument('--metric', default='median', choices=['median', 'best'], help='Time compared')
+    return parser.parse_args()
+
+def circuit_size(circuit):
+  # CircuitOperations counted once, as in construction_benchmark
+  return len(list(circuit.all_operations())) if isinstance(circuit, cirq.AbstractCircuit) else None
+
+def adder_case(n):
+  A = [cirq.NamedQubit('a' + str(i)) for i in range(n)]
+  B = [cirq.NamedQubit('b' + str(i)) for i in range(n+1)]
+  return lambda: Adder(A, B).construct_circuit()
+
+def control_adder_case(n):
+  A = [cirq.NamedQubit('a' + str(i)) for i in range(n)]
+  B = [cirq.NamedQubit('b' + str(i)) for i in range(n+1)]
+  return lambda: ControlAdder(A, B, cirq.NamedQubit('ctrl')).construct_circuit()
+
+def multiplier_case(n):
+  A = [cirq.NamedQubit('a' + str(i)) for i in range(n)]
+  B = [cirq.NamedQubit('b' + str(i)) for i in range(n)]
+  return lambda: Multiplier(A, B).multiply()
+
+def comparator_case(n):
+  A = [cirq.NamedQubit('a' + str(i)) for i in range(n)]
+  B = [cirq.NamedQubit('b' + str(i)) for i in range(n)]
+  # cold construction: the comparator templates are rebuilt by every repetition
+  clear_comparator_cache()
+  return lambda: Comparator(A, B).construct_circuit()
+
+def construct_case(model_name):
+  def case(n):
+    state_prep = MODELS[model_name](num_out_qubits=n, num_data_qubits=n, black_box=fx_equals_x.blackbox)
+    num_iteration = None
+    if model_name != "fixed_point_aa":
+      num_iteration = math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0, 2**n)]))
+    def construct():
+      state_prep.construct_circuit(num_iteration=num_iteration)
+      return state_prep.output_circuit
+    return construct
+  return case
+
+def get_output_case(model_name):
+  def case(n):
+    state_prep = build_state_prep(model_name, "x", n)
+    return state_prep.get_output
+  return case
+
+def gaussian_case(p):
+  # m = 2 keeps the state vector within memory: p=6 already needs 2^29 amplitudes
+  return lambda: Gaussian1DineqBased(p, 2, 1.0, 0.5).simulate()
+
+def circuit_stats_case(n):
+  circuit = build_state_prep("regular_aa", "x", n).output_circuit
+  directory = tempfile.mkdtemp()
+  return lambda: generate_circuit_stats(circuit, n, csv_out=os.path.join(directory, 'stats.csv'))
+
+def benchmarks() -> list:
+  """ (name, case, sizes): case(n) prepares the inputs, untimed, and returns the function to time """
+  suite = [("Adder.construct_circuit", adder_case, [8, 16, 32, 64]),
+           ("ControlAdder.construct_circuit", control_adder_case, [8, 16, 32, 64]),
+           ("Multiplier.multiply", multiplier_case, [4, 8, 16, 32]),
+           ("Comparator.construct_circuit", comparator_case, [8, 16, 32, 64])]
+  for model_name, class_name in MODEL_NAMES.items():
+    suite.append(("{}.construct_circuit".format(class_name), construct_case(model_name), [2, 4, 8, 16]))
+  for model_name, class_name in MODEL_NAMES.items():
+    suite.append(("{}.get_output".format(class_name), get_output_case(model_name), [2, 3, 4]))
+  suite.append(("Gaussian1DineqBased.simulate", gaussian_case, [4, 5]))
+  suite.append(("generate_circuit_stats", circuit_stats_case, [2, 3]))
+  return suite
+
+def run_case(case, n: int, repeat: int) -> dict:
+  """ Best and median wall times of 'repeat' runs, tracemalloc peak of one more run and size of the circuit """
+  times = []
+  for _ in range(repeat):
+    function = case(n)
+    t_start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - t_start)
+  # traced separately, tracing slows the timed runs down
+  function = case(n)
+  tracemalloc.start()
+  try:
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return {"n": n, "repeat": repeat, "best": min(times), "median": float(np.median(times)),
+          "tracemalloc_peak": peak, "operations": circuit_size(result)}
+
+def run_benchmarks(selected: list, repeat: int) -> dict:
+  results = {}
+  for name, case, sizes in benchmarks():
+    if selected and not any(name.startswith(prefix) for prefix in selected):
+      continue
+    for n in sizes:
+      result = run_case(case, n, repeat)
+      results["{}[n={}]".format(name, n)] = result
+      print("[INFO] {}[n={}]: median {:.4f}s, best {:.4f}s, peak {:.1f} MB".format(
+        name, n, result["median"], result["best"], result["tracemalloc_peak"]/1e6))
+  return {"machine": {"python": platform.python_version(), "cirq": cirq.__version__,
+                      "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count()},
+          "date": datetime.datetime.now().isoformat(timespec='seconds'), "results": results}
+
+def compare_results(baseline: dict, current: dict, tolerance: float, metric: str = "median") -> list:
+  """
+  Cases of 'current' whose time ('metric') or tracemalloc peak exceeds the one of 'baseline' by more than
+  'tolerance' (relative), as (case, quantity, baseline value, current value).
+  """
+  regressions = []
+  for case, result in current["results"].items():
+    reference = baseline["results"].get(case)
+    if reference is None:
+      continue
+    for quantity in (metric, "tracemalloc_peak"):
+      if result[quantity] > (1 + tolerance)*reference[quantity]:
+        regressions.append((case, quantity, reference[quantity], result[quantity]))
+  return regressions
+
+def print_comparison(baseline: dict, current: dict, metric: str) -> None:
+  print("{:<50} {:>12} {:>12} {:>8} {:>10} {:>10}".format("case", "baseline (s)", "current (s)", "ratio",
+                                                          "peak ratio", "ops"))
+  for case, result in current["results"].items():
+    reference = baseline["results"].get(case)
+    if reference is None:
+      print("{:<50} {:>12} {:>12.4f}".format(case, "new", result[metric]))
+      continue
+    # a different number of operations means the benchmark no longer builds the same circuit
+    operations = "same" if reference["operations"] == result["operations"] else "{} -> {}".format(
+      reference["operations"], result["operations"])
+    print("{:<50} {:>12.4f} {:>12.4f} {:>8.2f} {:>10.2f} {:>10}".format(
+      case, reference[metric], result[metric], result[metric]/reference[metric],
+      result["tracemalloc_peak"]/max(reference["tracemalloc_peak"], 1), operations))
+  for case in baseline["results"]:
+    if case not in current["results"]:
+      print("{:<50} {:>12.4f} {:>12}".format(case, baseline["results"][case][metric], "missing"))
+
+def main():
+   config = get_argparse()
+   if config.command == 'run':
+        output = run_benchmarks(config.benchmarks, config.repeat)
+        if os.path.dirname(config.json_out):
+            os.makedirs(os.path.dirname(config.json_out), exist_ok=True)
+        with open(config.json_out, 'w') as out_file:
+            json.dump(output, out_file, indent=1)
+        print("[INFO] DONE!!!")
+        return
+
+   with open(config.baseline) as in_file:
+        baseline = json.load(in_file)
+   with open(config.current) as in_file:
+        current = json.load(in_file)
+   if baseline["machine"] != current["machine"]:
+        print("[WARNING] The runs were made on different machines or versions:", baseline["machine"],
+              current["machine"])
+   print_comparison(baseline, current, config.metric)
+   regressions = compare_results(baseline, current, config.tolerance, config.metric)
+   for case, quantity, reference, value in regressions:
+        print("[REGRESSION] {} {}: {:.4g} -> {:.4g} (+{:.0%})".format(case, quantity, reference, value,
+                                                                       value/reference - 1))
+   if regressions:
+        sys.exit(1)
+   print("[INFO] No regression beyond {:.0%}".format(config.tolerance))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import time
+import math
+import argparse
+import cirq
+import numpy as np
+
+from modelling.black_box_without_arithmetic import BlackBoxRegularAA
+from utils.arithmetics import Multiplier
+from experimental.fx_equals_x2 import build_model
+
+
+def get_argparse():
+    parser = argparse.ArgumentParser(description='Circuit construction time against circuit size')
+    parser.add_argument('--multiplier_sizes', type=int, nargs='*', default=[8, 16, 32, 64],
+                        help='Operand sizes of the Multiplier')
+    parser.add_argument('--model_sizes', type=int, nargs='*', default=[2, 4, 8, 16],
+                        help='Input sizes of the BlackBoxRegularAA model of f(x) = x^2')
+    parser.add_argument('--repeat', type=int, default=3, help='Best of this many constructions')
+    parser.add_argument('-o', '--csv_out', default=None, help='Optional csv file for the timings')
+    return parser.parse_args()
+
+def build_multiplier(n):
+  A = [cirq.NamedQubit('a' + str(i)) for i in range(n)]
+  B = [cirq.NamedQubit('b' + str(i)) for i in range(n)]
+  return Multiplier(A, B).multiply()
+
+def build_regular_aa(n):
+  model = build_model(BlackBoxRegularAA, n)
+  model.construct_circuit(num_iteration=math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0, 2**n)])))
+  return model.output_circuit
+
+def time_construction(build, n, repeat):
+  """
+  Best construction time of build(n) over 'repeat' runs and the number of operations of the circuit
+  (CircuitOperations counted once), linear scaling means a constant time per operation.
+  """
+  best = np.inf
+  for _ in range(repeat):
+    t_start = time.perf_counter()
+    circuit = build(n)
+    best = min(best, time.perf_counter() - t_start)
+  return best, len(list(circuit.all_operations()))
+
+def main():
+   config = get_argparse()
+   rows = []
+   for name, build, sizes in [("Multiplier", build_multiplier, config.multiplier_sizes),
+                              ("BlackBoxRegularAA", build_regular_aa, config.model_sizes)]:
+        for n in sizes:
+            seconds, num_ops = time_construction(build, n, config.repeat)
+            rows.append((name, n, seconds, num_ops))
+            print("[INFO] {} n={}: {:.4f}s for {} operations, {:.2f}us per operation".format(
+                name, n, seconds, num_ops, 1e6*seconds/num_ops))
+
+   if config.csv_out is not None:
+        with open(config.csv_out, 'w') as out_file:
+            out_file.write('Builder,Input Size,Construction_Time,Num_Operations,Time_Per_Operation\n')
+            for name, n, seconds, num_ops in rows:
+                out_file.write(f'{name},{n},{seconds},{num_ops},{seconds/num_ops}\n')
+   print("[INFO] DONE!!!")
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,20 @@ import sys
 
 from modelling.black_box_without_arithmetic import *
 from utils.resource_estimation import generate_circuit_stats
+from utils.profiling import stage
+from utils.stats_cache import StatsCache
 import argparse
 
 
 def get_argparse():
     parser = argparse.ArgumentParser()
     parser.add_argument('-m', '--model', default='regular_aa',
-                        choices=['regular_aa', 'oblivious_aa', 'square_root'])
+                        choices=['regular_aa', 'oblivious_aa', 'square_root', 'fixed_point_aa'])
     parser.add_argument('-f', '--figure', default='fx_equals_x.png',
                         help='Output file for the visualization')
     parser.add_argument('-o', '--rs_dir', default='results/fx_equals_x.csv', help='Output file for resouce estimation')
+    parser.add_argument('-c', '--cache_dir', default=None,
+                        help='Cache of resource estimates already computed (e.g. .stats_cache), disabled by default')
     return parser.parse_args()
 
 def blackbox(out_register: list, data_register: list) -> cirq.Circuit:
@@ -31,9 +35,15 @@ def blackbox(out_register: list, data_register: list) -> cirq.Circuit:
 
 def visualize_results(config, input_size, model, output_file="f(x)_equals_x.png"):
   circuit = model(num_out_qubits=input_size, num_data_qubits=input_size, black_box=blackbox)
-  num_iteration = math.ceil((np.pi/4)*np.sqrt(2**input_size)/np.linalg.norm([x for x in range(0,2**input_size)]))
-  print("[INFO] Running the experiment with {} Amplitude Amplification Rounds".format(num_iteration))
+  if config.model == "fixed_point_aa":
+      # the fixed-point sequence length follows from delta and the lower bound on the success probability
+      num_iteration = None
+  else:
+      num_iteration = math.ceil((np.pi/4)*np.sqrt(2**input_size)/np.linalg.norm([x for x in range(0,2**input_size)]))
   circuit.construct_circuit(num_iteration=num_iteration)
+  if num_iteration is None:
+      num_iteration = circuit.num_iteration
+  print("[INFO] Running the experiment with {} Amplitude Amplification Rounds".format(num_iteration))
   output = circuit.get_output()
   if config.model == "square_root":
       expected_output = np.sqrt(np.arange(0, 2**input_size)/np.sum(np.arange(0, 2**input_size)))
@@ -57,6 +67,8 @@ def main():
       model = BlackBoxObliviousAA
    elif config.model == "square_root":
       model = BlackBoxSquareRoot
+   elif config.model == "fixed_point_aa":
+      model = BlackBoxFixedPointAA
    else:
       raise Exception('Unknown model') 
 
@@ -64,13 +76,18 @@ def main():
    visualize_results(config=config, input_size=4, model=model, output_file=config.figure)
 
    # resouce estimated on different input size
+   cache = StatsCache(config.cache_dir) if config.cache_dir else None
    input_size = [2,4,8,16]
    for n in input_size:
         print("[INFO] Prepare result with:", n)
-        state_prep = model(num_out_qubits=n, num_data_qubits=n, black_box=blackbox)
-        state_prep.construct_circuit(num_iteration = math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0,2**n)])))
+        with stage("resource_estimation", model=config.model, n=n):
+            state_prep = model(num_out_qubits=n, num_data_qubits=n, black_box=blackbox)
+            if config.model == "fixed_point_aa":
+                state_prep.construct_circuit(num_iteration = None)
+            else:
+                state_prep.construct_circuit(num_iteration = math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0,2**n)])))
 
-        generate_circuit_stats(state_prep.output_circuit, n, csv_out = config.rs_dir)
+            generate_circuit_stats(state_prep.output_circuit, n, csv_out = config.rs_dir, cache = cache)
    print("[INFO] DONE!!!")
 
 if __name__ == '__main__':
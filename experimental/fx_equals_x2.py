@@ -8,38 +8,52 @@ import sys
 
 from modelling.black_box_without_arithmetic import *
 from utils.resource_estimation import generate_circuit_stats
-from utils.arithmetics import Multiplier
+from utils.profiling import stage
+from utils.stats_cache import StatsCache
+from utils.arithmetics import Squarer
+from utils.ancilla import AncillaPool
 import argparse
 
 
 def get_argparse():
     parser = argparse.ArgumentParser()
     parser.add_argument('-m', '--model', default='regular_aa',
-                        choices=['regular_aa', 'oblivious_aa', 'square_root'])
+                        choices=['regular_aa', 'oblivious_aa', 'square_root', 'fixed_point_aa'])
     parser.add_argument('-f', '--figure', default='fx_equals_x2.png',
                         help='Output file for the visualization')
     parser.add_argument('-o', '--rs_dir', default='results/fx_equals_x2.csv', help='Output file for resouce estimation')
+    parser.add_argument('-c', '--cache_dir', default=None,
+                        help='Cache of resource estimates already computed (e.g. .stats_cache), disabled by default')
     return parser.parse_args()
 
 # blackbox for f(x) = x^2
-def blackbox(out_register, data_register):
-  anncilla = [cirq.NamedQubit('bb2_anc' + str(i)) for i in range(len(out_register))]
+def blackbox(out_register, data_register, pool=None):
   circuit = cirq.Circuit()
 
-  for out, anc in zip(out_register, anncilla):
-    circuit.append(cirq.CNOT(out, anc), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-  
-  multiplier = Multiplier(out_register, anncilla, data_register).multiply()
-  circuit.append(multiplier, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+  # x*x without a copy of x: each cross term is added once
+  squarer = Squarer(out_register, data_register, pool=pool).square()
+  circuit.append(squarer, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
   return circuit
 
+def build_model(model, input_size):
+  # the black box borrows its ancillae from the pool of the model
+  pool = AncillaPool()
+  return model(num_out_qubits=input_size, num_data_qubits=2*input_size+1,
+               black_box=lambda out, data: blackbox(out, data, pool=pool), pool=pool)
+
 
 def visualize_results(config, input_size, model, output_file="fx_equals_x2.png"):
-  circuit = model(num_out_qubits=input_size, num_data_qubits=2*input_size+1, black_box=blackbox)
-  num_iteration = math.ceil((np.pi/4)*np.sqrt(2**input_size)/np.linalg.norm([x for x in range(0,2**input_size)]))
-  print("[INFO] Running the experiment with {} Amplitude Amplification Rounds".format(num_iteration))
+  circuit = build_model(model, input_size)
+  if config.model == "fixed_point_aa":
+      # the fixed-point sequence length follows from delta and the lower bound on the success probability
+      num_iteration = None
+  else:
+      num_iteration = math.ceil((np.pi/4)*np.sqrt(2**input_size)/np.linalg.norm([x for x in range(0,2**input_size)]))
   circuit.construct_circuit(num_iteration=num_iteration)
+  if num_iteration is None:
+      num_iteration = circuit.num_iteration
+  print("[INFO] Running the experiment with {} Amplitude Amplification Rounds".format(num_iteration))
   output = circuit.get_output()
   if config.model == "square_root":
       expected_output = np.arange(0, 2**input_size)/np.linalg.norm(np.arange(0, 2**input_size))
@@ -64,6 +78,8 @@ def main():
       model = BlackBoxObliviousAA
    elif config.model == "square_root":
       model = BlackBoxSquareRoot
+   elif config.model == "fixed_point_aa":
+      model = BlackBoxFixedPointAA
    else:
       raise Exception('Unknown model') 
 
@@ -71,13 +87,18 @@ def main():
    visualize_results(config=config, input_size=2, model=model, output_file=config.figure)
 
    # resouce estimated on different input size
+   cache = StatsCache(config.cache_dir) if config.cache_dir else None
    input_size = [2,4,8,16]
    for n in input_size:
         print("[INFO] Prepare result with:", n)
-        state_prep = model(num_out_qubits=n, num_data_qubits=2*n+1, black_box=blackbox)
-        state_prep.construct_circuit(num_iteration = math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0,2**n)])))
+        with stage("resource_estimation", model=config.model, n=n):
+            state_prep = build_model(model, n)
+            if config.model == "fixed_point_aa":
+                state_prep.construct_circuit(num_iteration = None)
+            else:
+                state_prep.construct_circuit(num_iteration = math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0,2**n)])))
 
-        generate_circuit_stats(state_prep.output_circuit, n, csv_out = config.rs_dir)
+            generate_circuit_stats(state_prep.output_circuit, n, csv_out = config.rs_dir, cache = cache)
    print("[INFO] DONE!!!")
 
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+import argparse
+
+from utils.profiling import aggregate
+
+
+def get_argparse():
+    parser = argparse.ArgumentParser(description='Aggregate the per-stage profiles (JSON lines) of utils.profiling')
+    parser.add_argument('profiles', nargs='+', help='JSON lines files written with QSP_PROFILE=<file>')
+    parser.add_argument('-o', '--csv_out', default=None, help='Optional csv file for the totals')
+    return parser.parse_args()
+
+def format_megabytes(value, scale):
+  return "-" if value is None else "{:.1f}".format(value/scale)
+
+def main():
+   config = get_argparse()
+   totals = sorted(aggregate(config.profiles).items(), key=lambda item: -item[1]["wall"])
+   print("{:<90} {:>7} {:>10} {:>10} {:>10} {:>10}".format("stage", "calls", "wall (s)", "cpu (s)", "peak (MB)",
+                                                           "rss (MB)"))
+   for path, total in totals:
+        print("{:<90} {:>7} {:>10.3f} {:>10.3f} {:>10} {:>10}".format(
+            path, total["calls"], total["wall"], total["cpu"], format_megabytes(total["tracemalloc_peak"], 1e6),
+            format_megabytes(total["max_rss_kb"], 1e3)))
+
+   if config.csv_out is not None:
+        with open(config.csv_out, 'w') as out_file:
+            out_file.write('Stage,Calls,Wall_Time,CPU_Time,Tracemalloc_Peak,Max_RSS_KB\n')
+            for path, total in totals:
+                out_file.write(f'{path},{total["calls"]},{total["wall"]},{total["cpu"]},'
+                               f'{total["tracemalloc_peak"]},{total["max_rss_kb"]}\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import os
+import math
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from modelling.black_box_without_arithmetic import *
+from utils.resource_estimation import CSV_HEADER, compute_circuit_stats, write_circuit_stats
+from utils.profiling import stage
+from utils.stats_cache import StatsCache
+from experimental import fx_equals_x, fx_equals_x2
+
+"""
+Resource estimation sweep over (model, black box, input size) jobs, run in a process pool.
+
+Rows are written in job order as soon as every earlier job is done, each with a single flushed write, and jobs whose
+row is already in the output file are skipped, so an interrupted sweep is resumed by running the same command again.
+"""
+
+MODELS = {
+    "regular_aa": BlackBoxRegularAA,
+    "oblivious_aa": BlackBoxObliviousAA,
+    "square_root": BlackBoxSquareRoot,
+    "fixed_point_aa": BlackBoxFixedPointAA,
+}
+BLACK_BOXES = ["x", "x2"]
+SWEEP_HEADER = 'Model,Black_Box,' + CSV_HEADER
+
+
+def get_argparse():
+    parser = argparse.ArgumentParser(description='Parallel, resumable resource estimation sweep')
+    parser.add_argument('-m', '--models', nargs='*', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('-b', '--black_boxes', nargs='*', default=BLACK_BOXES, choices=BLACK_BOXES,
+                        help='f(x) = x (fx_equals_x) or f(x) = x^2 (fx_equals_x2)')
+    parser.add_argument('-n', '--sizes', type=int, nargs='*', default=[2, 4, 8, 16], help='Input sizes')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('-o', '--csv_out', default='results/sweep.csv', help='Output file for resource estimation')
+    parser.add_argument('-c', '--cache_dir', default=None,
+                        help='Cache of resource estimates shared by the workers (e.g. .stats_cache), off by default')
+    return parser.parse_args()
+
+def build_state_prep(model_name: str, black_box: str, n: int):
+  model = MODELS[model_name]
+  if black_box == "x":
+    state_prep = model(num_out_qubits=n, num_data_qubits=n, black_box=fx_equals_x.blackbox)
+  else:
+    state_prep = fx_equals_x2.build_model(model, n)
+  if model_name == "fixed_point_aa":
+    state_prep.construct_circuit(num_iteration=None)
+  else:
+    state_prep.construct_circuit(num_iteration=math.ceil((np.pi/4)*np.sqrt(2**n)/np.linalg.norm([x for x in range(0, 2**n)])))
+  return state_prep
+
+def run_job(job: tuple, cache_dir: str = None) -> list:
+  # worker: one row of the sweep
+  model_name, black_box, n = job
+  with stage("sweep_job", model=model_name, black_box=black_box, n=n):
+    state_prep = build_state_prep(model_name, black_box, n)
+    cache = StatsCache(cache_dir) if cache_dir else None
+    return [model_name, black_box] + compute_circuit_stats(state_prep.output_circuit, n, cache=cache)
+
+def completed_jobs(csv_out: str) -> set:
+  """
+  Jobs already in the output file. A trailing partial row (from a run killed mid-write) is cut off, and a file with
+  another header is refused rather than mixed with the sweep rows.
+  """
+  if not os.path.exists(csv_out):
+    return set()
+  with open(csv_out, 'rb+') as in_file:
+    content = in_file.read()
+    if content and not content.endswith(b'\n'):
+      content = content[:content.rfind(b'\n')+1]
+      in_file.truncate(len(content))
+  lines = content.decode().splitlines()
+  if not lines:
+    return set()
+  if lines[0] != SWEEP_HEADER:
+    raise ValueError("{} is not a sweep output file (header {!r})".format(csv_out, lines[0]))
+  done = set()
+  for line in lines[1:]:
+    model_name, black_box, n = line.split(',')[:3]
+    done.add((model_name, black_box, int(n)))
+  return done
+
+def run_sweep(jobs: list, csv_out: str, workers: int, cache_dir: str = None) -> None:
+  """
+  Run the jobs missing from csv_out in a process pool and append their rows in the order of 'jobs'.
+  A failed job is reported and left out of the file, so it is retried by the next run. Jobs whose circuit is in the
+  cache 'cache_dir' (see utils.stats_cache) are not estimated again.
+  """
+  done = completed_jobs(csv_out)
+  pending = [job for job in jobs if job not in done]
+  print("[INFO] {} jobs, {} already in {}".format(len(jobs), len(jobs) - len(pending), csv_out))
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(run_job, job, cache_dir) for job in pending]
+    # waiting on the futures in submission order writes the rows in job order
+    for job, future in zip(pending, futures):
+      try:
+        row = future.result()
+      except Exception as error:
+        print("[ERROR] {}: {!r}".format(job, error))
+        continue
+      write_circuit_stats(row, csv_out, header=SWEEP_HEADER)
+      print("[INFO] Done:", job)
+
+def main():
+   config = get_argparse()
+   jobs = list(itertools.product(config.models, config.black_boxes, config.sizes))
+   run_sweep(jobs, config.csv_out, config.workers, cache_dir=config.cache_dir)
+   print("[INFO] DONE!!!")
+
+if __name__ == '__main__':
+    main()
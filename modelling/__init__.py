@@ -1,2 +1,3 @@
+from modelling.aa_predictor import *
 from modelling.black_box_without_arithmetic import *
 from modelling.gaussian1D import *
\ No newline at end of file
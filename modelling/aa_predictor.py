@@ -0,0 +1,170 @@
+import numpy as np
+
+"""
+Classical predictor for the BlackBox models in black_box_without_arithmetic.py.
+
+For every index x the good state preparation loads v = f(x) into the data register and the inequality test leaves
+the amplitude a_v = v/2^d' on |0>_ref|0>_flag, where d' = 2^floor(log2(num_data_qubits)) is the number of bits the
+Comparator actually compares (the lowest d' bits of data). Everything below is computed from the histogram of a_v,
+so the cost is O(2^n) NumPy for the histogram and O(number of distinct values) per iteration count afterwards:
+
+  - BlackBoxRegularAA:   the good subspace is amplified as a whole, sin(theta) = sqrt(mean_x a_f(x)^2),
+                         P(k) = sin^2((2k+1) theta) and the output is proportional to a_f(x).
+  - BlackBoxObliviousAA: the reflections act independently on each data value, so index x is rotated by its own
+                         angle theta_v = arcsin(a_v): amplitude sin((2k-1) theta_v) for k >= 1 (a_v for k = 0).
+  - BlackBoxSquareRoot:  the flag reflections commute with the iterate on each ref branch, the success probability
+                         stays mean_x a_f(x) for every k and the output is proportional to sqrt(a_f(x)).
+"""
+
+__all__ = ["predict_regular_aa", "predict_oblivious_aa", "predict_square_root", "predict_output"]
+
+# candidates times distinct values evaluated by the default search of predict_oblivious_aa
+_SEARCH_BUDGET = 2**26
+
+def _compared_bits(num_data_qubits: int) -> int:
+  # Comparator builds int(log2(length)) layers of pairwise comparisons
+  return 2**int(np.log2(num_data_qubits)) if num_data_qubits > 1 else 1
+
+def _values(f, num_out_qubits: int, start: int, stop: int) -> np.ndarray:
+  if callable(f):
+    return np.asarray(f(np.arange(start, stop)), dtype=np.int64)
+  return np.asarray(f[start:stop], dtype=np.int64)
+
+def _compared_values(f, num_out_qubits: int, num_data_qubits: int, start: int, stop: int) -> np.ndarray:
+  # f(x) mod 2^d' as unsigned integers, d' >= 64 keeps every bit of an int64 value
+  bits = _compared_bits(num_data_qubits)
+  values = _values(f, num_out_qubits, start, stop).astype(np.uint64)
+  return values & np.uint64(2**bits - 1) if bits < 64 else values
+
+def _value_histogram(f, num_out_qubits: int, num_data_qubits: int, chunk_size: int) -> tuple:
+  """
+  Count how many indices x load each compared data value v = f(x) mod 2^d'. Only the values actually loaded are
+  kept, so the histogram has at most 2^n entries whatever d'.
+
+  :return: (sorted distinct values, their counts, their amplitudes a_v = v/2^d')
+  """
+  values = np.zeros(0, dtype=np.uint64)
+  counts = np.zeros(0, dtype=np.int64)
+  for start in range(0, 2**num_out_qubits, chunk_size):
+    stop = min(start + chunk_size, 2**num_out_qubits)
+    chunk_values, chunk_counts = np.unique(_compared_values(f, num_out_qubits, num_data_qubits, start, stop),
+                                           return_counts=True)
+    values, inverse = np.unique(np.concatenate([values, chunk_values]), return_inverse=True)
+    merged = np.zeros(len(values), dtype=np.int64)
+    np.add.at(merged, inverse, np.concatenate([counts, chunk_counts]))
+    counts = merged
+  return values, counts, values.astype(np.float64)/2.0**_compared_bits(num_data_qubits)
+
+def _summary(counts: np.ndarray, predicted: np.ndarray, target: np.ndarray, probability: float,
+             num_iteration: int, optimal_iteration: int) -> dict:
+  # fidelity of the predicted output with the target amplitudes, both given per data value
+  overlap = np.sum(counts*predicted*target)
+  norm = np.sqrt(np.sum(counts*predicted**2)*np.sum(counts*target**2))
+  return {"success_probability": float(probability),
+          "num_iteration": num_iteration,
+          "optimal_iteration": optimal_iteration,
+          "fidelity": float(overlap**2/norm**2) if norm > 0 else 0.0}
+
+def _amplitudes(f, num_out_qubits: int, num_data_qubits: int, values: np.ndarray, per_value: np.ndarray) -> np.ndarray:
+  compared = _compared_values(f, num_out_qubits, num_data_qubits, 0, 2**num_out_qubits)
+  amplitudes = per_value[np.searchsorted(values, compared)]
+  norm = np.linalg.norm(amplitudes)
+  return amplitudes/norm if norm > 0 else amplitudes
+
+def predict_regular_aa(f, num_out_qubits: int, num_data_qubits: int, num_iteration: int = None,
+                       return_amplitudes: bool = True, chunk_size: int = 2**20) -> dict:
+  """
+  Predict BlackBoxRegularAA.
+
+  Args:
+      - f: values f(x) for x in range(2**num_out_qubits), as an array or a vectorized callable on np.arange
+      - num_out_qubits: number of qubits of the output register
+      - num_data_qubits: number of qubits of the data register
+      - num_iteration: number of amplitude amplification rounds, the optimal count when None
+      - return_amplitudes: also return the predicted output amplitudes (2^n values)
+      - chunk_size: number of indices evaluated at once
+  Return:
+      A dict with success_probability, num_iteration, optimal_iteration, fidelity (with f/||f||), theta
+      and, if requested, amplitudes
+  """
+  values, counts, a = _value_histogram(f, num_out_qubits, num_data_qubits, chunk_size)
+  theta = np.arcsin(np.sqrt(np.sum(counts*a**2)/2**num_out_qubits))
+  optimal_iteration = max(int(np.round(np.pi/(4*theta) - 0.5)), 0) if theta > 0 else 0
+  if num_iteration is None:
+    num_iteration = optimal_iteration
+
+  result = _summary(counts, a, a, np.sin((2*num_iteration+1)*theta)**2, num_iteration, optimal_iteration)
+  result["theta"] = float(theta)
+  if return_amplitudes:
+    result["amplitudes"] = _amplitudes(f, num_out_qubits, num_data_qubits, values, a)
+  return result
+
+def _oblivious_per_value(a: np.ndarray, num_iteration: int) -> np.ndarray:
+  if num_iteration == 0:
+    return a
+  return np.sin((2*num_iteration-1)*np.arcsin(a))
+
+def predict_oblivious_aa(f, num_out_qubits: int, num_data_qubits: int, num_iteration: int = None,
+                         max_iteration: int = None, return_amplitudes: bool = True, chunk_size: int = 2**20) -> dict:
+  """
+  Predict BlackBoxObliviousAA. Arguments and returned dict as in predict_regular_aa; the optimal count maximizes
+  the success probability over 0..max_iteration (by default up to one period of the smallest non-zero angle, with at
+  most 2^26/(number of distinct values) candidates).
+  """
+  values, counts, a = _value_histogram(f, num_out_qubits, num_data_qubits, chunk_size)
+
+  def probability(k):
+    return np.sum(counts*_oblivious_per_value(a, k)**2)/2**num_out_qubits
+
+  if max_iteration is None:
+    loaded = a[a > 0]
+    max_iteration = int(np.ceil(np.pi/(2*np.arcsin(loaded.min())))) + 1 if len(loaded) else 0
+    # tiny values (e.g. f(x) = x^2 on 2^32 levels) would give billions of candidates
+    max_iteration = min(max_iteration, max(_SEARCH_BUDGET//len(a), 1))
+  # sin^2((2k-1) theta_v) is also a_v^2 for k = 0, so every candidate is evaluated at once, by blocks
+  angles = np.arcsin(a)
+  block = max(_SEARCH_BUDGET//(16*len(a)), 1)
+  probabilities = np.concatenate([
+    (np.sin(np.outer(2*np.arange(start, min(start + block, max_iteration+1)) - 1, angles))**2) @ counts
+    for start in range(0, max_iteration+1, block)])/2**num_out_qubits
+  optimal_iteration = int(np.argmax(probabilities))
+  if num_iteration is None:
+    num_iteration = optimal_iteration
+
+  per_value = _oblivious_per_value(a, num_iteration)
+  result = _summary(counts, per_value, a, probability(num_iteration), num_iteration, optimal_iteration)
+  if return_amplitudes:
+    result["amplitudes"] = _amplitudes(f, num_out_qubits, num_data_qubits, values, per_value)
+  return result
+
+def predict_square_root(f, num_out_qubits: int, num_data_qubits: int, num_iteration: int = None,
+                        return_amplitudes: bool = True, chunk_size: int = 2**20) -> dict:
+  """
+  Predict BlackBoxSquareRoot. Arguments and returned dict as in predict_regular_aa (fidelity with sqrt(f)/||sqrt(f)||).
+  The rounds do not change the success probability, so the optimal count is 0.
+  """
+  values, counts, a = _value_histogram(f, num_out_qubits, num_data_qubits, chunk_size)
+  if num_iteration is None:
+    num_iteration = 0
+
+  result = _summary(counts, np.sqrt(a), np.sqrt(a), np.sum(counts*a)/2**num_out_qubits, num_iteration, 0)
+  if return_amplitudes:
+    result["amplitudes"] = _amplitudes(f, num_out_qubits, num_data_qubits, values, np.sqrt(a))
+  return result
+
+def predict_output(model, f, num_iteration: int = None, **kwargs) -> dict:
+  """
+  Predict the output of a BlackBox model instance for the values f(x) it loads.
+
+  Args:
+      - model: a BlackBoxRegularAA, BlackBoxObliviousAA or BlackBoxSquareRoot instance
+      - f: values f(x), as in predict_regular_aa
+      - num_iteration: number of amplitude amplification rounds, the optimal count when None
+  """
+  predictors = {"BlackBoxRegularAA": predict_regular_aa,
+                "BlackBoxObliviousAA": predict_oblivious_aa,
+                "BlackBoxSquareRoot": predict_square_root}
+  name = type(model).__name__
+  if name not in predictors:
+    raise ValueError("Unknown model {}".format(name))
+  return predictors[name](f, model.num_out_qubits, model.num_data_qubits, num_iteration=num_iteration, **kwargs)
@@ -1,8 +1,227 @@
 import cirq
 import numpy as np
-from utils.inequality_test import Comparator
+import sympy
+from utils.ancilla import AncillaPool
+from utils.circuit_builder import CircuitBuilder
+from utils.inequality_test import Comparator, invert_circuit
+from utils.profiling import profiled
+from utils.data_loading import data_oracle, data_resolver, qrom_oracle, symbolic_data
+from utils.resource_model import and_toffolis, mcx_toffolis, repeat, resources, sequence
 
-__all__ = ["BlackBoxRegularAA", "BlackBoxObliviousAA", "BlackBoxSquareRoot"]
+__all__ = ["BlackBoxRegularAA", "BlackBoxObliviousAA", "BlackBoxSquareRoot", "BlackBoxFixedPointAA"]
+
+def _readout_order(circuit: cirq.Circuit, out: list, zero_qubits: list) -> list:
+  """
+  Qubit order for which the state vector reshapes to (x, zero_qubits, rest) with out[0] the least significant bit of x.
+  """
+  others = sorted(circuit.all_qubits() - set(out) - set(zero_qubits))
+  return out[::-1] + zero_qubits + others
+
+def _final_state(circuit: cirq.Circuit, out: list, zero_qubits: list) -> np.ndarray:
+  """
+  Final state vector of 'circuit' ordered by _readout_order. The mid-circuit measurements of the measurement-based
+  uncompute (comparators, QROM) fix the phase and reset their ancilla whatever the outcome, so the single trajectory
+  simulated is the final state of every shot.
+  """
+  return cirq.Simulator().simulate(circuit, qubit_order=_readout_order(circuit, out, zero_qubits)).final_state_vector
+
+def _post_select(state: np.ndarray, num_out: int, num_zero: int) -> tuple:
+  """
+  Take the amplitudes of |x>_out|0>_zero_qubits from a state vector ordered by _readout_order.
+
+  :return: (normalized signed amplitudes indexed by x, post-selection probability)
+  """
+  state = state.reshape(2**num_out, 2**num_zero, -1)[:, 0, :]
+  probability = float(np.sum(np.abs(state)**2))
+
+  # magnitudes are marginalized over the remaining registers as a measurement of out would see them,
+  # signs are taken from the branch carrying most of the weight (the uncomputed |0> of data and ancillae)
+  magnitude = np.sqrt(np.sum(np.abs(state)**2, axis=1)/probability)
+  branch = state[:, np.argmax(np.linalg.norm(state, axis=0))]
+  phase = np.where(np.abs(branch) > 1e-12, np.exp(1j*np.angle(branch)), 1)
+  amplitude = magnitude*phase
+  # fix the global phase so that the largest amplitude is real and positive
+  amplitude = amplitude*np.exp(-1j*np.angle(amplitude[np.argmax(np.abs(amplitude))]))
+  if np.allclose(amplitude.imag, 0, atol=1e-6):
+    amplitude = amplitude.real
+
+  return amplitude, probability
+
+def _post_selected_amplitudes(circuit: cirq.Circuit, out: list, zero_qubits: list) -> tuple:
+  """
+  Simulate the circuit once and read the amplitudes of |x>_out|0>_zero_qubits directly from the final state vector.
+
+  :param circuit: circuit without measurements of out and zero_qubits
+  :param out: output register, out[0] is the least significant bit of x
+  :param zero_qubits: qubits post-selected on |0> (e.g. ref and flag)
+  :return: (normalized signed amplitudes indexed by x, post-selection probability)
+  """
+  readout = set(out) | set(zero_qubits)
+  if any(isinstance(op.gate, cirq.MeasurementGate) and readout.intersection(op.qubits)
+         for op in circuit.all_operations()):
+    raise ValueError("The circuit measures the readout registers, their post-measurement state is collapsed")
+  return _post_select(_final_state(circuit, out, zero_qubits), len(out), len(zero_qubits))
+
+def _histogram_amplitudes(histogram: dict, num_out: int, num_zero: int) -> np.ndarray:
+  """
+  Rebuild the amplitudes of |x>_out|0>_zero_qubits from a histogram of measure(*out, *zero_qubits).
+  """
+  care_results = []
+  for i in range(2**num_out):
+    binarized_i = format(i, "b").zfill(num_out)[::-1]
+    care_results.append(histogram[int(binarized_i+"0"*num_zero, 2)])
+  return np.sqrt(np.array(care_results)/(sum(care_results)))
+
+def _care_distribution(state: np.ndarray, num_out: int, num_zero: int) -> np.ndarray:
+  """
+  Probabilities of measuring |x>_out|0>_zero_qubits, indexed by x, in a state vector ordered by _readout_order, followed
+  by the probability of failing the post-selection.
+  """
+  care = np.sum(np.abs(state.reshape(2**num_out, 2**num_zero, -1)[:, 0, :])**2, axis=1)
+  distribution = np.append(care, max(1 - np.sum(care), 0))
+  return distribution/np.sum(distribution)
+
+def _state_sampled_amplitudes(state: np.ndarray, num_out: int, num_zero: int, repetitions: int = 5000) -> np.ndarray:
+  """
+  Draw 'repetitions' shots of measure(*out, *zero_qubits) from a state vector ordered by _readout_order and rebuild
+  the amplitudes from the post-selected ones, as the sampled get_output does from a histogram.
+  """
+  counts = np.random.default_rng().multinomial(repetitions, _care_distribution(state, num_out, num_zero))[:-1]
+  return np.sqrt(counts/np.sum(counts))
+
+def _amplitude_error(counts: np.ndarray, num_shots: int, metric: str = "amplitude") -> float:
+  """
+  Estimated error of the amplitudes sqrt(counts/num_shots) of a post-selected histogram.
+
+  :param metric: "amplitude" for the largest standard error over x, sqrt((1-p)/(4N)) by the delta method on sqrt(p),
+                 or "tv" for the total variation error 1/2 sum_x sqrt(p(1-p)/N) of the distribution
+  """
+  if num_shots == 0:
+    return np.inf
+  p = counts/num_shots
+  if metric == "amplitude":
+    return float(np.max(np.sqrt((1-p)/(4*num_shots))))
+  elif metric == "tv":
+    return float(0.5*np.sum(np.sqrt(p*(1-p)/num_shots)))
+  raise ValueError("Unknown error metric {}".format(metric))
+
+def _adaptive_amplitudes(circuit: cirq.Circuit, out: list, zero_qubits: list, target_error: float,
+                         max_shots: int = 100000, chunk_size: int = 1000, metric: str = "amplitude",
+                         seed: int = None) -> tuple:
+  """
+  Sample measure(*out, *zero_qubits) in chunks of 'chunk_size' shots and accumulate the histogram of the post-selected
+  shots until the estimated amplitude error (see _amplitude_error) is below 'target_error' or 'max_shots' shots are
+  drawn. The circuit is simulated once and the chunks are drawn from its final state (see _final_state).
+
+  :return: (normalized amplitudes indexed by x, dict with the number of 'shots', of 'post_selected' shots,
+           the achieved 'error' and whether it 'converged' below target_error)
+  """
+  num_out, num_zero = len(out), len(zero_qubits)
+  rng = np.random.default_rng(seed)
+  # the last outcome gathers every shot failing the post-selection
+  distribution = _care_distribution(_final_state(circuit, out, zero_qubits), num_out, num_zero)
+
+  def draw(num_shots):
+    return rng.multinomial(num_shots, distribution)[:-1]
+
+  counts = np.zeros(2**num_out, dtype=np.int64)
+  shots, error = 0, np.inf
+  while shots < max_shots:
+    num_shots = min(chunk_size, max_shots - shots)
+    counts += draw(num_shots)
+    shots += num_shots
+    error = _amplitude_error(counts, int(np.sum(counts)), metric)
+    if error <= target_error:
+      break
+
+  post_selected = int(np.sum(counts))
+  amplitude = np.sqrt(counts/post_selected) if post_selected > 0 else np.zeros(2**num_out)
+  return amplitude, {"shots": shots, "post_selected": post_selected, "error": error,
+                     "converged": bool(error <= target_error)}
+
+def _output_sweep(circuit: cirq.Circuit, out: list, zero_qubits: list, input_data_batch: list,
+                  exact: bool = False, repetitions: int = 5000) -> list:
+  """
+  Resolve the symbolic data oracle of 'circuit' with every table in 'input_data_batch' and simulate all of them
+  in one simulate_sweep (exact, or sampling with mid-circuit measurements) or run_sweep (sampling) call.
+
+  :return: list with one readout per table, in the format of get_exact_output when exact, of get_output otherwise
+  """
+  if not cirq.is_parameterized(circuit):
+    raise ValueError("The circuit has no data symbols, build the model with symbolic_data=True")
+  resolvers = [data_resolver(input_data) for input_data in input_data_batch]
+  if exact:
+    results = cirq.Simulator().simulate_sweep(circuit, params=resolvers,
+                                              qubit_order=_readout_order(circuit, out, zero_qubits))
+    return [_post_select(result.final_state_vector, len(out), len(zero_qubits)) for result in results]
+  if circuit.has_measurements():
+    # one trajectory per table instead of one per shot (see _final_state)
+    results = cirq.Simulator().simulate_sweep(circuit, params=resolvers,
+                                              qubit_order=_readout_order(circuit, out, zero_qubits))
+    return [_state_sampled_amplitudes(result.final_state_vector, len(out), len(zero_qubits), repetitions)
+            for result in results]
+
+  measured_circuit = circuit + cirq.Circuit(cirq.measure(*(out+zero_qubits), key="result"))
+  results = cirq.Simulator().run_sweep(measured_circuit, params=resolvers, repetitions=repetitions)
+  return [_histogram_amplitudes(result.histogram(key="result"), len(out), len(zero_qubits)) for result in results]
+
+def _data_uncompute(model) -> cirq.Circuit:
+  """
+  Oracle appended at the end of construct_circuit to uncompute the data register. It is never inverted, so a QROM
+  loader built from input_data can be re-emitted with measurement-based uncomputation of its AND ancillae.
+  """
+  if model.measurement_uncompute and model.oracle == "qrom" and (model.input_data is not None or model.symbolic_data):
+    return qrom_oracle(model.data_table(), model.out, model.data, measurement_uncompute=True, pool=model.pool)
+  return model.blackbox
+
+def _append_iterations(circuit: CircuitBuilder, iterate: cirq.Circuit, num_iteration: int, compact: bool) -> None:
+  """
+  Append 'num_iteration' rounds of the amplitude amplification iterate to 'circuit'.
+  With compact=True the iterate is frozen once into a cirq.CircuitOperation applied with repetitions=num_iteration,
+  so the circuit size does not grow with the number of iterations.
+  """
+  if compact:
+    if num_iteration > 0:
+      circuit.append(cirq.CircuitOperation(iterate.freeze(), repetitions=num_iteration), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+  else:
+    for i in range(num_iteration):
+      circuit.append(iterate, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+def _chebyshev(L: int, lower_bound: float) -> float:
+  # T_L(1/sqrt(1-w)) >= 1/delta guarantees a success probability of at least 1 - delta^2 for all lambda >= w
+  return np.cosh(L*np.arccosh(1/np.sqrt(1-lower_bound)))
+
+def _fixed_point_iterations(delta: float, lower_bound: float) -> int:
+  # shortest fixed-point sequence (L = 2*num_iteration+1 queries) reaching 'delta' for 'lower_bound'
+  num_iteration = 0
+  while _chebyshev(2*num_iteration+1, lower_bound) < 1/delta:
+    num_iteration += 1
+  return num_iteration
+
+def _good_state_model(num_out_qubits: int, num_data_qubits: int, black_box: dict = None,
+                      measurement_uncompute: bool = False) -> tuple:
+  """
+  Resources of the good state preparation (black box, then comparison of ref and data with its uncompute) and of the
+  final data uncompute, see the resource_model methods of the BlackBox models.
+
+  :return: (good state preparation, data uncompute)
+  """
+  if black_box is None:
+    # QROM of a dense table: 2(2^n-2) Toffolis, 2^n-2 with the measurement-based final uncompute, n-1 ancillae
+    black_box = resources(toffoli=2*(2**num_out_qubits-2), toffoli_depth=2*(2**num_out_qubits-2),
+                          ancillae=num_out_qubits-1)
+    uncompute = resources(toffoli=2**num_out_qubits-2, toffoli_depth=2**num_out_qubits-2,
+                          ancillae=num_out_qubits-1) if measurement_uncompute else black_box
+  else:
+    uncompute = black_box
+  comparison = Comparator.resource_model(num_data_qubits, measurement_uncompute=measurement_uncompute, uncompute=True)
+  return sequence(black_box, comparison), uncompute
+
+def _algorithm_model(num_out_qubits: int, num_data_qubits: int, blocks: list, extra_qubits: int = 0) -> dict:
+  # whole circuit: out, data, ref, flag (and 'extra_qubits') plus the peak of the pool ancillae of the blocks
+  total = sequence(*blocks)
+  total["qubits"] = num_out_qubits + 2*num_data_qubits + 1 + extra_qubits + total["ancillae"]
+  return total
 
 class BlackBoxRegularAA:
   """
@@ -30,22 +249,53 @@ class BlackBoxRegularAA:
     amplitude_amplification(num_iteration) -> cirq.Circuit
         Generates the amplitude amplification circuit based on the 'good' circuit.
     
-    construct_circuit() -> None
+    construct_circuit(num_iteration, compact=False) -> None
         Combine good_state_preparation and amplitude_amplification circuit
 
+    resource_model(num_out_qubits, num_data_qubits, num_iteration, black_box=None, ...) -> dict
+        Closed-form Toffoli count, Toffoli-depth and qubits of construct_circuit (static)
+
     get_output() -> List[float]
         Simulate results and get ampltiudes of the output state 
+
+    get_exact_output() -> (List[float], float)
+        Read the post-selected amplitudes and their probability from the final state vector
+
+    get_output_adaptive(target_error, ...) -> (List[float], dict)
+        Sample until the amplitudes reach target_error and report the shots used
+
+    get_output_sweep(input_data_batch, exact=False) -> List
+        Simulate the symbolic circuit for a batch of input_data
   """
-  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None)-> None:
+  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None,
+               symbolic_data: bool = False, oracle: str = "qrom", measurement_uncompute: bool = False,
+               pool: AncillaPool = None)-> None:
     """
     :param num_out_qubits: number of qubits for output register
     :param num_data_qubits: number of qubits to estimate the output data from the oracle
     :param input_data: if 'black_box' is None, user can direct input the list of amplitudes as 'input_data'
     :param black_box: the oracle to generate the output data.
+    :param symbolic_data: if True (and 'black_box' is None), the data oracle is built with one sympy symbol per data bit
+                          so the same circuit can be resolved for many 'input_data' (see get_output_sweep)
+    :param oracle: data loader for 'input_data': "qrom" (unary iteration), "sparse" (skips zero entries, groups equal
+                   words, Gray-code order) or "basis" (one controlled operation per entry)
+    :param measurement_uncompute: uncompute the comparators and the QROM ancillae of the final data uncompute with
+                                  X-basis measurements and classically controlled CZs instead of Toffolis (see
+                                  Comparator). The comparators become carry chains with fewer Toffolis but a
+                                  Toffoli-depth linear in num_data_qubits, deeper than the comparison tree with its
+                                  uncompute from 128 data qubits. The sampled readouts draw their shots from a
+                                  single simulation (the final state does not depend on the measurement outcomes)
+    :param pool: allocator of the comparator, data oracle and reflection ancillae, a new AncillaPool when None.
+                 A 'black_box' needing ancillae can be given the same pool so its qubits are reused as well
     """
     self.num_out_qubits = num_out_qubits
     self.num_data_qubits = num_data_qubits
     self.input_data = input_data
+    self.symbolic_data = symbolic_data
+    self.oracle = oracle
+    self.measurement_uncompute = measurement_uncompute
+    self.pool = pool if pool is not None else AncillaPool()
+    self.blackbox = None
     
     self.out = [cirq.NamedQubit('out' + str(i)) for i in range(num_out_qubits)]
     self.data = [cirq.NamedQubit('data' + str(i)) for i in range(num_data_qubits)]
@@ -55,36 +305,20 @@ class BlackBoxRegularAA:
         # if there is input blackbox, directly apply the oracle on out and data registers
         self.blackbox = black_box(self.out, self.data)
 
+  @profiled
   def good_state_preparation(self,) -> cirq.Circuit:
     """
     Generate the good state at |0>_ref|0>-flag.
     Implement Eq.(7) in the paper 
     """
-    circuit = cirq.Circuit()
+    circuit = CircuitBuilder()
 
     # intializer
     for i in range(self.num_out_qubits):
       circuit.append(cirq.H(self.out[i]))
     if self.blackbox is None:
       # if there is no input blackbox, apply simple basis encoding for input_data
-      def ai_to_gate(ai):
-        circ = cirq.Circuit()
-        for i, val in enumerate(ai):
-          if val == '1':
-            circ.append(cirq.X(self.data[self.num_data_qubits-1-i]))
-        return circ
-
-      def oracle(A, d, n):
-          """ Loads the data array onto the circuit, controlled by register out as index. """
-          oracle = cirq.Circuit()
-          for i in range(2**d):
-              circ_ai = ai_to_gate(A[i])
-              circ_ai_to_op = cirq.CircuitOperation(circ_ai.freeze())
-              ai_encode_gate = circ_ai_to_op.controlled_by(*self.out, control_values=[int(k) for k in format(i, "b").zfill(self.num_out_qubits)])
-              oracle.append(ai_encode_gate)
-          return oracle 
-      # Apply blackbox
-      self.blackbox = oracle(self.input_data, self.num_out_qubits, self.num_data_qubits)
+      self.blackbox = data_oracle(self.data_table(), self.out, self.data, method=self.oracle, pool=self.pool)
       circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     else:
       circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
@@ -94,45 +328,49 @@ class BlackBoxRegularAA:
       circuit.append(cirq.H(self.ref[i]))
     
     # compare ref to data
-    comparator = Comparator(self.ref, self.data)
+    comparator = Comparator(self.ref, self.data, pool=self.pool, measurement_uncompute=self.measurement_uncompute)
     compare_circ = comparator.construct_circuit()
 
-    circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    circuit.append(cirq.X(comparator.anc1))
-    circuit.append(cirq.CNOT(comparator.anc1, self.flag))
-    circuit.append(cirq.X(comparator.anc1))
+    test = CircuitBuilder()
+    test.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    test.append(cirq.X(comparator.anc1))
+    test.append(cirq.CNOT(comparator.anc1, self.flag))
+    test.append(cirq.X(comparator.anc1))
 
     # uncompute comparator
-    inv_compare = cirq.inverse(compare_circ)
-    circuit.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    inv_compare = comparator.inverse_circuit()
+    test.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    comparator.release()
+    circuit.append(comparator.test_block(test.to_circuit()), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
     # unprepare superposition from ref
     for i in range(self.num_data_qubits):
       circuit.append(cirq.H(self.ref[i]))
 
-    return circuit
+    return circuit.to_circuit()
 
-  def amplitude_amplification(self, num_iteration: int) -> cirq.Circuit:
+  @profiled
+  def amplitude_amplification(self, num_iteration: int, compact: bool = False) -> cirq.Circuit:
 
     #define components
     def phase_oracle() -> cirq.Circuit:
       """
       Negate the amplitude with |0>_ref |0>_flag
       """
-      circ = cirq.Circuit()
+      circ = CircuitBuilder()
       circ.append(cirq.X(self.flag))
       circ.append(cirq.H(self.flag)) # on flag
       circ.append(cirq.XPowGate().controlled(self.num_data_qubits, control_values=[0]*self.num_data_qubits).on(*self.ref, self.flag))
       circ.append(cirq.H(self.flag)) # on flag
       circ.append(cirq.X(self.flag))
-      return circ
+      return circ.to_circuit()
 
     def zero_reflection(qubits: list) -> cirq.Circuit:
       """
       Reflect zero state. 
       Implement I - 2|0><0| over all qubits
       """
-      circ = cirq.Circuit()
+      circ = CircuitBuilder()
       for i in range(len(qubits)):
         circ.append(cirq.X(qubits[i]))
 
@@ -143,33 +381,91 @@ class BlackBoxRegularAA:
       for i in range(len(qubits)):
         circ.append(cirq.X(qubits[i]))
       
-      return circ
+      return circ.to_circuit()
 
-    circ = cirq.Circuit()
+    circ = CircuitBuilder()
     oracle = phase_oracle()
     good_state_preparation = self.good_state_preparation()
     reflection = zero_reflection(self.out+self.data+self.ref+[self.flag])
     
     
+    iterate = CircuitBuilder()
+    iterate.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(invert_circuit(good_state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(reflection, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
     circ.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    for i in range(num_iteration):
-      circ.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(cirq.inverse(good_state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(reflection, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    _append_iterations(circ, iterate.to_circuit(), num_iteration, compact)
     
-    return circ
+    return circ.to_circuit()
   
-  def construct_circuit(self,num_iteration: int) -> None:
-    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration) # math.floor(np.sqrt(2**self.num_data_qubits))
+  @profiled
+  def construct_circuit(self,num_iteration: int, compact: bool = False) -> None:
+    """
+    :param num_iteration: number of amplitude amplification rounds
+    :param compact: if True, the rounds are one cirq.CircuitOperation with repetitions=num_iteration
+    """
+    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration, compact=compact) # math.floor(np.sqrt(2**self.num_data_qubits))
     # uncompute data
-    self.output_circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    self.output_circuit.append(_data_uncompute(self), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+  @staticmethod
+  def resource_model(num_out_qubits: int, num_data_qubits: int, num_iteration: int, black_box: dict = None,
+                     measurement_uncompute: bool = False) -> dict:
+    """
+    Closed-form resources of construct_circuit: the good state preparation G, num_iteration rounds of the phase
+    oracle (X with d controls), G^-1, the zero reflection (X with n+2d controls) and G, then the data uncompute.
+
+    :param num_out_qubits: number of qubits for output register
+    :param num_data_qubits: number of qubits to estimate the output data from the oracle
+    :param num_iteration: number of amplitude amplification rounds
+    :param black_box: resources of the black box (utils.resource_model dict, e.g. Squarer.resource_model), its
+                      ancillae being taken from the pool of the model. None for the QROM of a dense 'input_data'
+                      table (an upper bound for tables with zero entries)
+    :param measurement_uncompute: see __init__
+    :return: dict with the 'toffoli' count, 'toffoli_depth', 'qubits' and pool 'ancillae' (see utils.resource_model)
+    """
+    good_state, uncompute = _good_state_model(num_out_qubits, num_data_qubits, black_box, measurement_uncompute)
+    oracle = resources(toffoli=mcx_toffolis(num_data_qubits), toffoli_depth=mcx_toffolis(num_data_qubits))
+    reflection = resources(toffoli=mcx_toffolis(num_out_qubits+2*num_data_qubits),
+                           toffoli_depth=mcx_toffolis(num_out_qubits+2*num_data_qubits))
+    iterate = sequence(oracle, good_state, reflection, good_state)
+    return _algorithm_model(num_out_qubits, num_data_qubits, [good_state, repeat(iterate, num_iteration), uncompute])
+
+  def data_table(self) -> list:
+    """
+    Table loaded by the data oracle when 'black_box' is None: 'input_data', or one symbol per data bit
+    when the model is built with symbolic_data=True
+    """
+    if self.symbolic_data:
+      return symbolic_data(2**self.num_out_qubits, self.num_data_qubits)
+    return self.input_data
+
+  @profiled
+  def get_output_sweep(self, input_data_batch: list, exact: bool = False) -> list:
+    """
+    Run the compiled circuit (symbolic_data=True, after construct_circuit) for every table in 'input_data_batch'
+    in a single sweep instead of rebuilding the circuit per table.
+
+    :param input_data_batch: list of 'input_data' tables
+    :param exact: if True, every table is read as by get_exact_output, otherwise as by get_output
+    :return: list of readouts, one per table
+    """
+    return _output_sweep(self.output_circuit, self.out, self.ref+[self.flag], input_data_batch, exact=exact)
 
+  @profiled
   def get_output(self) -> list:
+    if self.output_circuit.has_measurements():
+      # measurement_uncompute: sample one simulated final state instead of simulating every shot
+      return _state_sampled_amplitudes(_final_state(self.output_circuit, self.out, self.ref+[self.flag]), self.num_out_qubits,
+                                       len(self.ref+[self.flag]))
+
     # measurement
-    self.output_circuit.append(cirq.measure(*(self.out+self.ref+[self.flag]), key="result"))
+    # measure a copy, output_circuit stays free of terminal measurements for the other readouts
+    measured_circuit = self.output_circuit + cirq.Circuit(cirq.measure(*(self.out+self.ref+[self.flag]), key="result"))
     s = cirq.Simulator()
-    samples = s.run(self.output_circuit, repetitions=5000)
+    samples = s.run(measured_circuit, repetitions=5000)
     results = samples.histogram(key="result")
     care_results = []
     for i in range(2**self.num_out_qubits):
@@ -181,6 +477,29 @@ class BlackBoxRegularAA:
     amplitude = np.sqrt(np.array(care_results)/(sum(care_results)))
     
     return amplitude
+
+  @profiled
+  def get_exact_output(self) -> tuple:
+    """
+    Simulate the final state once and read the post-selected amplitudes directly from the state vector
+    instead of sampling 5000 shots
+
+    :return: (signed amplitudes of the output state, post-selection probability)
+    """
+    return _post_selected_amplitudes(self.output_circuit, self.out, self.ref+[self.flag])
+
+  @profiled
+  def get_output_adaptive(self, target_error: float, max_shots: int = 100000, chunk_size: int = 1000,
+                          error_metric: str = "amplitude") -> tuple:
+    """
+    Sample in chunks of 'chunk_size' shots until the estimated error of the amplitudes ('error_metric': "amplitude"
+    or "tv") is below target_error or 'max_shots' shots are drawn
+
+    :return: (amplitudes of the output state, sampling report with the number of 'shots', of 'post_selected' shots,
+             the achieved 'error' and whether it 'converged')
+    """
+    return _adaptive_amplitudes(self.output_circuit, self.out, self.ref+[self.flag], target_error, max_shots=max_shots,
+                                chunk_size=chunk_size, metric=error_metric)
   
 
 
@@ -211,23 +530,54 @@ class BlackBoxObliviousAA:
     amplitude_amplification(num_iteration) -> cirq.Circuit
         Generates the amplitude amplification circuit based on the 'good' circuit.
     
-    construct_circuit() -> None
+    construct_circuit(num_iteration, compact=False) -> None
         Combine good_state_preparation and amplitude_amplification circuit
 
+    resource_model(num_out_qubits, num_data_qubits, num_iteration, black_box=None, ...) -> dict
+        Closed-form Toffoli count, Toffoli-depth and qubits of construct_circuit (static)
+
     get_output() -> List[float]
         Simulate results and get ampltiudes of the output state 
+
+    get_exact_output() -> (List[float], float)
+        Read the post-selected amplitudes and their probability from the final state vector
+
+    get_output_adaptive(target_error, ...) -> (List[float], dict)
+        Sample until the amplitudes reach target_error and report the shots used
+
+    get_output_sweep(input_data_batch, exact=False) -> List
+        Simulate the symbolic circuit for a batch of input_data
   """
-  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None)-> None:
+  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None,
+               symbolic_data: bool = False, oracle: str = "qrom", measurement_uncompute: bool = False,
+               pool: AncillaPool = None)-> None:
     """
     :param num_out_qubits: number of qubits for output register
     :param num_data_qubits: number of qubits to estimate the output data from the oracle
     :param input_data: if 'black_box' is None, user can direct input the list of amplitudes as 'input_data'
     :param black_box: the oracle to generate the output data.
+    :param symbolic_data: if True (and 'black_box' is None), the data oracle is built with one sympy symbol per data bit
+                          so the same circuit can be resolved for many 'input_data' (see get_output_sweep)
+    :param oracle: data loader for 'input_data': "qrom" (unary iteration), "sparse" (skips zero entries, groups equal
+                   words, Gray-code order) or "basis" (one controlled operation per entry)
+    :param measurement_uncompute: uncompute the comparators and the QROM ancillae of the final data uncompute with
+                                  X-basis measurements and classically controlled CZs instead of Toffolis (see
+                                  Comparator). The comparators become carry chains with fewer Toffolis but a
+                                  Toffoli-depth linear in num_data_qubits, deeper than the comparison tree with its
+                                  uncompute from 128 data qubits. The sampled readouts draw their shots from a
+                                  single simulation (the final state does not depend on the measurement outcomes)
+    :param pool: allocator of the comparator, data oracle and reflection ancillae, a new AncillaPool when None.
+                 A 'black_box' needing ancillae can be given the same pool so its qubits are reused as well
     """
 
     self.num_out_qubits = num_out_qubits
     self.num_data_qubits = num_data_qubits
     self.input_data = input_data
+    self.symbolic_data = symbolic_data
+    self.oracle = oracle
+    self.measurement_uncompute = measurement_uncompute
+    self.pool = pool if pool is not None else AncillaPool()
+    self.blackbox = None
     
     self.out = [cirq.NamedQubit('out' + str(i)) for i in range(num_out_qubits)]
     self.data = [cirq.NamedQubit('data' + str(i)) for i in range(num_data_qubits)]
@@ -237,36 +587,20 @@ class BlackBoxObliviousAA:
         # if there is input blackbox, directly apply the oracle on out and data registers
         self.blackbox = black_box(self.out, self.data)
 
+  @profiled
   def good_state_preparation(self,)-> cirq.Circuit:
     """
     Generate the good state at |0>_ref|0>_flag.
     Implement Eq.(7) in the paper 
     """
-    circuit = cirq.Circuit()
+    circuit = CircuitBuilder()
 
     # intializer
     for i in range(self.num_out_qubits):
       circuit.append(cirq.H(self.out[i]))
     if self.blackbox is None:
       # if there is no input blackbox, apply simple basis encoding for input_data
-      def ai_to_gate(ai):
-        circ = cirq.Circuit()
-        for i, val in enumerate(ai):
-          if val == '1':
-            circ.append(cirq.X(self.data[self.num_data_qubits-1-i]))
-        return circ
-
-      def oracle(A, d, n):
-          """ Loads the data array onto the circuit, controlled by register out as index. """
-          oracle = cirq.Circuit()
-          for i in range(2**d):
-              circ_ai = ai_to_gate(A[i])
-              circ_ai_to_op = cirq.CircuitOperation(circ_ai.freeze())
-              ai_encode_gate = circ_ai_to_op.controlled_by(*self.out, control_values=[int(k) for k in format(i, "b").zfill(self.num_out_qubits)])
-              oracle.append(ai_encode_gate)
-          return oracle 
-      # Apply blackbox
-      self.blackbox = oracle(self.input_data, self.num_out_qubits, self.num_data_qubits)
+      self.blackbox = data_oracle(self.data_table(), self.out, self.data, method=self.oracle, pool=self.pool)
       circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     else:
 
@@ -276,66 +610,127 @@ class BlackBoxObliviousAA:
     for i in range(self.num_data_qubits):
       circuit.append(cirq.H(self.ref[i]))
     # compare ref to data
-    comparator = Comparator(self.ref, self.data)
+    comparator = Comparator(self.ref, self.data, pool=self.pool, measurement_uncompute=self.measurement_uncompute)
     compare_circ = comparator.construct_circuit()
 
-    circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    circuit.append(cirq.X(comparator.anc1))
-    circuit.append(cirq.CNOT(comparator.anc1, self.flag))
-    circuit.append(cirq.X(comparator.anc1))
+    test = CircuitBuilder()
+    test.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    test.append(cirq.X(comparator.anc1))
+    test.append(cirq.CNOT(comparator.anc1, self.flag))
+    test.append(cirq.X(comparator.anc1))
 
     # uncompute comparator
-    inv_compare = cirq.inverse(compare_circ)
-    circuit.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    inv_compare = comparator.inverse_circuit()
+    test.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    comparator.release()
+    circuit.append(comparator.test_block(test.to_circuit()), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
     # unprepare superposition from ref
     for i in range(self.num_data_qubits):
       circuit.append(cirq.H(self.ref[i]))
 
-    return circuit
+    return circuit.to_circuit()
 
-  def amplitude_amplification(self, num_iteration):
+  @profiled
+  def amplitude_amplification(self, num_iteration, compact: bool = False):
 
 
     def zero_reflection():
       '''
       This oracle phase flip the state of |0>_ref|0>_flag
       '''
-      circ = cirq.Circuit()
-      anc = cirq.NamedQubit('phase_oracle_ancilla')
+      circ = CircuitBuilder()
+      anc = self.pool.allocate(1)[0]
       circ.append(cirq.X(anc))
       circ.append(cirq.H(anc))
       circ.append(cirq.XPowGate().controlled(self.num_data_qubits+1, 
                                              control_values=[0]*(self.num_data_qubits+1)).on(*self.ref, self.flag, anc))
       circ.append(cirq.H(anc))
       circ.append(cirq.X(anc))
-      return circ
+      self.pool.free([anc])
+      return circ.to_circuit()
 
     
-    circ = cirq.Circuit()
+    circ = CircuitBuilder()
     good_state_preparation = self.good_state_preparation()
     reflection = zero_reflection()
 
     
+    iterate = CircuitBuilder()
+    iterate.append(invert_circuit(good_state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(reflection, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(reflection, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
     circ.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    for i in range(num_iteration):
-      
-      circ.append(cirq.inverse(good_state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(reflection, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(reflection, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    return circ
+    _append_iterations(circ, iterate.to_circuit(), num_iteration, compact)
+    return circ.to_circuit()
   
-  def construct_circuit(self,num_iteration:int) -> None:
-    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration) # math.floor(np.sqrt(2**self.num_data_qubits))
+  @profiled
+  def construct_circuit(self,num_iteration:int, compact: bool = False) -> None:
+    """
+    :param num_iteration: number of amplitude amplification rounds
+    :param compact: if True, the rounds are one cirq.CircuitOperation with repetitions=num_iteration
+    """
+    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration, compact=compact) # math.floor(np.sqrt(2**self.num_data_qubits))
     # uncompute data
-    self.output_circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    self.output_circuit.append(_data_uncompute(self), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+  @staticmethod
+  def resource_model(num_out_qubits: int, num_data_qubits: int, num_iteration: int, black_box: dict = None,
+                     measurement_uncompute: bool = False) -> dict:
+    """
+    Closed-form resources of construct_circuit: the good state preparation G, num_iteration rounds of G^-1, the
+    reflection (X with d+1 controls on a pool ancilla), G and the reflection, then the data uncompute.
+
+    :param num_out_qubits: number of qubits for output register
+    :param num_data_qubits: number of qubits to estimate the output data from the oracle
+    :param num_iteration: number of amplitude amplification rounds
+    :param black_box: resources of the black box (utils.resource_model dict, e.g. Squarer.resource_model), its
+                      ancillae being taken from the pool of the model. None for the QROM of a dense 'input_data'
+                      table (an upper bound for tables with zero entries)
+    :param measurement_uncompute: see __init__
+    :return: dict with the 'toffoli' count, 'toffoli_depth', 'qubits' and pool 'ancillae' (see utils.resource_model)
+    """
+    good_state, uncompute = _good_state_model(num_out_qubits, num_data_qubits, black_box, measurement_uncompute)
+    reflection = resources(toffoli=mcx_toffolis(num_data_qubits+1), toffoli_depth=mcx_toffolis(num_data_qubits+1),
+                           ancillae=1)
+    iterate = sequence(good_state, reflection, good_state, reflection)
+    return _algorithm_model(num_out_qubits, num_data_qubits, [good_state, repeat(iterate, num_iteration), uncompute])
+
+  def data_table(self) -> list:
+    """
+    Table loaded by the data oracle when 'black_box' is None: 'input_data', or one symbol per data bit
+    when the model is built with symbolic_data=True
+    """
+    if self.symbolic_data:
+      return symbolic_data(2**self.num_out_qubits, self.num_data_qubits)
+    return self.input_data
+
+  @profiled
+  def get_output_sweep(self, input_data_batch: list, exact: bool = False) -> list:
+    """
+    Run the compiled circuit (symbolic_data=True, after construct_circuit) for every table in 'input_data_batch'
+    in a single sweep instead of rebuilding the circuit per table.
 
+    :param input_data_batch: list of 'input_data' tables
+    :param exact: if True, every table is read as by get_exact_output, otherwise as by get_output
+    :return: list of readouts, one per table
+    """
+    return _output_sweep(self.output_circuit, self.out, self.ref+[self.flag], input_data_batch, exact=exact)
+
+  @profiled
   def get_output(self) -> list:
+    if self.output_circuit.has_measurements():
+      # measurement_uncompute: sample one simulated final state instead of simulating every shot
+      return _state_sampled_amplitudes(_final_state(self.output_circuit, self.out, self.ref+[self.flag]), self.num_out_qubits,
+                                       len(self.ref+[self.flag]))
+
     # measurement
-    self.output_circuit.append(cirq.measure(*(self.out+self.ref+[self.flag]), key="result"))
+    # measure a copy, output_circuit stays free of terminal measurements for the other readouts
+    measured_circuit = self.output_circuit + cirq.Circuit(cirq.measure(*(self.out+self.ref+[self.flag]), key="result"))
     s = cirq.Simulator()
-    samples = s.run(self.output_circuit, repetitions=5000)
+    samples = s.run(measured_circuit, repetitions=5000)
     results = samples.histogram(key="result")
     care_results = []
     for i in range(2**self.num_out_qubits):
@@ -348,6 +743,29 @@ class BlackBoxObliviousAA:
     
     return amplitude
 
+  @profiled
+  def get_exact_output(self) -> tuple:
+    """
+    Simulate the final state once and read the post-selected amplitudes directly from the state vector
+    instead of sampling 5000 shots
+
+    :return: (signed amplitudes of the output state, post-selection probability)
+    """
+    return _post_selected_amplitudes(self.output_circuit, self.out, self.ref+[self.flag])
+
+  @profiled
+  def get_output_adaptive(self, target_error: float, max_shots: int = 100000, chunk_size: int = 1000,
+                          error_metric: str = "amplitude") -> tuple:
+    """
+    Sample in chunks of 'chunk_size' shots until the estimated error of the amplitudes ('error_metric': "amplitude"
+    or "tv") is below target_error or 'max_shots' shots are drawn
+
+    :return: (amplitudes of the output state, sampling report with the number of 'shots', of 'post_selected' shots,
+             the achieved 'error' and whether it 'converged')
+    """
+    return _adaptive_amplitudes(self.output_circuit, self.out, self.ref+[self.flag], target_error, max_shots=max_shots,
+                                chunk_size=chunk_size, metric=error_metric)
+
 
 
 class BlackBoxSquareRoot:
@@ -375,23 +793,54 @@ class BlackBoxSquareRoot:
     amplitude_amplification(num_iteration) -> cirq.Circuit
         Generates the amplitude amplification circuit based on the 'good' circuit.
     
-    construct_circuit() -> None
+    construct_circuit(num_iteration, compact=False) -> None
         Combine good_state_preparation and amplitude_amplification circuit
 
+    resource_model(num_out_qubits, num_data_qubits, num_iteration, black_box=None, ...) -> dict
+        Closed-form Toffoli count, Toffoli-depth and qubits of construct_circuit (static)
+
     get_output() -> List[float]
         Simulate results and get ampltiudes of the output state 
+
+    get_exact_output() -> (List[float], float)
+        Read the post-selected amplitudes and their probability from the final state vector
+
+    get_output_adaptive(target_error, ...) -> (List[float], dict)
+        Sample until the amplitudes reach target_error and report the shots used
+
+    get_output_sweep(input_data_batch, exact=False) -> List
+        Simulate the symbolic circuit for a batch of input_data
   """
-  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None)-> None:
+  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None,
+               symbolic_data: bool = False, oracle: str = "qrom", measurement_uncompute: bool = False,
+               pool: AncillaPool = None)-> None:
     """
     :param num_out_qubits: number of qubits for output register
     :param num_data_qubits: number of qubits to estimate the output data from the oracle
     :param input_data: if 'black_box' is None, user can direct input the list of amplitudes as 'input_data'
     :param black_box: the oracle to generate the output data.
+    :param symbolic_data: if True (and 'black_box' is None), the data oracle is built with one sympy symbol per data bit
+                          so the same circuit can be resolved for many 'input_data' (see get_output_sweep)
+    :param oracle: data loader for 'input_data': "qrom" (unary iteration), "sparse" (skips zero entries, groups equal
+                   words, Gray-code order) or "basis" (one controlled operation per entry)
+    :param measurement_uncompute: uncompute the comparators and the QROM ancillae of the final data uncompute with
+                                  X-basis measurements and classically controlled CZs instead of Toffolis (see
+                                  Comparator). The comparators become carry chains with fewer Toffolis but a
+                                  Toffoli-depth linear in num_data_qubits, deeper than the comparison tree with its
+                                  uncompute from 128 data qubits. The sampled readouts draw their shots from a
+                                  single simulation (the final state does not depend on the measurement outcomes)
+    :param pool: allocator of the comparator, data oracle and reflection ancillae, a new AncillaPool when None.
+                 A 'black_box' needing ancillae can be given the same pool so its qubits are reused as well
     """
 
     self.num_out_qubits = num_out_qubits
     self.num_data_qubits = num_data_qubits
     self.input_data = input_data
+    self.symbolic_data = symbolic_data
+    self.oracle = oracle
+    self.measurement_uncompute = measurement_uncompute
+    self.pool = pool if pool is not None else AncillaPool()
+    self.blackbox = None
     
     self.out = [cirq.NamedQubit('out' + str(i)) for i in range(num_out_qubits)]
     self.data = [cirq.NamedQubit('data' + str(i)) for i in range(num_data_qubits)]
@@ -401,33 +850,17 @@ class BlackBoxSquareRoot:
         # if there is input blackbox, directly apply the oracle on out and data registers
         self.blackbox = black_box(self.out, self.data)
 
+  @profiled
   def good_state_preparation(self,)-> cirq.Circuit:
 
-    circuit = cirq.Circuit()
+    circuit = CircuitBuilder()
 
     # intializer
     for i in range(self.num_out_qubits):
       circuit.append(cirq.H(self.out[i]))
     if self.blackbox is None:
       # if there is no input blackbox, apply simple basis encoding for input_data
-      def ai_to_gate(ai):
-        circ = cirq.Circuit()
-        for i, val in enumerate(ai):
-          if val == '1':
-            circ.append(cirq.X(self.data[self.num_data_qubits-1-i]))
-        return circ
-
-      def oracle(A, d, n):
-          """ Loads the data array onto the circuit, controlled by register out as index. """
-          oracle = cirq.Circuit()
-          for i in range(2**d):
-              circ_ai = ai_to_gate(A[i])
-              circ_ai_to_op = cirq.CircuitOperation(circ_ai.freeze())
-              ai_encode_gate = circ_ai_to_op.controlled_by(*self.out, control_values=[int(k) for k in format(i, "b").zfill(self.num_out_qubits)])
-              oracle.append(ai_encode_gate)
-          return oracle 
-      # Apply blackbox
-      self.blackbox = oracle(self.input_data, self.num_out_qubits, self.num_data_qubits)
+      self.blackbox = data_oracle(self.data_table(), self.out, self.data, method=self.oracle, pool=self.pool)
       circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     else:
 
@@ -437,120 +870,185 @@ class BlackBoxSquareRoot:
     for i in range(self.num_data_qubits):
       circuit.append(cirq.H(self.ref[i]))
     # compare ref to data
-    comparator = Comparator(self.ref, self.data)
+    comparator = Comparator(self.ref, self.data, pool=self.pool, measurement_uncompute=self.measurement_uncompute)
     compare_circ = comparator.construct_circuit()
 
-    circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    circuit.append(cirq.X(comparator.anc1))
-    circuit.append(cirq.CNOT(comparator.anc1, self.flag))
-    circuit.append(cirq.X(comparator.anc1))
+    test = CircuitBuilder()
+    test.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    test.append(cirq.X(comparator.anc1))
+    test.append(cirq.CNOT(comparator.anc1, self.flag))
+    test.append(cirq.X(comparator.anc1))
 
     # uncompute comparator
-    inv_compare = cirq.inverse(compare_circ)
-    circuit.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    inv_compare = comparator.inverse_circuit()
+    test.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    comparator.release()
+    circuit.append(comparator.test_block(test.to_circuit()), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
-    return circuit
+    return circuit.to_circuit()
 
-  def unif(self) -> cirq.Circuit:
+  def unif(self, compact: bool = False) -> cirq.Circuit:
     """
     Approximate unif operation (Eq.8 in the paper) by unif' (Eq. 9):
     U: |lambda>_data |0>_ref --> 1/sqrt(lambda) |lambda>_data sum_{x=0}^{lambda-1}|0>_ref
     The circuit can be implemented by  n-controlled Hadamard gates followed by an application of Comparator. 
     It is finalized by ampltitude amplification to get close to Eq.8
     """
+    # holds the result of unif and is never uncomputed, so it is not borrowed from the pool
     unif_ancilla = cirq.NamedQubit('unif_anc')
     def state_unif():
-      circ = cirq.Circuit()
+      circ = CircuitBuilder()
       
       # apply controlled Hadamard gates
       for i in range(self.num_data_qubits):
         circ.append(cirq.HPowGate().controlled(1).on(self.data[i], self.ref[i]))
       # apply comparator
-      comparator = Comparator(self.ref, self.data)
+      comparator = Comparator(self.ref, self.data, pool=self.pool, measurement_uncompute=self.measurement_uncompute)
       compare_circ = comparator.construct_circuit()
 
-      circ.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(cirq.X(comparator.anc1))
-      circ.append(cirq.CNOT(comparator.anc1, unif_ancilla))
-      circ.append(cirq.X(comparator.anc1))
+      test = CircuitBuilder()
+      test.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      test.append(cirq.X(comparator.anc1))
+      test.append(cirq.CNOT(comparator.anc1, unif_ancilla))
+      test.append(cirq.X(comparator.anc1))
 
       # uncompute comparator
-      inv_compare = cirq.inverse(compare_circ)
-      circ.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      inv_compare = comparator.inverse_circuit()
+      test.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      comparator.release()
+      circ.append(comparator.test_block(test.to_circuit()), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
-      return circ
+      return circ.to_circuit()
     def unif_zero_reflection():
-      circ = cirq.Circuit()
+      circ = CircuitBuilder()
       circ.append(cirq.X(unif_ancilla))
       circ.append(cirq.H(unif_ancilla)) # on flag
       circ.append(cirq.X(unif_ancilla))
       circ.append(cirq.H(unif_ancilla)) # on flag
       circ.append(cirq.X(unif_ancilla))
-      return circ
+      return circ.to_circuit()
     
-    circ = cirq.Circuit()
+    circ = CircuitBuilder()
 
     state_preparation = state_unif()
     oracle = unif_zero_reflection()
 
     
     
+    iterate = CircuitBuilder()
+    iterate.append(invert_circuit(state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
     circ.append(state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     # for simple case number of iteration in AA of 2 is enough, can be changed for better understanding
-    for i in range(2): 
-      
-      circ.append(cirq.inverse(state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-
-      circ.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    _append_iterations(circ, iterate.to_circuit(), 2, compact)
     
-    return circ
+    return circ.to_circuit()
     
 
-  def amplitude_amplification(self, num_iteration:int ) -> cirq.Circuit:
+  @profiled
+  def amplitude_amplification(self, num_iteration:int, compact: bool = False) -> cirq.Circuit:
     """
     Use oblivious Amplitude Amplification
     """
 
     def zero_reflection():
-      circ = cirq.Circuit()
+      circ = CircuitBuilder()
       circ.append(cirq.X(self.flag))
       circ.append(cirq.H(self.flag)) # on flag
       circ.append(cirq.X(self.flag))
       circ.append(cirq.H(self.flag)) # on flag
       circ.append(cirq.X(self.flag))
-      return circ
+      return circ.to_circuit()
     
-    circ = cirq.Circuit()
+    circ = CircuitBuilder()
     state_preparation = self.good_state_preparation()
     oracle = zero_reflection()
 
     
     
+    iterate = CircuitBuilder()
+    iterate.append(invert_circuit(state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    iterate.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
     circ.append(state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    for i in range(num_iteration):
-      
-      circ.append(cirq.inverse(state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      circ.append(oracle, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    _append_iterations(circ, iterate.to_circuit(), num_iteration, compact)
     
-    return circ
+    return circ.to_circuit()
   
-  def construct_circuit(self,num_iteration:int) -> None:
-    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration) # math.floor(np.sqrt(2**self.num_data_qubits))
+  @profiled
+  def construct_circuit(self,num_iteration:int, compact: bool = False) -> None:
+    """
+    :param num_iteration: number of amplitude amplification rounds
+    :param compact: if True, the rounds (and those of unif) are cirq.CircuitOperations with repetitions
+    """
+    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration, compact=compact) # math.floor(np.sqrt(2**self.num_data_qubits))
     #apply inverse unif
-    unif_circuit = self.unif()
-    self.output_circuit.append(cirq.inverse(unif_circuit), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    unif_circuit = self.unif(compact=compact)
+    self.output_circuit.append(invert_circuit(unif_circuit), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     # uncompute data
-    self.output_circuit.append(self.blackbox, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    self.output_circuit.append(_data_uncompute(self), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+  @staticmethod
+  def resource_model(num_out_qubits: int, num_data_qubits: int, num_iteration: int, black_box: dict = None,
+                     measurement_uncompute: bool = False) -> dict:
+    """
+    Closed-form resources of construct_circuit: the good state preparation G and num_iteration rounds of G^-1 and G
+    (the flag reflections take no Toffoli), the inverse of unif (5 comparisons, the controlled Hadamards take no
+    Toffoli) and the data uncompute. unif_anc is one more qubit.
+
+    :param num_out_qubits: number of qubits for output register
+    :param num_data_qubits: number of qubits to estimate the output data from the oracle
+    :param num_iteration: number of amplitude amplification rounds
+    :param black_box: resources of the black box (utils.resource_model dict, e.g. Squarer.resource_model), its
+                      ancillae being taken from the pool of the model. None for the QROM of a dense 'input_data'
+                      table (an upper bound for tables with zero entries)
+    :param measurement_uncompute: see __init__
+    :return: dict with the 'toffoli' count, 'toffoli_depth', 'qubits' and pool 'ancillae' (see utils.resource_model)
+    """
+    good_state, uncompute = _good_state_model(num_out_qubits, num_data_qubits, black_box, measurement_uncompute)
+    unif = repeat(Comparator.resource_model(num_data_qubits, measurement_uncompute=measurement_uncompute,
+                                            uncompute=True), 5)
+    return _algorithm_model(num_out_qubits, num_data_qubits,
+                            [good_state, repeat(good_state, 2*num_iteration), unif, uncompute], extra_qubits=1)
+
+  def data_table(self) -> list:
+    """
+    Table loaded by the data oracle when 'black_box' is None: 'input_data', or one symbol per data bit
+    when the model is built with symbolic_data=True
+    """
+    if self.symbolic_data:
+      return symbolic_data(2**self.num_out_qubits, self.num_data_qubits)
+    return self.input_data
+
+  @profiled
+  def get_output_sweep(self, input_data_batch: list, exact: bool = False) -> list:
+    """
+    Run the compiled circuit (symbolic_data=True, after construct_circuit) for every table in 'input_data_batch'
+    in a single sweep instead of rebuilding the circuit per table.
+
+    :param input_data_batch: list of 'input_data' tables
+    :param exact: if True, every table is read as by get_exact_output, otherwise as by get_output
+    :return: list of readouts, one per table
+    """
+    return _output_sweep(self.output_circuit, self.out, [self.flag], input_data_batch, exact=exact)
 
+  @profiled
   def get_output(self) -> list:
+    if self.output_circuit.has_measurements():
+      # measurement_uncompute: sample one simulated final state instead of simulating every shot
+      return _state_sampled_amplitudes(_final_state(self.output_circuit, self.out, [self.flag]), self.num_out_qubits,
+                                       len([self.flag]))
+
     # measurement
-    self.output_circuit.append(cirq.measure(*(self.out+[self.flag]), key="result"))
+    # measure a copy, output_circuit stays free of terminal measurements for the other readouts
+    measured_circuit = self.output_circuit + cirq.Circuit(cirq.measure(*(self.out+[self.flag]), key="result"))
     s = cirq.Simulator()
-    samples = s.run(self.output_circuit, repetitions=5000)
+    samples = s.run(measured_circuit, repetitions=5000)
     results = samples.histogram(key="result")
     care_results = []
     for i in range(2**self.num_out_qubits):
@@ -563,3 +1061,210 @@ class BlackBoxSquareRoot:
     
     return amplitude
 
+  @profiled
+  def get_exact_output(self) -> tuple:
+    """
+    Simulate the final state once and read the post-selected amplitudes directly from the state vector
+    instead of sampling 5000 shots
+
+    :return: (signed amplitudes of the output state, post-selection probability)
+    """
+    return _post_selected_amplitudes(self.output_circuit, self.out, [self.flag])
+
+  @profiled
+  def get_output_adaptive(self, target_error: float, max_shots: int = 100000, chunk_size: int = 1000,
+                          error_metric: str = "amplitude") -> tuple:
+    """
+    Sample in chunks of 'chunk_size' shots until the estimated error of the amplitudes ('error_metric': "amplitude"
+    or "tv") is below target_error or 'max_shots' shots are drawn
+
+    :return: (amplitudes of the output state, sampling report with the number of 'shots', of 'post_selected' shots,
+             the achieved 'error' and whether it 'converged')
+    """
+    return _adaptive_amplitudes(self.output_circuit, self.out, [self.flag], target_error, max_shots=max_shots,
+                                chunk_size=chunk_size, metric=error_metric)
+
+
+
+class BlackBoxFixedPointAA(BlackBoxRegularAA):
+  """
+  Implement inequality test based method in https://arxiv.org/abs/1807.03206 with fixed-point amplitude amplification
+  (Yoder, Low and Chuang, https://arxiv.org/abs/1409.3305). The generalized Grover iterates
+  G(alpha_j, beta_j) = -S_s(alpha_j) S_t(beta_j) converge monotonically: the success probability is at least
+  1 - delta^2 for every success probability of the good state preparation above 'lower_bound',
+  so no tuning of the number of iterations is needed.
+
+  Attributes:
+    -----------
+    num_out_qubits, num_data_qubits, black_box, input_data :
+        Same as BlackBoxRegularAA
+
+    delta : float
+        Target failure bound, the final success probability is at least 1 - delta^2
+
+    lower_bound : float
+        Lower bound on the success probability of the good state preparation
+
+    achieved_delta : float
+        Failure bound of the sequence built by the last phases() call (delta, or the bound reached with the
+        num_iteration given to construct_circuit)
+
+  Methods:
+    --------
+    phases(num_iteration=None) -> (List[float], List[float])
+        Phases alpha_j, beta_j of the fixed-point sequence.
+
+    amplitude_amplification(num_iteration=None) -> cirq.Circuit
+        Generates the fixed-point amplitude amplification circuit based on the 'good' circuit.
+
+    construct_circuit(num_iteration=None, compact=False) -> None
+        Combine good_state_preparation and amplitude_amplification circuit
+
+    resource_model(num_out_qubits, num_data_qubits, num_iteration=None, black_box=None, ...) -> dict
+        Closed-form Toffoli count, Toffoli-depth and qubits of construct_circuit (static)
+
+    get_output() -> List[float]
+        Simulate results and get ampltiudes of the output state 
+
+    get_exact_output() -> (List[float], float)
+        Read the post-selected amplitudes and their probability from the final state vector
+
+    get_output_adaptive(target_error, ...) -> (List[float], dict)
+        Sample until the amplitudes reach target_error and report the shots used
+  """
+  def __init__(self, num_out_qubits: int, num_data_qubits: int, input_data: list =None, black_box: cirq.Circuit = None,
+               symbolic_data: bool = False, oracle: str = "qrom", measurement_uncompute: bool = False,
+               pool: AncillaPool = None, delta: float = 0.1, lower_bound: float = 0.05)-> None:
+    """
+    :param num_out_qubits: number of qubits for output register
+    :param num_data_qubits: number of qubits to estimate the output data from the oracle
+    :param input_data: if 'black_box' is None, user can direct input the list of amplitudes as 'input_data'
+    :param black_box: the oracle to generate the output data.
+    :param symbolic_data: build the data oracle with symbolic data bits (see BlackBoxRegularAA)
+    :param oracle: data loader for 'input_data' (see BlackBoxRegularAA)
+    :param measurement_uncompute: measurement-based uncompute of the comparators and final QROM, trading Toffoli-depth
+                                  for Toffoli count (see BlackBoxRegularAA)
+    :param pool: ancilla allocator (see BlackBoxRegularAA)
+    :param delta: target failure bound, the output succeeds with probability at least 1 - delta^2
+    :param lower_bound: lower bound on the success probability of the good state preparation
+    """
+    super().__init__(num_out_qubits, num_data_qubits, input_data=input_data, black_box=black_box,
+                     symbolic_data=symbolic_data, oracle=oracle, measurement_uncompute=measurement_uncompute,
+                     pool=pool)
+    self.delta = delta
+    self.lower_bound = lower_bound
+
+  def phases(self, num_iteration: int = None) -> tuple:
+    """
+    Compute the phases of the fixed-point sequence with L = 2*num_iteration+1 queries.
+    If num_iteration is None, the shortest sequence reaching 'delta' for 'lower_bound' is used, otherwise the
+    sequence is built for the failure bound reached with num_iteration iterates. The bound of the sequence is kept in
+    self.achieved_delta, self.delta stays the target given to the constructor.
+
+    :return: (alphas, betas) with beta_j = -alpha_(l-j+1)
+    """
+    if num_iteration is None:
+      num_iteration = _fixed_point_iterations(self.delta, self.lower_bound)
+      self.achieved_delta = self.delta
+    else:
+      self.achieved_delta = 1/_chebyshev(2*num_iteration+1, self.lower_bound)
+    self.num_iteration = num_iteration
+
+    L = 2*num_iteration+1
+    gamma = 1/np.cosh(np.arccosh(1/self.achieved_delta)/L)
+    alphas = [2*np.arctan2(1, np.tan(2*np.pi*j/L)*np.sqrt(1-gamma**2)) for j in range(1, num_iteration+1)]
+    betas = [-alphas[num_iteration-j] for j in range(1, num_iteration+1)]
+    return alphas, betas
+
+  @profiled
+  def amplitude_amplification(self, num_iteration: int = None, compact: bool = False) -> cirq.Circuit:
+    """
+    :param num_iteration: number of generalized Grover iterates, derived from delta and lower_bound when None
+    :param compact: if True, the iterate is built once with symbolic phases and every round is a
+                    cirq.CircuitOperation resolving them
+    """
+    alpha, beta = sympy.Symbol('alpha'), sympy.Symbol('beta')
+
+    def target_phase(angle) -> cirq.Circuit:
+      """
+      S_t(beta) = I - (1 - e^{i beta})|T><T| on the good states |0>_ref|0>_flag
+      """
+      circ = CircuitBuilder()
+      circ.append(cirq.X(self.flag))
+      circ.append(cirq.ZPowGate(exponent=angle/np.pi).controlled(self.num_data_qubits, control_values=[0]*self.num_data_qubits).on(*self.ref, self.flag))
+      circ.append(cirq.X(self.flag))
+      return circ.to_circuit()
+
+    def zero_phase(qubits: list, angle) -> cirq.Circuit:
+      """
+      S_0(alpha) = I - (1 - e^{-i alpha})|0><0| over all qubits
+      """
+      circ = CircuitBuilder()
+      for i in range(len(qubits)):
+        circ.append(cirq.X(qubits[i]))
+
+      circ.append(cirq.ZPowGate(exponent=-angle/np.pi).controlled(len(qubits)-1).on(*qubits))
+
+      for i in range(len(qubits)):
+        circ.append(cirq.X(qubits[i]))
+
+      return circ.to_circuit()
+
+    def iterate(alpha_j, beta_j) -> cirq.Circuit:
+      circ = CircuitBuilder()
+      circ.append(target_phase(beta_j), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      circ.append(invert_circuit(good_state_preparation), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      circ.append(zero_phase(self.out+self.data+self.ref+[self.flag], alpha_j), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      circ.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      return circ.to_circuit()
+
+    circ = CircuitBuilder()
+    good_state_preparation = self.good_state_preparation()
+    alphas, betas = self.phases(num_iteration)
+
+    circ.append(good_state_preparation, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    if compact:
+      symbolic_iterate = iterate(alpha, beta).freeze()
+      for alpha_j, beta_j in zip(alphas, betas):
+        circ.append(cirq.CircuitOperation(symbolic_iterate, param_resolver={alpha: alpha_j, beta: beta_j}),
+                    strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    else:
+      for alpha_j, beta_j in zip(alphas, betas):
+        circ.append(iterate(alpha_j, beta_j), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+    return circ.to_circuit()
+
+  @profiled
+  def construct_circuit(self, num_iteration: int = None, compact: bool = False) -> None:
+    """
+    :param num_iteration: number of generalized Grover iterates, derived from delta and lower_bound when None
+    :param compact: if True, the iterate is built once and reused by every round
+    """
+    self.output_circuit = self.amplitude_amplification(num_iteration=num_iteration, compact=compact)
+    # uncompute data
+    self.output_circuit.append(_data_uncompute(self), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+  @staticmethod
+  def resource_model(num_out_qubits: int, num_data_qubits: int, num_iteration: int = None, black_box: dict = None,
+                     measurement_uncompute: bool = False, delta: float = 0.1, lower_bound: float = 0.05) -> dict:
+    """
+    Closed-form resources of construct_circuit: the good state preparation G, num_iteration rounds of the target
+    phase (phase with d controls), G^-1, the zero phase (phase with n+2d controls) and G, then the data uncompute.
+    Controlled phases cost the AND of their controls.
+
+    :param num_iteration: number of generalized Grover iterates, derived from delta and lower_bound when None
+    :param delta, lower_bound: see __init__
+    :param black_box: resources of the black box (utils.resource_model dict, e.g. Squarer.resource_model), its
+                      ancillae being taken from the pool of the model. None for the QROM of a dense 'input_data'
+                      table (an upper bound for tables with zero entries)
+    :param measurement_uncompute: see __init__
+    :return: dict with the 'toffoli' count, 'toffoli_depth', 'qubits' and pool 'ancillae' (see utils.resource_model)
+    """
+    if num_iteration is None:
+      num_iteration = _fixed_point_iterations(delta, lower_bound)
+    good_state, uncompute = _good_state_model(num_out_qubits, num_data_qubits, black_box, measurement_uncompute)
+    target_phase = resources(toffoli=and_toffolis(num_data_qubits), toffoli_depth=and_toffolis(num_data_qubits))
+    zero_phase = resources(toffoli=and_toffolis(num_out_qubits+2*num_data_qubits),
+                           toffoli_depth=and_toffolis(num_out_qubits+2*num_data_qubits))
+    iterate = sequence(target_phase, good_state, zero_phase, good_state)
+    return _algorithm_model(num_out_qubits, num_data_qubits, [good_state, repeat(iterate, num_iteration), uncompute])
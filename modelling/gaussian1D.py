@@ -1,9 +1,29 @@
 import sympy
 import cirq
 import numpy as np
-from utils.arithmetics import Multiplier
+from utils.ancilla import AncillaPool
+from utils.arithmetics import ConstantMultiplier
+from utils.circuit_builder import CircuitBuilder
 from utils.helpers import *
-from utils.inequality_test import Comparator
+from utils.inequality_test import Comparator, invert_circuit
+from utils.profiling import profiled, stage
+from utils.resource_model import and_toffolis, mcx_toffolis, repeat, resources, sequence
+
+def _classically_controlled(circuit: cirq.Circuit, condition) -> cirq.Circuit:
+  """
+  Condition every operation of 'circuit' on 'condition'. cirq refuses to condition measurements, so those of the
+  measurement-based uncompute are kept unconditioned: when the condition fails their ancilla is still |0>, the
+  measurement reads 0 and the correction it controls is skipped.
+  """
+  ops = []
+  for op in circuit.all_operations():
+    if not cirq.is_measurement(op):
+      ops.append(op.with_classical_controls(condition))
+    elif isinstance(op.untagged, cirq.CircuitOperation):
+      ops.extend(_classically_controlled(op.untagged.mapped_circuit(), condition).all_operations())
+    else:
+      ops.append(op)
+  return cirq.Circuit(ops)
 
 class Gaussian1DineqBased:
   """
@@ -22,6 +42,11 @@ class Gaussian1DineqBased:
     delta : float
         lattice spacing value
 
+    measurement_uncompute : bool
+        Uncompute the comparisons by measurement (see Comparator). Each comparison is then uncomputed right after
+        its result is copied, instead of after CHAD for the post process and in the final inverse of the preparation
+        for the comparison of tmp and ref, and the post process is conditioned operation by operation
+
   Methods:
     --------
     simulate() -> cirq.StateVectorTrialResult
@@ -29,9 +54,12 @@ class Gaussian1DineqBased:
     
     post_process_circuit() -> cirq.Circuit
         Generates circuit for post measurement process.
+
+    resource_model(p, m, sigma, delta, measurement_uncompute=False) -> dict
+        Closed-form Toffoli count, Toffoli-depth and qubits of the circuit of simulate()
     
   """
-  def __init__(self, p: int, m: int, sigma: float, delta: float) -> None:
+  def __init__(self, p: int, m: int, sigma: float, delta: float, measurement_uncompute: bool = False) -> None:
     """
     Initialize the class with some preparation parameters
 
@@ -40,11 +68,14 @@ class Gaussian1DineqBased:
         m: fixed-point number of representation
         sigma: std value of the target gaussian (mean value is set to be 0)
         delta: lattice spacing value
+        measurement_uncompute: uncompute both comparisons with X-basis measurements and classically controlled CZs
+                               instead of Toffolis (see Comparator)
     """
     self.p = p # p > 2m + 1
     self.m = m
     self.sigma = sigma
     self.delta = delta
+    self.measurement_uncompute = measurement_uncompute
 
     # intialize working registers
     self.full_out_register = [cirq.NamedQubit('out' + str(p-1-i)) for i in range(p)]
@@ -54,17 +85,19 @@ class Gaussian1DineqBased:
     self.ref_register = [cirq.NamedQubit('ref' + str(i)) for i in range(m)]
     self.tmp_register = [cirq.NamedQubit('tmp' + str(i)) for i in range(m)]
     self.ang_register = [cirq.NamedQubit('ang' + str(i)) for i in range(p)]
-    self.spc_register = [cirq.NamedQubit('spc' + str(i)) for i in range(m)]
     self.prod_out_register = [cirq.NamedQubit('prod_out' + str(i)) for i in range(p)]
     self.ineq_qubit = cirq.NamedQubit("inequality_test_qubit")
     self.flag_qubit = cirq.NamedQubit("flip_flag")
+    # the ancillae of the comparators are borrowed from one pool and reused (ConstantMultiplier needs none)
+    self.pool = AncillaPool()
     self.preparation_circuit = cirq.Circuit()
 
+  @profiled
   def simulate(self)-> cirq.StateVectorTrialResult:
     """
     Return the circuit described in Algorithm.7
     """
-    self.circuit = cirq.Circuit()
+    self.circuit = CircuitBuilder()
 
     # Prepare Eq. 78
 
@@ -117,19 +150,31 @@ class Gaussian1DineqBased:
                                                            control_values=[int(k) for k in format(j, "b").zfill(self.m)]))
 
       # Compare ref and tmp
-      comparator = Comparator( self.tmp_register, self.ref_register)
+      comparator = Comparator( self.tmp_register, self.ref_register, pool=self.pool,
+                               measurement_uncompute=self.measurement_uncompute)
       compare_circ = comparator.construct_circuit()
 
-      self.circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-      self.circuit.append(cirq.X(comparator.anc1))
-      self.circuit.append(cirq.CNOT(comparator.anc1, self.ineq_qubit))
-      self.circuit.append(cirq.X(comparator.anc1))
+      if self.measurement_uncompute:
+        # compare, copy and uncompute at once, the inverse of the preparation repeats the block
+        test = CircuitBuilder()
+        test.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+        test.append(cirq.X(comparator.anc1))
+        test.append(cirq.CNOT(comparator.anc1, self.ineq_qubit))
+        test.append(cirq.X(comparator.anc1))
+        test.append(comparator.inverse_circuit(), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+        comparator.release()
+        self.circuit.append(comparator.test_block(test.to_circuit()), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      else:
+        self.circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+        self.circuit.append(cirq.X(comparator.anc1))
+        self.circuit.append(cirq.CNOT(comparator.anc1, self.ineq_qubit))
+        self.circuit.append(cirq.X(comparator.anc1))
 
       # unprepare ref
       for i in range(self.m):
         self.circuit.append(cirq.H(self.ref_register[i]))
 
-      self.preparation_circuit.append(self.circuit)
+      self.preparation_circuit.append(self.circuit.to_circuit())
 
       # the circuit outputs Eq.77 if ineq qubit return 0
       # flip the Eq.77 to Eq. 76 if ineq return 0
@@ -138,53 +183,94 @@ class Gaussian1DineqBased:
       self.circuit.append(cirq.measure(self.ineq_qubit, key="ineq"))
 
       # post process if measure ineq returns 1
-      post_process_circuit = self.post_process_cricuit()
-      post_process_op = cirq.CircuitOperation(post_process_circuit.freeze())
-      self.circuit.append(post_process_op.with_classical_controls(sympy_cond))
+      post_process_circuit = self.post_process_circuit()
+      if self.measurement_uncompute:
+        self.circuit.append(_classically_controlled(post_process_circuit, sympy_cond))
+      else:
+        post_process_op = cirq.CircuitOperation(post_process_circuit.freeze())
+        self.circuit.append(post_process_op.with_classical_controls(sympy_cond))
 
       # Run simulation
       #print(comparator.circuit.get_independent_qubit_sets()[0])
+      self.circuit = self.circuit.to_circuit()
       simulator = cirq.Simulator()
-      result = simulator.simulate(self.circuit)
+      with stage("cirq.Simulator.simulate", circuit=self.circuit):
+        result = simulator.simulate(self.circuit)
       b = result.measurements['ineq'][0]
 
       return result
 
+  @profiled
   def post_process_circuit(self) -> cirq.Circuit:
-    circuit = cirq.Circuit()
+    circuit = CircuitBuilder()
     # COMP(out, ref, flag)
-    comparator = Comparator(self.ref_register, self.active_out_register)
+    comparator = Comparator(self.ref_register, self.active_out_register, pool=self.pool,
+                            measurement_uncompute=self.measurement_uncompute)
     compare_circ = comparator.construct_circuit()
-    circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    circuit.append(cirq.CNOT(comparator.anc1, self.flag_qubit))
-
-    # CHAD(flag, out[m-1])
-    circuit.append(cirq.H(self.active_out_register[0]).controlled_by(self.flag_qubit))
-    # erase flag
-    inv_compare = cirq.inverse(compare_circ)
-    circuit.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-
-    self.preparation_circuit.append(circuit)
-    # delta to register
-    binarized_delta = format(int(self.delta), "b").zfill(self.m) # convert to binary string
-    for qubit, value in zip(self.spc_register, binarized_delta):
-      if value == "1":
-        circuit.append(cirq.X(qubit))
-
-    # MUL(out, spc, anc)
-    multiplier = Multiplier(self.active_out_register, self.spc_register, self.prod_out_register).multiply()
-    circuit.append(multiplier)
+    if self.measurement_uncompute:
+      # the measurement-based uncompute needs the compared registers as the comparison left them, so it comes
+      # before CHAD changes out
+      test = CircuitBuilder()
+      test.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      test.append(cirq.CNOT(comparator.anc1, self.flag_qubit))
+      test.append(comparator.inverse_circuit(), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      comparator.release()
+      circuit.append(comparator.test_block(test.to_circuit()), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      # CHAD(flag, out[m-1])
+      circuit.append(cirq.H(self.active_out_register[0]).controlled_by(self.flag_qubit))
+    else:
+      circuit.append(compare_circ, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      circuit.append(cirq.CNOT(comparator.anc1, self.flag_qubit))
 
-    # erases spc_register
-    for qubit, value in zip(self.spc_register, binarized_delta):
-      if value == "1":
-        circuit.append(cirq.X(qubit))
+      # CHAD(flag, out[m-1])
+      circuit.append(cirq.H(self.active_out_register[0]).controlled_by(self.flag_qubit))
+      # erase flag
+      inv_compare = comparator.inverse_circuit()
+      circuit.append(inv_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      comparator.release()
+
+    self.preparation_circuit.append(circuit.to_circuit())
+    # MUL(out, delta): delta is classical, only the shifted copies of out at its set bits are added
+    multiplier = ConstantMultiplier(self.active_out_register, int(self.delta), self.prod_out_register).multiply()
+    circuit.append(multiplier)
 
     # erases out
-    circuit.append(cirq.inverse(self.preparation_circuit))
+    circuit.append(invert_circuit(self.preparation_circuit))
 
     for l in range(0, self.p):
       circuit.append(cirq.SWAP(self.full_out_register[l], self.prod_out_register[l]))
 
-    return circuit
+    return circuit.to_circuit()
 
+  @staticmethod
+  def resource_model(p: int, m: int, sigma: float, delta: float, measurement_uncompute: bool = False) -> dict:
+    """
+    Closed-form resources of the circuit built by simulate() (see utils.resource_model), the classically controlled
+    post process being counted in full.
+
+    The preparation is the rotation of out_(m-2) (no Toffoli), m-2 rotations controlled on the previous out qubit
+    (p Ry with two controls, 2 Toffolis each), the ratio table (an X with m controls per set bit of every ratio)
+    and the comparison of tmp and ref. The post process compares out and ref (with its uncompute), multiplies out by
+    int(delta) and inverts the preparation and the comparison, the SWAPs taking no Toffoli.
+
+    Args:
+        p: working precision
+        m: fixed-point number of representation (m >= 2)
+        sigma: std value of the target gaussian
+        delta: lattice spacing value
+        measurement_uncompute: see __init__
+    Return:
+        dict with the 'toffoli' count, 'toffoli_depth', 'qubits' and pool 'ancillae'
+    """
+    rotations = repeat(resources(toffoli=and_toffolis(2), toffoli_depth=and_toffolis(2)), p*max(0, m-2))
+    num_ratio_bits = sum(ratio_bits(j, sigma, m).count("1") for j in range(2**m - 1))
+    ratios = repeat(resources(toffoli=mcx_toffolis(m), toffoli_depth=mcx_toffolis(m)), num_ratio_bits)
+    comparison = Comparator.resource_model(m, measurement_uncompute=measurement_uncompute, uncompute=True)
+    preparation = sequence(rotations, ratios, comparison if measurement_uncompute else Comparator.resource_model(m))
+    post_process = sequence(comparison, ConstantMultiplier.resource_model(m, int(delta)), preparation, comparison)
+    total = sequence(preparation, post_process)
+    # the ancillae of the comparison of tmp and ref are kept during the post process, unless it is measured away
+    total["ancillae"] = comparison["ancillae"]*(1 if measurement_uncompute else 2)
+    # out, ang and prod_out (p qubits each), ref and tmp (m qubits each), the inequality and flag qubits
+    total["qubits"] = 3*p + 2*m + 2 + total["ancillae"]
+    return total
@@ -1,4 +1,12 @@
+from utils.ancilla import *
 from utils.arithmetics import *
+from utils.circuit_builder import *
+from utils.data_loading import *
 from utils.helpers import *
 from utils.inequality_test import *
-from utils.resource_estimation import *
\ No newline at end of file
+from utils.profiling import *
+from utils.qasm_writer import *
+from utils.resource_estimation import *
+from utils.resource_model import *
+from utils.reversible_simulation import *
+from utils.stats_cache import *
\ No newline at end of file
@@ -0,0 +1,49 @@
+import cirq
+
+"""
+Allocator for the clean ancillae of the circuit builders (Comparator, Adder, Multiplier, data oracles).
+
+Builders take their temporary qubits from a shared AncillaPool and give them back once the circuit they append
+has uncomputed them. A later builder then reuses the same qubits instead of creating new ones, so the width of the
+final circuit is the peak number of ancillae alive at the same time rather than the sum over all subcircuits.
+The pool follows the order in which subcircuits are built, which is the order in which they are appended: a
+qubit must only be freed when it is back to |0> at the end of the subcircuit that allocated it.
+"""
+
+class AncillaPool:
+  def __init__(self, prefix: str = "anc") -> None:
+    """
+    :param prefix: name prefix of the ancillae, the i-th qubit created by the pool is cirq.NamedQubit(prefix + str(i))
+    """
+    self.prefix = prefix
+    self.qubits = []
+    self.in_use = set()
+    # peak number of ancillae alive at once, also the number of distinct qubits the pool created
+    self.peak = 0
+
+  def allocate(self, num: int = 1) -> list:
+    """
+    Hand out 'num' clean ancillae, reusing freed qubits (lowest index first) before creating new ones.
+    """
+    free = [q for q in self.qubits if q not in self.in_use]
+    while len(free) < num:
+      qubit = cirq.NamedQubit(self.prefix + str(len(self.qubits)))
+      self.qubits.append(qubit)
+      free.append(qubit)
+    allocated = free[:num]
+    self.in_use.update(allocated)
+    self.peak = max(self.peak, len(self.in_use))
+    return allocated
+
+  def free(self, qubits: list) -> None:
+    """
+    Return ancillae to the pool. They must be back to |0> at the end of the circuit built so far.
+    """
+    for qubit in qubits:
+      if qubit not in self.in_use:
+        raise ValueError("{} is not allocated from this pool".format(qubit))
+      self.in_use.remove(qubit)
+
+  def num_in_use(self) -> int:
+    """ Number of ancillae currently allocated """
+    return len(self.in_use)
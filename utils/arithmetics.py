@@ -1,13 +1,43 @@
+import math
 import cirq
+from utils.ancilla import AncillaPool
+from utils.circuit_builder import CircuitBuilder
+from utils.profiling import profiled
+from utils.resource_model import resources
 """ Several Common Arithmetics for State Prepartion: Add, Multiplication"""
+
+def adder_metadata(adder: str, circuit: cirq.Circuit, ancillae: list) -> dict:
+    """
+    Cost summary of an adder circuit: Toffoli count, Toffoli depth and depth of the circuit with every operation
+    moved as early as possible, and the number of ancillae besides the operands (carry included).
+    """
+    # layer of each operation when packed as early as possible, from the last layer of its qubits
+    layer = {}
+    toffoli_layers = set()
+    toffoli_count = 0
+    for op in circuit.all_operations():
+        index = max(layer.get(q, 0) for q in op.qubits) + 1
+        for q in op.qubits:
+            layer[q] = index
+        if len(op.qubits) == 3:
+            toffoli_count += 1
+            toffoli_layers.add(index)
+    return {"adder": adder,
+            "toffoli_count": toffoli_count,
+            "toffoli_depth": len(toffoli_layers),
+            "depth": max(layer.values(), default=0),
+            "ancillae": len(set(ancillae))}
+
 class Adder:
-    def __init__(self, A: list, B: list, ancillae: list = None, type: bool =True) -> None:
+    def __init__(self, A: list, B: list, ancillae: list = None, type: bool =True, pool: AncillaPool = None) -> None:
         """
         :param A: The quantum register holding the first integer
         :param B: The quantum register second the first integer (the last N qubits of the addition result will be
                  registered in B)
         :param ancillae: The two needed ancillae
         :param type: Boolean parameter : if True the result will be in N+1 precision otherwise, otherwise it will
+        :param pool: if given and ancillae is None, the carry qubit of the N+1 precision result is allocated from
+                 the pool (it holds the most significant bit of the sum and is not freed)
         """
         self.A = A
         self.B = B
@@ -15,11 +45,13 @@ class Adder:
         self.type = type
         if ancillae != None:
             self.ancillae = ancillae
+        elif pool is not None:
+            self.ancillae = pool.allocate(1) if type else []
         else:
             self.ancillae = [cirq.NamedQubit("ancilla1") ,cirq.NamedQubit("ancilla2")]
 
     def construct_circuit(self) -> cirq.Circuit:
-        circuit = cirq.Circuit()
+        circuit = CircuitBuilder()
         # The set of CNOTs between Ai and Bi
         firs_set_of_CNOTs=[cirq.Moment([cirq.CNOT(self.A[i], self.B[i]) for i in range(1, self.size)])]
 
@@ -67,11 +99,25 @@ class Adder:
         circuit.append(second_set_of_CNOTs, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
         circuit.append(firs_set_of_CNOTs, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
+        circuit = circuit.to_circuit()
+        self.metadata = adder_metadata("ripple", circuit, self.ancillae[:1] if self.type else [])
         return circuit
 
+    @staticmethod
+    def resource_model(n: int, type: bool = True) -> dict:
+        """
+        Closed-form resources of construct_circuit for N = n >= 2 (see utils.resource_model): a chain of 2N-1
+        Toffolis (2N-2 without the carry), on A, B and the carry qubit.
+        """
+        if n < 2:
+            raise ValueError("Adder needs registers of at least 2 qubits")
+        toffoli = 2*n - 1 if type else 2*n - 2
+        return resources(toffoli=toffoli, toffoli_depth=toffoli, qubits=2*n + int(type), ancillae=int(type))
+
 # Controlled Adder
 class ControlAdder:
-    def __init__(self, A: list, B: list, ctrl: cirq.NamedQubit, ancillae: list = None, type: bool =True) -> None:
+    def __init__(self, A: list, B: list, ctrl: cirq.NamedQubit, ancillae: list = None, type: bool =True,
+                 pool: AncillaPool = None) -> None:
         """
         :param A: The quantum register holding the first integer
         :param B: The quantum register second the first integer (the last N qubits of the addition result will be
@@ -80,19 +126,29 @@ class ControlAdder:
         :param ancillae: The two needed ancillae
         :param type: Boolean parameter : if True the result will be in N+1 precision otherwise, otherwise it will
                  be in N qubit precision
+        :param pool: if given and ancillae is None, the carry qubit (first ancilla) is allocated from the pool and
+                 kept as part of the result, the second ancilla is a temporary borrowed during construct_circuit
         """
         self.A = A
         self.B = B
         self.ctrl = ctrl
         self.size = len(A)
         self.type = type
+        self.pool = None
         if ancillae != None:
             self.ancillae = ancillae
+        elif pool is not None:
+            self.pool = pool
+            self.ancillae = pool.allocate(1) + [None] if type else []
         else:
             self.ancillae = [cirq.NamedQubit("ancilla1"), cirq.NamedQubit("ancilla2")]
 
     def construct_circuit(self) -> cirq.Circuit:
-        self.circuit = cirq.Circuit()
+        self.circuit = CircuitBuilder()
+        borrow = self.pool is not None and self.type
+        if borrow:
+            # the second ancilla is back to |0> at the end of the addition
+            self.ancillae[1] = self.pool.allocate(1)[0]
         # The first set of CNOTs
         firs_set_of_CNOTs = [cirq.Moment([cirq.CNOT(self.A[i], self.B[i]) for i in range(1, self.size)])]
         # The set of CNOTs between the Ais
@@ -133,8 +189,205 @@ class ControlAdder:
         self.circuit.append(second_set_of_CNOTs, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
         self.circuit.append(firs_set_of_CNOTs, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
+        if borrow:
+            self.pool.free([self.ancillae[1]])
+        self.circuit = self.circuit.to_circuit()
+        self.metadata = adder_metadata("ripple", self.circuit, self.ancillae if self.type else [])
         return self.circuit
 
+    @staticmethod
+    def resource_model(n: int, type: bool = True) -> dict:
+        """
+        Closed-form resources of construct_circuit for N = n >= 2 (see utils.resource_model): a chain of 3N+2
+        Toffolis (3N-2 without the carry), on A, B, ctrl and the two ancillae.
+        """
+        if n < 2:
+            raise ValueError("ControlAdder needs registers of at least 2 qubits")
+        toffoli = 3*n + 2 if type else 3*n - 2
+        return resources(toffoli=toffoli, toffoli_depth=toffoli, qubits=2*n + 1 + 2*int(type), ancillae=2*int(type))
+
+def _carry_moments(A: list, B: list, carries: list, workspace) -> list:
+    """
+    Out-of-place carry-lookahead network of Draper, Kutin, Rains and Svore (https://arxiv.org/abs/quant-ph/0406142):
+    XOR the carries c_1..c_m of A + B into carries[0..m-1] (carries[m-1] is the carry out) in O(log m) depth,
+    with A, B and the workspace restored. 'workspace' is called for each clean ancilla holding a block propagate.
+    """
+    m = len(A)
+    z = {i: carries[i - 1] for i in range(1, m + 1)}
+    moments = []
+    # generate g_i = a_i b_i into z[i+1] and propagate p_i = a_i xor b_i into b_i
+    moments.append(cirq.Moment([cirq.TOFFOLI(A[i], B[i], z[i + 1]) for i in range(m)]))
+    moments.append(cirq.Moment([cirq.CNOT(A[i], B[i]) for i in range(m)]))
+
+    # P-rounds: P[t][x] is the propagate of the block [2^t x, 2^t (x+1))
+    log = int(math.log2(m))
+    P = {0: {x: B[x] for x in range(m)}}
+    p_rounds = []
+    for t in range(1, log):
+        P[t] = {x: workspace() for x in range(1, m // 2**t)}
+        p_rounds.append(cirq.Moment([cirq.TOFFOLI(P[t - 1][2*x], P[t - 1][2*x + 1], P[t][x]) for x in range(1, m // 2**t)]))
+    moments += p_rounds
+    # G-rounds: carries at the multiples of 2^t
+    for t in range(1, log + 1):
+        moments.append(cirq.Moment([cirq.TOFFOLI(z[2**t*x + 2**(t - 1)], P[t - 1][2*x + 1], z[2**t*x + 2**t])
+                                    for x in range(m // 2**t)]))
+    # C-rounds: the remaining carries
+    for t in range(int(math.floor(math.log2(2*m/3))), 0, -1):
+        moments.append(cirq.Moment([cirq.TOFFOLI(z[2**t*x], P[t - 1][2*x], z[2**t*x + 2**(t - 1)])
+                                    for x in range(1, (m - 2**(t - 1)) // 2**t + 1)]))
+    # P^-1-rounds and restore B
+    moments += p_rounds[::-1]
+    moments.append(cirq.Moment([cirq.CNOT(A[i], B[i]) for i in range(m)]))
+    return [moment for moment in moments if len(moment)]
+
+class CarryLookaheadAdder:
+    def __init__(self, A: list, B: list, ancillae: list = None, type: bool = True, pool: AncillaPool = None) -> None:
+        """
+        In-place carry-lookahead adder (Draper, Kutin, Rains and Svore): O(log N) depth against O(N) for Adder,
+        for about 4 times the Toffolis and N-1 + N - w(N) - floor(log N) ancillae besides the carry
+        (see self.metadata after construct_circuit).
+
+        :param A: The quantum register holding the first integer
+        :param B: The quantum register holding the second integer, replaced by the N lowest bits of the sum
+        :param ancillae: ancillae[0] receives the carry out when type is True (the other entries are not used)
+        :param type: Boolean parameter : if True the result will be in N+1 precision, otherwise in N qubit precision
+        :param pool: if given, the carry out (when ancillae is None) is allocated from the pool and the internal
+                 carries and block propagates are borrowed during construct_circuit, instead of the named qubits
+                 'ancilla1', 'cla_carry*' and 'cla_prop*'
+        """
+        self.A = A
+        self.B = B
+        self.size = len(A)
+        self.type = type
+        self.pool = pool
+        if ancillae != None:
+            self.ancillae = ancillae
+        elif pool is not None:
+            self.ancillae = pool.allocate(1) if type else []
+        else:
+            self.ancillae = [cirq.NamedQubit("ancilla1")]
+
+    def construct_circuit(self) -> cirq.Circuit:
+        n = self.size
+        borrowed = []
+        names = {"cla_carry": 0, "cla_prop": 0}
+
+        def ancilla(name):
+            if self.pool is not None:
+                borrowed.extend(self.pool.allocate(1))
+                return borrowed[-1]
+            names[name] += 1
+            return cirq.NamedQubit(name + str(names[name] - 1))
+
+        # internal carries c_1..c_(N-1), then the carry out
+        carries = [ancilla("cla_carry") for i in range(n - 1)]
+        width = n
+        if self.type:
+            carries.append(self.ancillae[0])
+        else:
+            width = n - 1
+        # the block propagates are back to |0> after each network, the second network reuses them
+        workspace = []
+
+        def network(A, B, carries):
+            used = [0]
+
+            def propagate():
+                if used[0] == len(workspace):
+                    workspace.append(ancilla("cla_prop"))
+                used[0] += 1
+                return workspace[used[0] - 1]
+            return _carry_moments(A, B, carries, propagate)
+
+        self.circuit = CircuitBuilder()
+        if width > 0:
+            self.circuit.append(network(self.A[:width], self.B[:width], carries))
+        # s_i = a_i xor b_i xor c_i
+        self.circuit.append(cirq.Moment([cirq.CNOT(self.A[i], self.B[i]) for i in range(n)]))
+        if n > 1:
+            self.circuit.append(cirq.Moment([cirq.CNOT(carries[i - 1], self.B[i]) for i in range(1, n)]))
+            # the carries of A + B are those of A + NOT(s), the inverse network erases them
+            flip = cirq.Moment([cirq.X(self.B[i]) for i in range(n - 1)])
+            self.circuit.append(flip)
+            self.circuit.append(network(self.A[:n - 1], self.B[:n - 1], carries[:n - 1])[::-1])
+            self.circuit.append(flip)
+
+        if self.pool is not None:
+            self.pool.free(borrowed)
+        self.circuit = self.circuit.to_circuit()
+        ancillae = self.circuit.all_qubits() - set(self.A) - set(self.B)
+        self.metadata = adder_metadata("carry_lookahead", self.circuit, list(ancillae))
+        return self.circuit
+
+class ControlCarryLookaheadAdder:
+    def __init__(self, A: list, B: list, ctrl: cirq.NamedQubit, ancillae: list = None, type: bool = True,
+                 pool: AncillaPool = None) -> None:
+        """
+        Controlled carry-lookahead adder: B += ctrl*A. ctrl is fanned out to N-1 ancillae with CNOTs, the controlled
+        operand ctrl AND A is copied into N ancillae with one layer of Toffolis, added with CarryLookaheadAdder and
+        erased, keeping the O(log N) depth.
+
+        :param A: The quantum register holding the first integer
+        :param B: The quantum register holding the second integer, replaced by the N lowest bits of the sum
+        :param ctrl: The qubit controlling the operation
+        :param ancillae: ancillae[0] receives the carry out when type is True (the other entries are not used)
+        :param type: Boolean parameter : if True the result will be in N+1 precision, otherwise in N qubit precision
+        :param pool: if given, the ancillae are taken from the pool (see CarryLookaheadAdder), the copies of
+                 ctrl AND A and of ctrl are borrowed instead of being the named qubits 'cla_and*' and 'cla_ctrl*'
+        """
+        self.A = A
+        self.B = B
+        self.ctrl = ctrl
+        self.size = len(A)
+        self.type = type
+        self.pool = pool
+        if ancillae != None:
+            self.ancillae = ancillae
+        elif pool is not None:
+            self.ancillae = pool.allocate(1) if type else []
+        else:
+            self.ancillae = [cirq.NamedQubit("ancilla1")]
+
+    def construct_circuit(self) -> cirq.Circuit:
+        n = self.size
+        if self.pool is not None:
+            copies = self.pool.allocate(n)
+            fanout = self.pool.allocate(n - 1)
+        else:
+            copies = [cirq.NamedQubit('cla_and' + str(i)) for i in range(n)]
+            fanout = [cirq.NamedQubit('cla_ctrl' + str(i)) for i in range(n - 1)]
+        # copies of ctrl in log depth, so that the N Toffolis writing ctrl AND A fit in one moment
+        controls = [self.ctrl] + fanout
+        spread = []
+        k = 1
+        while k < n:
+            spread.append(cirq.Moment([cirq.CNOT(controls[i], controls[i + k]) for i in range(min(k, n - k))]))
+            k *= 2
+        copy = cirq.Moment([cirq.TOFFOLI(controls[i], self.A[i], copies[i]) for i in range(n)])
+
+        self.circuit = CircuitBuilder()
+        self.circuit.append(spread)
+        self.circuit.append(copy)
+        self.circuit += CarryLookaheadAdder(copies, self.B, ancillae=self.ancillae, type=self.type, pool=self.pool).construct_circuit()
+        self.circuit.append(copy)
+        self.circuit.append(spread[::-1])
+
+        if self.pool is not None:
+            self.pool.free(copies + fanout)
+        self.circuit = self.circuit.to_circuit()
+        ancillae = self.circuit.all_qubits() - set(self.A) - set(self.B) - {self.ctrl}
+        self.metadata = adder_metadata("carry_lookahead", self.circuit, list(ancillae))
+        return self.circuit
+
+# Adder and controlled adder classes selectable by name in the multipliers
+ADDERS = {"ripple": (Adder, ControlAdder),
+          "carry_lookahead": (CarryLookaheadAdder, ControlCarryLookaheadAdder)}
+
+def _adder_classes(adder: str) -> tuple:
+    if adder not in ADDERS:
+        raise ValueError("Unknown adder {}".format(adder))
+    return ADDERS[adder]
+
 # Controlled Toffoli
 class ControlToffoli:
     def __init__(self, ctrl, B, A):
@@ -147,27 +400,193 @@ class ControlToffoli:
         return moments
 
 class Multiplier:
-    def __init__(self, A: list, B: list, P: list = None)-> None:
+    def __init__(self, A: list, B: list, P: list = None, pool: AncillaPool = None, adder: str = "ripple")-> None:
         """
         :param A: First operand
         :param B: Second operand
+        :param P: The qubits holding the product, 2N+1 qubits by default (the last one is only a temporary of the last
+                 addition, so 2N qubits are enough when a pool is given)
+        :param pool: if given, the temporary of the last addition (and the workspace of the carry-lookahead
+                 additions) is borrowed from the pool
+        :param adder: "ripple" (ControlAdder) or "carry_lookahead" (ControlCarryLookaheadAdder, O(log N) depth per
+                 addition for more Toffolis and ancillae), see ADDERS
         """
         self.A = A
         self.B = B
         self.size = len(A)
+        self.pool = pool
+        self.adder = adder
+        _adder_classes(adder)
         # The qubits holding the product
         if P is None:
-          self.P = [cirq.NamedQubit('P'+str(i)) for i in range(2*self.size+1)]
+          size = 2*self.size if pool is not None else 2*self.size+1
+          self.P = [cirq.NamedQubit('P'+str(i)) for i in range(size)]
         else:
           self.P = P
 
+    @profiled
     def multiply(self)-> cirq.Circuit:
-        circuit = cirq.Circuit()
+        circuit = CircuitBuilder()
         circuit.append(ControlToffoli(self.B[0], self.A, self.P[0:self.size]).construct_moments())
         for i in range(1, self.size):
-            # Add and shift
-            circuit += ControlAdder(self.A, self.P[i:i + self.size], self.B[i], ancillae=[self.P[i + self.size], self.P[i + 1 + self.size]]).construct_circuit()
-        return circuit
+            # Add and shift, the next carry qubit of P is still |0> and serves as the temporary
+            borrow = self.pool is not None and i == self.size - 1
+            temp = self.pool.allocate(1)[0] if borrow else self.P[i + 1 + self.size]
+            control_adder = _adder_classes(self.adder)[1]
+            circuit += control_adder(self.A, self.P[i:i + self.size], self.B[i], ancillae=[self.P[i + self.size], temp],
+                                     pool=self.pool).construct_circuit()
+            if borrow:
+                self.pool.free([temp])
+        return circuit.to_circuit()
+
+    @staticmethod
+    def resource_model(n: int, pool: bool = False) -> dict:
+        """
+        Closed-form resources of multiply with the ripple adder for N = n (see utils.resource_model): N Toffolis
+        copying A controlled by B[0] and N-1 ControlAdders of 3N+2 Toffolis, 3N^2-2 in total. Consecutive additions
+        overlap by one Toffoli layer. The qubits are A, B and the 2N+1 product qubits (the last one borrowed from
+        the pool when 'pool' is True).
+        """
+        if n == 1:
+            return resources(toffoli=1, toffoli_depth=1, qubits=3)
+        return resources(toffoli=3*n**2 - 2, toffoli_depth=3*n**2 - n, qubits=4*n + 1, ancillae=int(pool))
+
+class ConstantMultiplier:
+    def __init__(self, A: list, constant: int, P: list = None, adder: str = "ripple") -> None:
+        """
+        :param A: The quantum register holding the integer (A[0] is the least significant bit)
+        :param constant: The classical non-negative integer multiplying A
+        :param P: The qubits holding the product, len(A) + constant.bit_length() qubits (created as 'CP*' by default)
+        :param adder: "ripple" (Adder) or "carry_lookahead" (CarryLookaheadAdder), see ADDERS
+        """
+        self.A = A
+        self.constant = int(constant)
+        self.size = len(A)
+        self.adder = adder
+        _adder_classes(adder)
+        if self.constant < 0:
+            raise ValueError("The constant must be non-negative")
+        # Positions of the set bits of the constant, only the shifted copies of A at these positions are added
+        self.shifts = [k for k in range(self.constant.bit_length()) if (self.constant >> k) & 1]
+        if P is None:
+            self.P = [cirq.NamedQubit('CP'+str(i)) for i in range(self.size + self.constant.bit_length())]
+        else:
+            self.P = P
+
+    @profiled
+    def multiply(self) -> cirq.Circuit:
+        circuit = CircuitBuilder()
+        if not self.shifts:
+            return circuit.to_circuit()
+        # The lowest set bit copies A into the empty product
+        k = self.shifts[0]
+        circuit.append([cirq.CNOT(self.A[i], self.P[k + i]) for i in range(self.size)])
+        for k in self.shifts[1:]:
+            # Add A*2^k, the partial product is below bit k + N so P[k + N] is free for the carry
+            if self.size == 1:
+                circuit.append(cirq.TOFFOLI(self.A[0], self.P[k], self.P[k + 1]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+                circuit.append(cirq.CNOT(self.A[0], self.P[k]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+            else:
+                adder = _adder_classes(self.adder)[0]
+                circuit += adder(self.A, self.P[k:k + self.size], ancillae=[self.P[k + self.size]]).construct_circuit()
+        return circuit.to_circuit()
+
+    @staticmethod
+    def resource_model(n: int, constant: int) -> dict:
+        """
+        Closed-form resources of multiply with the ripple adder for N = n (see utils.resource_model): one Adder of
+        2N-1 Toffolis (a single Toffoli when N = 1) per set bit of the constant after the lowest one, applied one
+        after another. The qubits are A and the product qubits covered by the shifted copies of A.
+        """
+        shifts = [k for k in range(int(constant).bit_length()) if (int(constant) >> k) & 1]
+        if not shifts:
+            return resources()
+        covered = set(range(shifts[0], shifts[0] + n))
+        for k in shifts[1:]:
+            covered.update(range(k, k + n + 1))
+        toffoli = (len(shifts) - 1)*(2*n - 1)
+        return resources(toffoli=toffoli, toffoli_depth=toffoli, qubits=n + len(covered))
+
+class Squarer:
+    def __init__(self, A: list, P: list = None, pool: AncillaPool = None, adder: str = "ripple") -> None:
+        """
+        :param A: The quantum register holding the integer x (A[0] is the least significant bit)
+        :param P: The qubits holding x^2, at least 2N qubits (created as 'SQ*' by default)
+        :param pool: if given, the constant |1>, |0> qubits and the temporary of the additions are borrowed from the
+                 pool instead of being the named qubits 'sq_one', 'sq_zero' and 'sq_temp'
+        :param adder: "ripple" (ControlAdder) or "carry_lookahead" (ControlCarryLookaheadAdder), see ADDERS
+        """
+        self.A = A
+        self.size = len(A)
+        self.pool = pool
+        self.adder = adder
+        _adder_classes(adder)
+        if P is None:
+            self.P = [cirq.NamedQubit('SQ'+str(i)) for i in range(2*self.size)]
+        else:
+            self.P = P
+
+    @profiled
+    def square(self) -> cirq.Circuit:
+        """
+        x^2 = sum_i x_i 2^(2i) (1 + 4 (x >> (i+1))): step i adds the (N+1-i)-bit value [1, 0, x_(i+1), ..., x_(N-1)]
+        to P[2i:], controlled by x_i. Each cross term x_i x_j appears once, so the additions shrink from N+1 to 2 bits.
+        The partial sum before step i is below 2^(N+i+1), hence P[N+i+1] is free for the carry (and P[N+i+2] for the
+        temporary when it exists), and the last step needs no carry since x^2 < 2^(2N).
+        """
+        circuit = CircuitBuilder()
+        n = self.size
+        # Step 0 writes into the empty product: P[0] = x_0, P[j+1] = x_0 x_j
+        circuit.append(cirq.CNOT(self.A[0], self.P[0]))
+        circuit.append([cirq.TOFFOLI(self.A[0], self.A[j], self.P[j + 1]) for j in range(1, n)], strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+        if n == 1:
+            return circuit.to_circuit()
+
+        if self.pool is not None:
+            one, zero = self.pool.allocate(2)
+        else:
+            one, zero = cirq.NamedQubit('sq_one'), cirq.NamedQubit('sq_zero')
+        circuit.append(cirq.X(one), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+        control_adder = _adder_classes(self.adder)[1]
+        for i in range(1, n):
+            addend = [one, zero] + self.A[i + 1:]
+            if i == n - 1:
+                circuit += control_adder(addend, self.P[2*i:n + i + 1], self.A[i], ancillae=[], type=False,
+                                         pool=self.pool).construct_circuit()
+                continue
+            borrow = n + i + 2 >= len(self.P)
+            if not borrow:
+                temp = self.P[n + i + 2]
+            elif self.pool is not None:
+                temp = self.pool.allocate(1)[0]
+            else:
+                temp = cirq.NamedQubit('sq_temp')
+            circuit += control_adder(addend, self.P[2*i:n + i + 1], self.A[i], ancillae=[self.P[n + i + 1], temp],
+                                     pool=self.pool).construct_circuit()
+            if borrow and self.pool is not None:
+                self.pool.free([temp])
+        circuit.append(cirq.X(one), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+        if self.pool is not None:
+            self.pool.free([one, zero])
+        return circuit.to_circuit()
+
+    @staticmethod
+    def resource_model(n: int, num_product_qubits: int = None) -> dict:
+        """
+        Closed-form resources of square with the ripple adder for N = n (see utils.resource_model): N-1 Toffolis for
+        step 0, ControlAdders of 3(N+1-i)+2 Toffolis for the steps i = 1..N-2 and one of 4 Toffolis for the last
+        step, (3N^2+9N-20)/2 in total, consecutive additions overlapping by one Toffoli layer from N = 3. P[1] is
+        never used (bit 1 of x^2 is 0), the ancillae are the constant qubits and the temporary of step N-2 when P
+        has only 2N qubits ('num_product_qubits', 2N by default).
+        """
+        num_product_qubits = 2*n if num_product_qubits is None else num_product_qubits
+        if n == 1:
+            return resources(qubits=2)
+        toffoli = (3*n**2 + 9*n - 20)//2
+        temp = int(n >= 3 and num_product_qubits <= 2*n)
+        product = 2*n - 1 + int(n >= 3 and num_product_qubits > 2*n)
+        return resources(toffoli=toffoli, toffoli_depth=toffoli - max(0, n - 3), qubits=n + product + 2 + temp,
+                         ancillae=2 + temp)
 
 
 # # test
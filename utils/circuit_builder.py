@@ -0,0 +1,153 @@
+import cirq
+
+"""
+Bulk construction of circuits for the builders (arithmetics, comparators, BlackBox models).
+
+cirq.Circuit.append re-flattens, regroups and re-validates the operations at every call, and the moment-by-moment
+appends of the builders spend most of their time there. CircuitBuilder keeps the moments as plain lists of
+operations with the last moment index of every qubit and measurement key, places each operation in O(1) and creates
+the cirq.Moments once in to_circuit() (cirq.Circuit.from_moments). Moments appended intact (e.g. the moments of a
+subcircuit) are kept as they are. Its append follows the placement rules of cirq.Circuit.append at the end of a
+circuit, so a builder produces exactly the circuit the appends would.
+"""
+
+def _keys(op: cirq.Operation) -> tuple:
+  # (measurement keys, control keys) of an operation, skipping the protocol calls for plain unitary gates
+  if isinstance(op, cirq.GateOperation) and not isinstance(op.gate, cirq.MeasurementGate):
+    return (), ()
+  return tuple(cirq.measurement_key_objs(op)), tuple(cirq.control_keys(op))
+
+def _flatten(tree, mops: list) -> list:
+  # operations and moments of an op tree in order, the moments of a circuit being kept intact
+  if isinstance(tree, (cirq.Operation, cirq.Moment)):
+    mops.append(tree)
+  elif isinstance(tree, cirq.AbstractCircuit):
+    mops.extend(tree.moments)
+  else:
+    for subtree in tree:
+      _flatten(subtree, mops)
+  return mops
+
+class CircuitBuilder:
+  def __init__(self) -> None:
+    # moment i is the intact moment intact[i] (None for a new one) followed by the operations ops[i]
+    self.intact = []
+    self.ops = []
+    # index of the last moment acting on each qubit, measuring each key and conditioned on each key, over the
+    # first 'synced' moments. Intact moments are only scanned once an operation has to be placed after them, so
+    # appending subcircuits costs nothing beyond the moment list.
+    self.qubit_index = {}
+    self.measurement_index = {}
+    self.control_index = {}
+    self.synced = 0
+
+  def __len__(self) -> int:
+    return len(self.ops)
+
+  def _sync(self) -> None:
+    while self.synced < len(self.ops):
+      if self.intact[self.synced] is not None:
+        for op in self.intact[self.synced]:
+          self._track(op, _keys(op), self.synced)
+      self.synced += 1
+
+  def _earliest(self, op: cirq.Operation, keys: tuple) -> int:
+    # first moment after every moment the operation conflicts with
+    self._sync()
+    measurements, controls = keys
+    index = max((self.qubit_index.get(q, -1) for q in op.qubits), default=-1)
+    for key in measurements:
+      index = max(index, self.measurement_index.get(key, -1), self.control_index.get(key, -1))
+    for key in controls:
+      index = max(index, self.measurement_index.get(key, -1))
+    return index + 1
+
+  def _track(self, op: cirq.Operation, keys: tuple, index: int) -> None:
+    measurements, controls = keys
+    for q in op.qubits:
+      self.qubit_index[q] = index
+    for key in measurements:
+      self.measurement_index[key] = index
+    for key in controls:
+      self.control_index[key] = max(self.control_index.get(key, -1), index)
+
+  def _place(self, op: cirq.Operation, keys: tuple, index: int) -> None:
+    self._sync()
+    if index == len(self.ops):
+      self.intact.append(None)
+      self.ops.append([])
+    self.ops[index].append(op)
+    self._track(op, keys, index)
+
+  def _append_moment(self, moment: cirq.Moment) -> None:
+    self.intact.append(moment)
+    self.ops.append([])
+
+  def append(self, moment_or_operation_tree, strategy: cirq.InsertStrategy = cirq.InsertStrategy.EARLIEST) -> None:
+    """
+    Same placement as cirq.Circuit.append: moments (and the moments of circuits) are appended intact, operations are
+    placed as early as possible (EARLIEST), or in a new moment inlining the following operations while they fit in
+    the last moment (NEW_THEN_INLINE), or each in a new moment (NEW).
+    """
+    mops = _flatten(moment_or_operation_tree, [])
+    if strategy == cirq.InsertStrategy.NEW_THEN_INLINE:
+      self._append_new_then_inline(mops)
+      return
+    if strategy not in (cirq.InsertStrategy.EARLIEST, cirq.InsertStrategy.NEW):
+      raise ValueError("Unsupported insertion strategy {}".format(strategy))
+    for mop in mops:
+      if isinstance(mop, cirq.Moment):
+        self._append_moment(mop)
+      else:
+        keys = _keys(mop)
+        index = self._earliest(mop, keys) if strategy == cirq.InsertStrategy.EARLIEST else len(self.ops)
+        self._place(mop, keys, index)
+
+  def _append_new_then_inline(self, mops: list) -> None:
+    # consecutive operations sharing a moment are grouped as cirq does, the first group opens a new moment and the
+    # next ones go to the last moment when all their operations fit there
+    new = True
+    batch, batch_keys, qubits, measurements, controls = [], [], set(), set(), set()
+
+    def flush():
+      if batch:
+        last = len(self.ops) - 1
+        fits = not new and all(self._earliest(op, keys) <= last for op, keys in zip(batch, batch_keys))
+        index = last if fits else len(self.ops)
+        for op, keys in zip(batch, batch_keys):
+          self._place(op, keys, index)
+
+    for mop in mops:
+      if isinstance(mop, cirq.Moment):
+        flush()
+        batch, batch_keys, qubits, measurements, controls = [], [], set(), set(), set()
+        self._append_moment(mop)
+        new = False
+        continue
+      keys = _keys(mop)
+      op_measurements, op_controls = keys
+      if (not qubits.isdisjoint(mop.qubits) or not measurements.isdisjoint(op_measurements)
+          or not measurements.isdisjoint(op_controls) or not controls.isdisjoint(op_measurements)):
+        flush()
+        new = False
+        batch, batch_keys, qubits, measurements, controls = [], [], set(), set(), set()
+      batch.append(mop)
+      batch_keys.append(keys)
+      qubits.update(mop.qubits)
+      measurements.update(op_measurements)
+      controls.update(op_controls)
+    flush()
+
+  def __iadd__(self, other):
+    self.append(other)
+    return self
+
+  def to_circuit(self) -> cirq.Circuit:
+    """ Create the cirq.Circuit of the moments built so far """
+    moments = []
+    for moment, ops in zip(self.intact, self.ops):
+      if moment is None:
+        moments.append(cirq.Moment.from_ops(*ops))
+      else:
+        moments.append(moment.with_operations(*ops) if ops else moment)
+    return cirq.Circuit.from_moments(*moments)
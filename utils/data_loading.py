@@ -0,0 +1,265 @@
+import cirq
+import sympy
+from utils.ancilla import AncillaPool
+from utils.circuit_builder import CircuitBuilder
+
+"""
+Data loading oracles for the BlackBox models when the amplitudes are given as a table 'input_data':
+  O|x>_out|0>_data -> |x>_out|A[x]>_data
+
+Each entry A[x] is a binary string (most significant bit first) or, for a parameterized oracle, a list of
+sympy symbols with the same bit order. The symbols are resolved with data_resolver() so that one compiled
+circuit can be simulated for many tables through cirq.Simulator().simulate_sweep / run_sweep.
+"""
+
+def symbolic_data(num_entries: int, num_bits: int, name: str = "a") -> list:
+  """
+  Create a table of symbolic data words, the j-th bit of the i-th entry is the symbol '{name}_{i}_{j}'.
+
+  Args:
+      - num_entries: number of entries in the table (2**num_out_qubits)
+      - num_bits: number of bits in each entry (num_data_qubits)
+      - name: prefix of the symbols
+  Return:
+      A list of num_entries lists of sympy.Symbol
+  """
+  return [[sympy.Symbol("{}_{}_{}".format(name, i, j)) for j in range(num_bits)] for i in range(num_entries)]
+
+def data_resolver(input_data: list, name: str = "a") -> cirq.ParamResolver:
+  """
+  Bind the symbols of symbolic_data() to the bits of 'input_data'.
+
+  Args:
+      - input_data: list of binary strings, one per entry
+      - name: prefix of the symbols
+  Return:
+      A cirq.ParamResolver assigning 0/1 to every data bit symbol
+  """
+  return cirq.ParamResolver({"{}_{}_{}".format(name, i, j): int(bit)
+                             for i, ai in enumerate(input_data) for j, bit in enumerate(ai)})
+
+def word_to_circuit(ai, data: list) -> cirq.Circuit:
+  """
+  Write the data word 'ai' to the data register with X gates. The j-th bit of the word is stored in
+  data[len(data)-1-j], i.e. the least significant bit of the word goes to data[0].
+  """
+  circuit = cirq.Circuit()
+  for j, value in enumerate(ai):
+    if isinstance(value, sympy.Basic):
+      circuit.append(cirq.X(data[len(data)-1-j])**value)
+    elif value == '1':
+      circuit.append(cirq.X(data[len(data)-1-j]))
+  return circuit
+
+def basis_encoding_oracle(input_data: list, out: list, data: list) -> cirq.Circuit:
+  """
+  Load the data array onto the data register, controlled by register out as index.
+  Entry i is written by a CircuitOperation controlled on all qubits of out (out[0] being the least significant bit,
+  as in the readout of the BlackBox models).
+  """
+  oracle = CircuitBuilder()
+  for i in range(2**len(out)):
+    circ_ai = word_to_circuit(input_data[i], data)
+    circ_ai_to_op = cirq.CircuitOperation(circ_ai.freeze())
+    ai_encode_gate = circ_ai_to_op.controlled_by(*out, control_values=[int(k) for k in format(i, "b").zfill(len(out))[::-1]])
+    oracle.append(ai_encode_gate)
+  return oracle.to_circuit()
+
+def _is_zero_word(ai) -> bool:
+  return all(not isinstance(value, sympy.Basic) and value != '1' for value in ai)
+
+def qrom_oracle(input_data: list, out: list, data: list, ancillae: list = None,
+                measurement_uncompute: bool = False, key_prefix: str = "qrom", pool: AncillaPool = None) -> cirq.Circuit:
+  """
+  QROM data loader based on unary iteration (Babbush et al., https://arxiv.org/abs/1805.03662).
+
+  The index bits are walked from out[-1] (most significant) to out[0]. Each level keeps one ancilla holding the AND
+  of the index bits above it; switching from the 0- to the 1-branch of a level costs a single CNOT, so the whole
+  iteration costs 2*(2^n-2) Toffolis (2^n-2 with measurement_uncompute) and n-1 ancillae, instead of one
+  n-controlled operation per entry. Entries are written with CNOTs from the leaf ancilla; subtrees whose entries are
+  all zero are skipped.
+
+  Args:
+      - input_data: 2**len(out) data words, see word_to_circuit
+      - out: index register, out[0] is the least significant bit
+      - data: data register
+      - ancillae: len(out)-1 clean ancillae, created as 'qrom_anc{i}' when None
+      - measurement_uncompute: uncompute the AND ancillae with an X-basis measurement and a classically controlled CZ
+        instead of a Toffoli. The circuit is then not invertible by cirq.inverse, use it only where the oracle is
+        applied without being inverted (e.g. the final uncompute of the data register).
+      - key_prefix: prefix of the measurement keys
+      - pool: if given (and ancillae is None), the ancillae are borrowed from the pool and freed at the end
+  Return:
+      A cirq.Circuit implementing |x>_out|y>_data -> |x>_out|y xor A[x]>_data
+  """
+  borrowed = ancillae is None and pool is not None
+  if borrowed:
+    ancillae = pool.allocate(len(out)-1)
+  elif ancillae is None:
+    ancillae = [cirq.NamedQubit('qrom_anc' + str(i)) for i in range(len(out)-1)]
+  bits = out[::-1]
+  ops = []
+  num_measurements = [0]
+
+  def subtree_is_zero(prefix, depth):
+    size = 2**(len(bits)-depth)
+    return all(_is_zero_word(ai) for ai in input_data[prefix*size:(prefix+1)*size])
+
+  def leaf(ctrl, index):
+    ai = input_data[index]
+    for j, value in enumerate(ai):
+      if isinstance(value, sympy.Basic):
+        ops.append(cirq.CNOT(ctrl, data[len(data)-1-j])**value)
+      elif value == '1':
+        ops.append(cirq.CNOT(ctrl, data[len(data)-1-j]))
+
+  def uncompute_and(ctrl, q, anc):
+    if measurement_uncompute:
+      key = "{}_{}".format(key_prefix, num_measurements[0])
+      num_measurements[0] += 1
+      ops.append(cirq.H(anc))
+      ops.append(cirq.measure(anc, key=key))
+      ops.append(cirq.CZ(ctrl, q).with_classical_controls(key))
+      ops.append(cirq.X(anc).with_classical_controls(key))
+    else:
+      ops.append(cirq.TOFFOLI(ctrl, q, anc))
+
+  def iterate(ctrl, depth, prefix):
+    if depth == len(bits):
+      leaf(ctrl, prefix)
+      return
+    if subtree_is_zero(prefix, depth):
+      return
+    q = bits[depth]
+    zero_branch = not subtree_is_zero(2*prefix, depth+1)
+    one_branch = not subtree_is_zero(2*prefix+1, depth+1)
+    if ctrl is None:
+      # top level: the most significant index bit itself selects the branch
+      if zero_branch:
+        ops.append(cirq.X(q))
+        iterate(q, depth+1, 2*prefix)
+        ops.append(cirq.X(q))
+      if one_branch:
+        iterate(q, depth+1, 2*prefix+1)
+      return
+
+    anc = ancillae[depth-1]
+    if zero_branch:
+      # anc = ctrl AND NOT q
+      ops.append(cirq.X(q))
+      ops.append(cirq.TOFFOLI(ctrl, q, anc))
+      ops.append(cirq.X(q))
+      iterate(anc, depth+1, 2*prefix)
+      if one_branch:
+        # anc = ctrl AND q
+        ops.append(cirq.CNOT(ctrl, anc))
+        iterate(anc, depth+1, 2*prefix+1)
+        uncompute_and(ctrl, q, anc)
+      else:
+        ops.append(cirq.X(q))
+        uncompute_and(ctrl, q, anc)
+        ops.append(cirq.X(q))
+    else:
+      ops.append(cirq.TOFFOLI(ctrl, q, anc))
+      iterate(anc, depth+1, 2*prefix+1)
+      uncompute_and(ctrl, q, anc)
+
+  iterate(None, 0, 0)
+  if borrowed:
+    pool.free(ancillae)
+  return cirq.Circuit(ops)
+
+def gray_rank(i: int) -> int:
+  """
+  Position of index i in the reflected binary Gray code sequence (inverse Gray code).
+  """
+  rank = i
+  while i:
+    i >>= 1
+    rank ^= i
+  return rank
+
+def _word_weight(ai) -> int:
+  return sum(1 for value in ai if isinstance(value, sympy.Basic) or value == '1')
+
+def sparse_oracle(input_data: list, out: list, data: list, ancilla: cirq.Qid = None,
+                  pool: AncillaPool = None) -> cirq.Circuit:
+  """
+  Data loader for sparse or piecewise-constant tables.
+
+  Zero entries are skipped. Indices sharing the same (non-symbolic) data word are grouped: the group is marked on
+  one ancilla with a multi-controlled X per index, the word is written with CNOTs from the ancilla and the mark is
+  uncomputed, which is cheaper than one controlled word per index as soon as the word has more than two set bits.
+  The controls are all on |1>, the 0-controls are X toggles on out kept across consecutive operations. Indices are
+  visited in Gray-code order, so consecutive controls differ in about one bit and only the differing toggles are
+  emitted.
+
+  Args:
+      - input_data: 2**len(out) data words, see word_to_circuit
+      - out: index register, out[0] is the least significant bit
+      - data: data register
+      - ancilla: clean ancilla marking a group, created as 'oracle_anc' when None
+      - pool: if given (and ancilla is None), the ancilla is borrowed from the pool and freed at the end
+  Return:
+      A cirq.Circuit implementing |x>_out|y>_data -> |x>_out|y xor A[x]>_data
+  """
+  borrowed = ancilla is None and pool is not None
+  if borrowed:
+    ancilla = pool.allocate(1)[0]
+  elif ancilla is None:
+    ancilla = cirq.NamedQubit('oracle_anc')
+  # group the non-zero entries by data word, symbolic words are never shared between entries
+  groups = {}
+  for i, ai in enumerate(input_data[:2**len(out)]):
+    if not _is_zero_word(ai):
+      groups.setdefault(tuple(ai), []).append(i)
+  for indices in groups.values():
+    indices.sort(key=gray_rank)
+  ordered = sorted(groups.items(), key=lambda item: gray_rank(item[1][0]))
+
+  ops = []
+  mask = [0]  # bit j set when out[j] is currently toggled
+
+  def select(i):
+    # toggle out so that index i reads as all ones
+    target = ~i & (2**len(out)-1)
+    for j in range(len(out)):
+      if (mask[0] ^ target) >> j & 1:
+        ops.append(cirq.X(out[j]))
+    mask[0] = target
+
+  for word, indices in ordered:
+    if len(indices) > 1 and _word_weight(word) > 2:
+      for i in indices:
+        select(i)
+        ops.append(cirq.X(ancilla).controlled_by(*out))
+      for j, value in enumerate(word):
+        if value == '1':
+          ops.append(cirq.CNOT(ancilla, data[len(data)-1-j]))
+      for i in indices[::-1]:
+        select(i)
+        ops.append(cirq.X(ancilla).controlled_by(*out))
+    else:
+      circ_ai = cirq.CircuitOperation(word_to_circuit(word, data).freeze())
+      for i in indices:
+        select(i)
+        ops.append(circ_ai.controlled_by(*out))
+  select(2**len(out)-1)
+  if borrowed:
+    pool.free([ancilla])
+  return cirq.Circuit(ops)
+
+def data_oracle(input_data: list, out: list, data: list, method: str = "qrom", **kwargs) -> cirq.Circuit:
+  """
+  Build the data loading oracle for 'input_data' with the chosen method: 'qrom' (unary iteration), 'sparse'
+  (zero entries skipped, equal words grouped, Gray-code order) or 'basis' (one controlled operation per entry).
+  Extra keyword arguments (e.g. pool, see AncillaPool) are passed to the 'qrom' and 'sparse' builders.
+  """
+  if method == "qrom":
+    return qrom_oracle(input_data, out, data, **kwargs)
+  elif method == "sparse":
+    return sparse_oracle(input_data, out, data, **kwargs)
+  elif method == "basis":
+    return basis_encoding_oracle(input_data, out, data)
+  else:
+    raise ValueError("Unknown data oracle {}".format(method))
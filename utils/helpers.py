@@ -39,6 +39,23 @@ def angle_to_register(ang_register: list, theta: float) -> cirq.Circuit:
   return circuit
 
 
+def ratio_bits(out: int, sigma: float, t: int) -> str:
+  """
+  t-bit approximation of the ratio of Eq.81 for the index `out`, as a binary string (most significant bit first).
+  """
+  if out == 0:
+    r_out =  1
+  else:
+    r_out = np.exp((2**(2*np.floor(np.log2(out)))-out**2)/(4*sigma**2))
+
+  if r_out < 1:
+    r_out = (np.floor(2**t * r_out))
+
+  r_out = format(int(r_out), "b").zfill(t) # convert to binary string
+
+  assert len(r_out) == t
+  return r_out
+
 def ratio_to_register(out: int, sigma: float,
                       tmp_register: list) -> cirq.Circuit:
   """
@@ -54,21 +71,7 @@ def ratio_to_register(out: int, sigma: float,
   Return:
       A cirq.Circuit() store value of r_out to tmp_register
   """
-
-  # Calculate t-bit approximation of ratio
-  t = len(tmp_register)
-
-  if out == 0:
-    r_out =  1
-  else:
-    r_out = np.exp((2**(2*np.floor(np.log2(out)))-out**2)/(4*sigma**2))
-
-  if r_out < 1:
-    r_out = (np.floor(2**t * r_out))
-
-  r_out = format(int(r_out), "b").zfill(t) # convert to binary string
-
-  assert len(r_out) == t
+  r_out = ratio_bits(out, sigma, len(tmp_register))
 
   # Store the value in tmp_register
   circuit = cirq.Circuit()
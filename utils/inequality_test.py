@@ -2,22 +2,138 @@
 The implementation is based on https://arxiv.org/pdf/1711.10460.pdf"""
 
 import math
+from collections import OrderedDict
 import cirq
+from utils.ancilla import AncillaPool
+from utils.circuit_builder import CircuitBuilder
+from utils.resource_model import resources
+
+# Comparator circuits and their inverses. Templates are built once per register length on placeholder qubits
+# and remapped onto the caller's registers (and pool ancillae); the remapped circuits are cached as well since the
+# models compare the same registers repeatedly. The least recently used entry is evicted past TEMPLATE_CACHE_SIZE
+# entries.
+TEMPLATE_CACHE_SIZE = 32
+_template_cache = OrderedDict()
+
+# Tag of the blocks "compute, copy the result, uncompute" that are their own inverse (see invert_circuit)
+SELF_INVERSE = "self_inverse"
+
+def clear_comparator_cache() -> None:
+  """ Drop all cached comparator templates """
+  _template_cache.clear()
+
+def _cache_lookup(key):
+  if key in _template_cache:
+    _template_cache.move_to_end(key)
+    return _template_cache[key]
+  return None
+
+def _cache_store(key, value) -> None:
+  _template_cache[key] = value
+  if len(_template_cache) > TEMPLATE_CACHE_SIZE:
+    _template_cache.popitem(last=False)
+
+def _comparator_template(length: int, measurement_uncompute: bool = False) -> tuple:
+  """
+  Return (placeholder A, placeholder B, ancillae, circuit, inverse circuit) of a comparator on registers of 'length'
+  qubits. The ancillae are the default named ones ('ancilla_comp2_*', then 'ancilla_fin', or 'ancilla_carry*').
+  """
+  key = (length, measurement_uncompute)
+  template = _cache_lookup(key)
+  if template is None:
+    A = [cirq.NamedQubit('_comparator_a' + str(i)) for i in range(length)]
+    B = [cirq.NamedQubit('_comparator_b' + str(i)) for i in range(length)]
+    comparator = Comparator(A, B, use_cache=False, measurement_uncompute=measurement_uncompute)
+    circuit = comparator.construct_circuit()
+    template = (A, B, comparator.ancillae, circuit, comparator.inverse_circuit())
+    _cache_store(key, template)
+  return template
+
+def _num_comparator_ancillae(length: int, measurement_uncompute: bool = False) -> int:
+  return len(_comparator_template(length, measurement_uncompute)[2])
+
+def _cached_comparator(A: list, B: list, ancillae: list = None, measurement_uncompute: bool = False) -> tuple:
+  """
+  Return (circuit, inverse circuit) of a comparator on A and B, remapped from the template of the same length.
+  The ancillae of the template are remapped onto 'ancillae' when given, otherwise they keep their default names.
+  """
+  key = (tuple(A), tuple(B), tuple(ancillae) if ancillae is not None else None, measurement_uncompute)
+  circuits = _cache_lookup(key)
+  if circuits is None:
+    template_A, template_B, template_ancillae, template_circuit, template_inverse = _comparator_template(
+      len(A), measurement_uncompute)
+    qubit_map = dict(zip(template_A + template_B, list(A) + list(B)))
+    if ancillae is not None:
+      qubit_map.update(zip(template_ancillae, ancillae))
+    circuits = (template_circuit.transform_qubits(lambda q: qubit_map.get(q, q)),
+                template_inverse.transform_qubits(lambda q: qubit_map.get(q, q)))
+    _cache_store(key, circuits)
+  # hand out copies so callers cannot modify the cached circuits
+  return circuits[0].copy(), circuits[1].copy()
+
+def self_inverse_block(circuit: cirq.Circuit) -> cirq.Circuit:
+  """
+  Wrap a block equal to its own inverse (e.g. a comparison, the copy of its result and a measurement-based
+  uncompute) into a tagged cirq.CircuitOperation, which invert_circuit re-emits instead of inverting.
+  """
+  return cirq.Circuit(cirq.CircuitOperation(circuit.freeze()).with_tags(SELF_INVERSE))
+
+def _invert_operation(op: cirq.Operation) -> cirq.Operation:
+  if SELF_INVERSE in op.tags:
+    return op
+  if isinstance(op.untagged, cirq.CircuitOperation) and op.untagged.circuit.has_measurements():
+    # (U^k)^-1 = (U^-1)^k, with U inverted block by block
+    return op.untagged.replace(circuit=invert_circuit(op.untagged.circuit.unfreeze()).freeze())
+  return cirq.inverse(op)
+
+def invert_circuit(circuit: cirq.Circuit) -> cirq.Circuit:
+  """
+  Same as cirq.inverse(circuit), except that blocks wrapped by self_inverse_block are kept as they are, so circuits
+  using the measurement-based comparator can still be inverted.
+  """
+  return cirq.Circuit.from_moments(*(cirq.Moment.from_ops(*(_invert_operation(op) for op in moment))
+                                      for moment in reversed(circuit)))
+
 class Comparator:
-  def __init__(self, A, B):
+  def __init__(self, A, B, use_cache: bool = True, pool: AncillaPool = None, measurement_uncompute: bool = False):
     """
         :param A: The quantum register holding the first number
         :param B: The quantum register second number
+        :param use_cache: if True, the circuit is copied from a cached template of the same length
+                 and remapped onto A and B instead of being rebuilt
+        :param pool: if given, the ancillae are allocated from the pool (see release) instead of being
+                 the fixed named qubits 'ancilla_comp2_*' and 'ancilla_fin'
+        :param measurement_uncompute: if True, compare with a carry chain of temporary logical-AND gates
+                 (Gidney, https://arxiv.org/abs/1709.06648) whose uncompute (inverse_circuit) is an X-basis
+                 measurement and a classically controlled CZ per AND, without Toffolis. The uncompute is not
+                 invertible by cirq.inverse, wrap compute / copy / uncompute with test_block.
+                 The chain trades depth for count: its 2^L Toffolis (L = floor(log2 n)) are all on the critical
+                 path, where the tree has a Toffoli-depth of 6L+1, 2(6L+1) with its unitary uncompute. Compute and
+                 uncompute are shallower up to 64 compared bits and deeper from 128 (128 against 86), the compute
+                 alone is deeper from 32 bits (see resource_model).
     """
     self.A = A
     self.B = B
     self.length = len(A)
+    self.use_cache = use_cache
+    self.pool = pool
+    self.measurement_uncompute = measurement_uncompute
+    self.ancillae = []
+
+  def ancilla(self, name: str) -> cirq.NamedQubit:
+    # take the next ancilla from the pool, or create the named one
+    if self.pool is not None:
+      qubit = self.pool.allocate(1)[0]
+    else:
+      qubit = cirq.NamedQubit(name)
+    self.ancillae.append(qubit)
+    return qubit
 
 
   def compare2(self, a0: cirq.NamedQubit, b0: cirq.NamedQubit, a1:cirq.NamedQubit, b1:cirq.NamedQubit, name: str) -> [cirq.Circuit, cirq.NamedQubit, cirq.NamedQubit]:
     # Compare a pair of two bits
-    p = cirq.NamedQubit("ancilla_comp2_{}".format(name))
-    compare2 = cirq.Circuit()
+    p = self.ancilla("ancilla_comp2_{}".format(name))
+    compare2 = CircuitBuilder()
     compare2.append(cirq.X(p))
     compare2.append(cirq.CNOT(b1,a1), strategy=cirq.InsertStrategy.EARLIEST)
     compare2.append(cirq.CNOT(b0,a0), strategy=cirq.InsertStrategy.EARLIEST)
@@ -33,23 +149,73 @@ class Comparator:
 
     compare2.append(cirq.CNOT(b0,a0), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
-    return compare2, a0, b0
+    return compare2.to_circuit(), a0, b0
 
 
   def finalizer(self, a: cirq.NamedQubit, b: cirq.NamedQubit) -> cirq.Circuit:
     # verify b>a
 
-    self.anc1 = cirq.NamedQubit("ancilla_fin")
+    self.anc1 = self.ancilla("ancilla_fin")
 
-    final_cir = cirq.Circuit()
+    final_cir = CircuitBuilder()
     final_cir.append(cirq.X(a), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     final_cir.append(cirq.TOFFOLI(a,b, self.anc1), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
     final_cir.append(cirq.X(a), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
 
-    return final_cir
+    return final_cir.to_circuit()
+
+  def carry_circuit(self) -> tuple:
+    """
+    Measurement-uncomputed comparison: anc1 is the carry out of B + NOT(A) over the compared bits, which is 1 iff B > A.
+    Each carry c_(i+1) = MAJ(NOT a_i, b_i, c_i) = c_i XOR ((NOT a_i XOR c_i) AND (b_i XOR c_i)) takes one logical-AND.
+
+    :return: (compute circuit, measurement-based uncompute circuit)
+    """
+    # same compared bits as the tree of compare2 blocks
+    size = 2**int(math.log2(self.length))
+    A, B = self.A[:size], self.B[:size]
+    carries = [self.ancilla("ancilla_carry{}".format(i)) for i in range(size)]
+    self.anc1 = carries[-1]
+
+    compute = CircuitBuilder()
+    compute.append([cirq.X(a) for a in A])
+    compute.append(cirq.TOFFOLI(A[0], B[0], carries[0]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    for i in range(1, size):
+      compute.append([cirq.CNOT(carries[i-1], A[i]), cirq.CNOT(carries[i-1], B[i])], strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      compute.append(cirq.TOFFOLI(A[i], B[i], carries[i]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      compute.append(cirq.CNOT(carries[i-1], carries[i]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+
+    def uncompute_and(a, b, target, key):
+      # the ancilla holds a AND b: measure it in the X basis, fix the phase (-1)^(ab) on outcome 1 and reset it
+      return [cirq.H(target), cirq.measure(target, key=key),
+              cirq.CZ(a, b).with_classical_controls(key), cirq.X(target).with_classical_controls(key)]
+
+    uncompute = CircuitBuilder()
+    for i in range(size-1, 0, -1):
+      uncompute.append(cirq.CNOT(carries[i-1], carries[i]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      uncompute.append(uncompute_and(A[i], B[i], carries[i], "comparator_carry{}".format(i)), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      uncompute.append([cirq.CNOT(carries[i-1], A[i]), cirq.CNOT(carries[i-1], B[i])], strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    uncompute.append(uncompute_and(A[0], B[0], carries[0], "comparator_carry0"), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    uncompute.append([cirq.X(a) for a in A], strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    return compute.to_circuit(), uncompute.to_circuit()
 
   def construct_circuit(self,) -> cirq.Circuit:
-    self.circuit = cirq.Circuit()
+    if self.use_cache:
+      if self.pool is not None:
+        self.ancillae = self.pool.allocate(_num_comparator_ancillae(self.length, self.measurement_uncompute))
+        self.circuit, self.inverse = _cached_comparator(self.A, self.B, self.ancillae, self.measurement_uncompute)
+      else:
+        self.ancillae = list(_comparator_template(self.length, self.measurement_uncompute)[2])
+        self.circuit, self.inverse = _cached_comparator(self.A, self.B, measurement_uncompute=self.measurement_uncompute)
+      self.anc1 = self.ancillae[-1]
+      return self.circuit
+
+    self.ancillae = []
+    if self.measurement_uncompute:
+      self.circuit, self.inverse = self.carry_circuit()
+      return self.circuit
+
+    circuit = CircuitBuilder()
     two_bitwise_compare = {}
     qubits_out_acc_layer = {}
     for j in range(0, int(math.log2(self.length))):
@@ -70,10 +236,58 @@ class Comparator:
 
     final_compare = self.finalizer(*qubits_out_acc_layer[int(math.log2(self.length))-1][0])
     for j in range(0, int(math.log2(self.length))):
-      self.circuit.append((two_bitwise_compare[j]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
-    self.circuit.append(final_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+      circuit.append((two_bitwise_compare[j]), strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    circuit.append(final_compare, strategy=cirq.InsertStrategy.NEW_THEN_INLINE)
+    self.circuit = circuit.to_circuit()
     return self.circuit
 
+  def inverse_circuit(self) -> cirq.Circuit:
+    """
+    Uncompute the comparator built by construct_circuit (the cached inverse is remapped when available,
+    measurement-based with measurement_uncompute)
+    """
+    if self.use_cache or self.measurement_uncompute:
+      return self.inverse
+    return cirq.inverse(self.circuit)
+
+  def test_block(self, circuit: cirq.Circuit) -> cirq.Circuit:
+    """
+    Return 'circuit' (construct_circuit, copy of anc1, inverse_circuit), wrapped by self_inverse_block when the
+    uncompute is measurement-based so that invert_circuit can still invert the enclosing circuit
+    """
+    if self.measurement_uncompute:
+      return self_inverse_block(circuit)
+    return circuit
+
+  @staticmethod
+  def resource_model(n: int, measurement_uncompute: bool = False, uncompute: bool = False) -> dict:
+    """
+    Closed-form resources of construct_circuit on registers of n >= 2 qubits (see utils.resource_model).
+    The tree compares 2^L bits (L = floor(log2 n)) with K = n//2 + n//4 + ... compare2 blocks of 6 Toffolis over L
+    layers and a final Toffoli: 6K+1 Toffolis of depth 6L+1, with K+1 ancillae. The carry chain of
+    measurement_uncompute takes one Toffoli and one ancilla per compared bit, in sequence (Toffoli-depth 2^L), and
+    its uncompute none.
+
+    :param uncompute: model construct_circuit followed by inverse_circuit
+    """
+    if n < 2:
+      raise ValueError("Comparator needs registers of at least 2 qubits")
+    layers = int(math.log2(n))
+    if measurement_uncompute:
+      size = 2**layers
+      return resources(toffoli=size, toffoli_depth=size, qubits=3*size, ancillae=size)
+    blocks = sum(n//2**(j+1) for j in range(layers))
+    factor = 2 if uncompute else 1
+    return resources(toffoli=factor*(6*blocks + 1), toffoli_depth=factor*(6*layers + 1),
+                     qubits=4*(n//2) + blocks + 1, ancillae=blocks + 1)
+
+  def release(self) -> None:
+    """
+    Return the ancillae to the pool, once the circuit of inverse_circuit has been appended after construct_circuit
+    """
+    if self.pool is not None:
+      self.pool.free(self.ancillae)
+
 # if __name__ == "__main__":
 #     # Test: verify B>A or not
 #     A = "0110"
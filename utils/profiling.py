@@ -0,0 +1,164 @@
+import functools
+import json
+import os
+import time
+import tracemalloc
+import cirq
+try:
+  import resource
+except ImportError:  # not available on Windows
+  resource = None
+
+"""
+Per-stage profiling of circuit construction, decomposition, counting and simulation.
+
+Stages are marked with the stage() context manager or the profiled decorator. Profiling is off by default and a
+disabled stage costs one flag test. When enabled (enable(), or the environment variable QSP_PROFILE=<file>, which
+worker processes inherit), every stage appends one JSON line to the output file:
+
+  {"stage": ..., "path": "outer/inner", "pid": ..., "wall": s, "cpu": s, "tracemalloc_peak": bytes or null,
+   "max_rss_kb": ..., plus the fields given to the stage}
+
+Circuits given as fields (or returned by a profiled function) are recorded as their numbers of operations, moments
+and qubits. The tracemalloc peak is only measured with trace_memory=True (QSP_PROFILE_MEMORY=1) since tracing slows
+the program down; max_rss_kb is the peak resident memory of the process so far. Lines of several runs (or processes)
+are aggregated with aggregate(), or with: python -m experimental.profile_report profile.jsonl [...]
+"""
+
+_output = None
+_stack = []
+
+def enable(path: str, trace_memory: bool = False) -> None:
+  """
+  Start appending stage records to 'path'.
+
+  :param path: JSON lines output file
+  :param trace_memory: also measure the tracemalloc peak of every stage
+  """
+  global _output
+  disable()
+  _output = open(path, 'a', buffering=1)
+  if trace_memory and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+def disable() -> None:
+  global _output
+  if _output is not None:
+    _output.close()
+    _output = None
+
+def is_enabled() -> bool:
+  return _output is not None
+
+def circuit_fields(circuit: cirq.AbstractCircuit) -> dict:
+  """ Size of a circuit as recorded by the stages (CircuitOperations count as one operation) """
+  return {"operations": sum(len(moment) for moment in circuit), "moments": len(circuit),
+          "qubits": len(circuit.all_qubits())}
+
+class _NullStage:
+  def add(self, **fields) -> None:
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc) -> bool:
+    return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+  def __init__(self, name: str, fields: dict) -> None:
+    self.name = name
+    self.fields = dict(fields)
+    self.child_peak = 0
+
+  def add(self, **fields) -> None:
+    """ Record more fields, e.g. the circuit built by the stage """
+    self.fields.update(fields)
+
+  def __enter__(self):
+    if tracemalloc.is_tracing():
+      if _stack:
+        _stack[-1].child_peak = max(_stack[-1].child_peak, tracemalloc.get_traced_memory()[1])
+      tracemalloc.reset_peak()
+    _stack.append(self)
+    self.cpu = time.process_time()
+    self.wall = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc) -> bool:
+    wall = time.perf_counter() - self.wall
+    cpu = time.process_time() - self.cpu
+    _stack.pop()
+    peak = None
+    if tracemalloc.is_tracing():
+      peak = max(self.child_peak, tracemalloc.get_traced_memory()[1])
+      if _stack:
+        _stack[-1].child_peak = max(_stack[-1].child_peak, peak)
+    record = {"stage": self.name, "path": "/".join([stage.name for stage in _stack] + [self.name]),
+              "pid": os.getpid(), "wall": wall, "cpu": cpu, "tracemalloc_peak": peak,
+              "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None}
+    if exc[0] is not None:
+      record["error"] = exc[0].__name__
+    for key, value in self.fields.items():
+      if isinstance(value, cirq.AbstractCircuit):
+        record.update(circuit_fields(value))
+      else:
+        record[key] = value
+    if _output is not None:
+      _output.write(json.dumps(record, default=str) + "\n")
+    return False
+
+def stage(name: str, **fields):
+  """
+  Context manager profiling the enclosed block as the stage 'name', with extra 'fields' in its record (e.g. n=8).
+  It returns an object whose add(**fields) records more fields.
+  """
+  if _output is None:
+    return _NULL_STAGE
+  return _Stage(name, fields)
+
+def profiled(function=None, name: str = None):
+  """
+  Decorator profiling every call as a stage named after the function (its __qualname__ unless 'name' is given).
+  A returned circuit is recorded with circuit_fields.
+  """
+  def decorator(function):
+    stage_name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if _output is None:
+        return function(*args, **kwargs)
+      with _Stage(stage_name, {}) as current:
+        result = function(*args, **kwargs)
+        if isinstance(result, cirq.AbstractCircuit):
+          current.add(circuit=result)
+        return result
+    return wrapper
+  return decorator(function) if function is not None else decorator
+
+def aggregate(paths: list) -> dict:
+  """
+  Totals per stage path over JSON lines files: number of calls, wall and CPU times, largest tracemalloc peak and RSS.
+  """
+  totals = {}
+  for path in paths:
+    with open(path) as in_file:
+      for line in in_file:
+        if not line.strip():
+          continue
+        record = json.loads(line)
+        total = totals.setdefault(record["path"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "tracemalloc_peak": None,
+                                                   "max_rss_kb": None})
+        total["calls"] += 1
+        total["wall"] += record["wall"]
+        total["cpu"] += record["cpu"]
+        for key in ("tracemalloc_peak", "max_rss_kb"):
+          if record.get(key) is not None:
+            total[key] = max(total[key] or 0, record[key])
+  return totals
+
+if os.environ.get("QSP_PROFILE"):
+  enable(os.environ["QSP_PROFILE"], trace_memory=os.environ.get("QSP_PROFILE_MEMORY", "") not in ("", "0"))
@@ -0,0 +1,118 @@
+import gzip
+import io
+import cirq
+from cirq.circuits.qasm_output import QasmTwoQubitGate, QasmUGate
+
+"""
+Streaming OpenQASM 2.0 writer for circuits too large to be materialized (millions of gates once decomposed).
+
+Operations are taken one at a time from any iterable (e.g. a generator of decomposed operations) and written with
+cirq.qasm through buffered I/O, so the memory used does not grow with the number of gates. Qubits and measurement
+keys not declared in the header are declared on first use, operations without an OpenQASM translation are decomposed
+on the fly as cirq.Circuit.to_qasm does and CircuitOperations are unrolled one repetition at a time.
+"""
+
+def open_qasm(path: str, compress: bool = None, buffer_size: int = 1 << 20, compresslevel: int = 6):
+  """
+  Open 'path' for writing OpenQASM text through a buffer of 'buffer_size' bytes, gzip-compressed when 'compress' is
+  True (by default when the path ends with '.gz').
+  """
+  if compress is None:
+    compress = str(path).endswith('.gz')
+  if compress:
+    raw = gzip.GzipFile(path, 'wb', compresslevel=compresslevel)
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), encoding='ascii')
+  return open(path, 'w', buffering=buffer_size, encoding='ascii')
+
+def _matrix_gate(op: cirq.Operation):
+  # last resort of cirq.Circuit.to_qasm: one- and two-qubit unitaries written from their matrix
+  if len(op.qubits) not in (1, 2):
+    return NotImplemented
+  matrix = cirq.unitary(op, None)
+  if matrix is None:
+    return NotImplemented
+  if len(op.qubits) == 1:
+    return QasmUGate.from_matrix(matrix).on(*op.qubits)
+  return QasmTwoQubitGate.from_matrix(matrix).on(*op.qubits)
+
+class QasmWriter:
+  def __init__(self, out_file, qubits: list = None, precision: int = 10) -> None:
+    """
+    :param out_file: text file the program is written to (see open_qasm)
+    :param qubits: qubits declared as the register q in the header, in this order. Other qubits are declared as
+                   registers of one qubit when first used
+    :param precision: number of digits of the gate parameters
+    """
+    self.out_file = out_file
+    self.args = cirq.QasmArgs(precision=precision, version='2.0', qubit_id_map={}, meas_key_id_map={},
+                              meas_key_bitcount={})
+    self.num_operations = 0
+    out_file.write('OPENQASM 2.0;\ninclude "qelib1.inc";\n')
+    if qubits:
+      out_file.write('qreg q[{}];\n'.format(len(qubits)))
+      for i, q in enumerate(qubits):
+        self.args.qubit_id_map[q] = 'q[{}]'.format(i)
+
+  def _declare(self, op: cirq.Operation) -> None:
+    for q in op.qubits:
+      if q not in self.args.qubit_id_map:
+        name = 'a{}'.format(len(self.args.qubit_id_map))
+        self.out_file.write('qreg {}[1];\n'.format(name))
+        self.args.qubit_id_map[q] = name + '[0]'
+    if isinstance(op, cirq.GateOperation) and not isinstance(op.gate, cirq.MeasurementGate):
+      return
+    for key in cirq.measurement_key_names(op):
+      if key not in self.args.meas_key_id_map:
+        name = 'm{}'.format(len(self.args.meas_key_id_map))
+        size = cirq.num_qubits(op) if cirq.is_measurement(op) else 1
+        self.out_file.write('creg {}[{}];\n'.format(name, size))
+        self.args.meas_key_id_map[key] = name
+        self.args.meas_key_bitcount[name] = size
+
+  def write(self, op: cirq.Operation) -> None:
+    """
+    Write one operation, decomposed as cirq.Circuit.to_qasm does until every part has an OpenQASM 2.0 translation
+    """
+    if isinstance(op.untagged, cirq.CircuitOperation):
+      circuit_op = op.untagged
+      body = circuit_op.replace(repetitions=1 if circuit_op.repetitions > 0 else -1, repetition_ids=None)
+      body = body.mapped_circuit(deep=False)
+      for _ in range(abs(circuit_op.repetitions)):
+        self.write_all(body.all_operations())
+      return
+    # depth-first, as cirq.decompose, without holding the whole decomposition of a wide multi-controlled gate
+    self._declare(op)
+    qasm = cirq.qasm(op, args=self.args, default=None)
+    if qasm is not None:
+      self.out_file.write(qasm)
+      self.num_operations += 1
+      return
+    sub_ops = cirq.decompose_once(op, default=None)
+    if sub_ops is None:
+      sub_ops = _matrix_gate(op)
+      if sub_ops is NotImplemented:
+        raise ValueError("Operation {!r} has no OpenQASM 2.0 translation".format(op))
+    self.write_all(cirq.flatten_to_ops(sub_ops))
+
+  def write_all(self, operations) -> None:
+    for op in operations:
+      self.write(op)
+
+def write_qasm(operations, path: str, qubits: list = None, compress: bool = None, buffer_size: int = 1 << 20,
+               precision: int = 10) -> int:
+  """
+  Stream 'operations' to an OpenQASM 2.0 file.
+
+  Args:
+      - operations: iterable of operations in circuit order (e.g. circuit.all_operations() or a generator)
+      - path: output file, gzip-compressed when it ends with '.gz' (see open_qasm)
+      - qubits: qubits of the header register, e.g. sorted(circuit.all_qubits())
+      - compress, buffer_size: see open_qasm
+      - precision: number of digits of the gate parameters
+  Return:
+      The number of OpenQASM operations written
+  """
+  with open_qasm(path, compress=compress, buffer_size=buffer_size) as out_file:
+    writer = QasmWriter(out_file, qubits=qubits, precision=precision)
+    writer.write_all(operations)
+  return writer.num_operations
@@ -1,32 +1,25 @@
 # Scaling analysis
 import time
 import os
+import math
+import itertools
 import cirq
-from pyLIQTR.QSP.qsp_helpers import qsp_decompose_once, print_to_openqasm, prettyprint_qsp_to_qasm, count_qubits
+from collections import Counter
+from utils.profiling import profiled, stage
+from utils.qasm_writer import QasmWriter, open_qasm, write_qasm
+from utils.stats_cache import StatsCache
+from pyLIQTR.QSP.qsp_helpers import qsp_decompose_once, prettyprint_qsp_to_qasm, count_qubits
 from pyLIQTR.gate_decomp.cirq_transforms import clifford_plus_t_direct_transform
 
-toffolis = [
-    "CCX",
-    "ccx",
-    "TOFFOLI",
-    "toffoli",
-]
 def count_Toff_gates(circuit):
     '''
     For counting the number of Toffoli Gates in a circuit
     Parameters:
      - circuit: The circuit to count Toffoli Gates in
     Returns:
-     - Toff_gate_counter: the number of Toffoli Gates in the circuit
+     - Toff_gate_counter: the number of Toffoli Gates in the circuit (see gate_counts)
     '''
-    Toff_gate_counter = 0
-        
-    for moment in circuit:
-        for op in moment:
-            if (bool([x for x in toffolis if x in str(op)])):
-                Toff_gate_counter += 1
-
-    return (Toff_gate_counter)
+    return gate_counts(circuit)["toffoli"]
 
 def count_T_gates(circuit):
     '''
@@ -34,72 +27,576 @@ def count_T_gates(circuit):
     Parameters:
      - circuit: The circuit to count T-Gates in
     Returns:
-     - T_gate_counter: the number of T-Gates in the circuit
+     - T_gate_counter: the number of T-Gates in the circuit (see gate_counts)
+    '''
+    return gate_counts(circuit)["t"]
+
+GATE_COUNT_KEYS = ("toffoli", "t", "clifford", "rotation", "measurement", "other")
+
+def _scaled(counts: Counter, factor: int) -> Counter:
+    return Counter({key: factor*value for key, value in counts.items()})
+
+def _and_ladder(num_controls: int) -> Counter:
+    # compute and uncompute the AND of 'num_controls' controls on clean ancillae
+    return Counter({"toffoli": 2*(num_controls - 1)}) if num_controls > 1 else Counter()
+
+def _is_multiple(exponent, step: float) -> bool:
+    return not cirq.is_parameterized(exponent) and abs(exponent/step - round(exponent/step)) < 1e-14
+
+def _phase_counts(exponent) -> Counter:
+    # single-qubit Z**exponent (X**exponent and Y**exponent are Clifford conjugates of it)
+    if _is_multiple(exponent, 2):
+        return Counter()
+    if _is_multiple(exponent, 0.5):
+        return Counter({"clifford": 1})
+    if _is_multiple(exponent, 0.25):
+        return Counter({"t": 1})
+    return Counter({"rotation": 1})
+
+def _gate_counts(gate: cirq.Gate, num_controls: int) -> Counter:
+    '''
+    Counts of 'gate' controlled by 'num_controls' qubits, with the decompositions
+     - Pauli (X, Y, Z) with c controls: Clifford for c <= 1, one Toffoli for c = 2, 2c-3 Toffolis (ladder) beyond
+     - controlled Z**t: Z**(t/2) on the control and the target, Z**(-t/2) and two CNOTs, after the AND of the
+       controls (2(c-1) Toffolis) when c > 1; the rotations cirq.rz/ry/rx (global shift -1/2) need no phase on the
+       control, X**t and Y**t add two Cliffords for the change of basis
+     - controlled H: 2 T and 5 Cliffords, SWAP with c controls: the AND of the controls and a Fredkin (one Toffoli)
+    '''
+    if isinstance(gate, cirq.ControlledGate):
+        return _gate_counts(gate.sub_gate, num_controls + gate.num_controls())
+    base = {cirq.CXPowGate: (cirq.XPowGate, 1), cirq.CZPowGate: (cirq.ZPowGate, 1),
+            cirq.CCXPowGate: (cirq.XPowGate, 2), cirq.CCZPowGate: (cirq.ZPowGate, 2)}
+    for gate_type, (base_type, controls) in base.items():
+        if isinstance(gate, gate_type):
+            return _gate_counts(base_type(exponent=gate.exponent), num_controls + controls)
+    if isinstance(gate, cirq.CSwapGate):
+        return _gate_counts(cirq.SWAP, num_controls + 1)
+
+    if isinstance(gate, (cirq.XPowGate, cirq.YPowGate, cirq.ZPowGate)):
+        basis = Counter() if isinstance(gate, cirq.ZPowGate) else Counter({"clifford": 2})
+        if _is_multiple(gate.exponent, 2):
+            return Counter()
+        if _is_multiple(gate.exponent, 1):
+            if num_controls <= 1:
+                return Counter({"clifford": 1})
+            return Counter({"toffoli": 1 if num_controls == 2 else 2*num_controls - 3})
+        if num_controls == 0:
+            return _phase_counts(gate.exponent) if isinstance(gate, cirq.ZPowGate) else _phase_counts(gate.exponent) + basis
+        half = _phase_counts(gate.exponent/2)
+        num_half = 2 if gate.global_shift == -0.5 else 3
+        return _and_ladder(num_controls) + _scaled(half, num_half) + Counter({"clifford": 2}) + basis
+    if isinstance(gate, cirq.HPowGate) and _is_multiple(gate.exponent, 1):
+        if _is_multiple(gate.exponent, 2):
+            return Counter()
+        if num_controls == 0:
+            return Counter({"clifford": 1})
+        return _and_ladder(num_controls) + Counter({"t": 2, "clifford": 5})
+    if isinstance(gate, cirq.SwapPowGate) and _is_multiple(gate.exponent, 1):
+        if _is_multiple(gate.exponent, 2):
+            return Counter()
+        if num_controls == 0:
+            return Counter({"clifford": 1})
+        return _and_ladder(num_controls) + Counter({"toffoli": 1, "clifford": 2})
+    if isinstance(gate, cirq.MeasurementGate):
+        return Counter({"measurement": 1})
+    if isinstance(gate, (cirq.IdentityGate, cirq.GlobalPhaseGate)):
+        return Counter()
+    if num_controls == 0 and cirq.num_qubits(gate) == 1 and cirq.has_unitary(gate):
+        return Counter({"rotation": 1})
+    return Counter({"other": 1})
+
+def _operation_counts(op: cirq.Operation, num_controls: int, cache: dict) -> Counter:
+    op = op.untagged
+    if isinstance(op, cirq.CircuitOperation):
+        circuit = op.circuit
+        if op.param_resolver.param_dict and cirq.is_parameterized(circuit):
+            circuit = cirq.resolve_parameters(circuit, op.param_resolver).freeze()
+        return _scaled(_circuit_counts(circuit, num_controls, cache), abs(op.repetitions))
+    if isinstance(op, cirq.ControlledOperation):
+        # controls on |0> are X toggles around the operation
+        zeros = sum(1 for cv in op.control_values if 1 not in cv)
+        return (_operation_counts(op.sub_operation, num_controls + len(op.controls), cache)
+                + Counter({"clifford": 2*zeros}))
+    if isinstance(op, cirq.ClassicallyControlledOperation):
+        return _operation_counts(op.without_classical_controls(), num_controls, cache)
+    if op.gate is not None:
+        counts = _gate_counts(op.gate, num_controls)
+        if not counts["other"]:
+            return counts
+    # unknown operation: count its decomposition when it has one
+    decomposition = cirq.decompose_once(op, default=None)
+    if decomposition is None:
+        return Counter({"other": 1})
+    counts = Counter()
+    for sub_op in decomposition:
+        counts += _operation_counts(sub_op, num_controls, cache)
+    return counts
+
+def _circuit_counts(circuit: cirq.AbstractCircuit, num_controls: int, cache: dict) -> Counter:
+    # frozen subcircuits are counted once per number of extra controls
+    key = (circuit, num_controls) if isinstance(circuit, cirq.FrozenCircuit) else None
+    if key is not None and key in cache:
+        return cache[key]
+    counts = Counter()
+    for op in circuit.all_operations():
+        counts += _operation_counts(op, num_controls, cache)
+    if key is not None:
+        cache[key] = counts
+    return counts
+
+def gate_counts(circuit: cirq.AbstractCircuit, cache: dict = None) -> dict:
+    '''
+    Count gates by type while walking the structure of the circuit: cirq.CircuitOperations are counted once per
+    distinct subcircuit (and number of extra controls) and multiplied by their repetitions, controlled subcircuits
+    count each of their gates with the extra controls, classically controlled operations are counted as applied.
+    Multi-controlled gates are costed with the decompositions of _gate_counts instead of being decomposed.
+    Parameters:
+     - circuit: The circuit to count
+     - cache: optional dict of per-subcircuit counts, to share between calls on circuits with common subcircuits
+    Returns:
+     - counts: dict with the numbers of Toffoli, T, Clifford, arbitrary rotation, measurement and other (unknown)
+       gates (keys GATE_COUNT_KEYS) and the number of qubits ("qubits")
     '''
-    T_gate_counter = 0
-        
+    counts = _circuit_counts(circuit, 0, cache if cache is not None else {})
+    result = {key: counts[key] for key in GATE_COUNT_KEYS}
+    result["qubits"] = len(circuit.all_qubits())
+    return result
+
+# T-count of a z-rotation synthesized to precision epsilon in Clifford+T: slope*log2(1/epsilon) + offset
+SYNTHESIS_MODELS = {
+    "gridsynth": (3.0, 0.0),                # Ross and Selinger, 3*log2(1/epsilon) + O(log(log(1/epsilon)))
+    "repeat_until_success": (1.15, 9.2),    # Bocharov, Roetteler and Svore, expected T-count
+}
+
+def rotation_t_cost(epsilon: float, model="gridsynth") -> int:
+    '''
+    T-count of one arbitrary single-qubit rotation synthesized to precision epsilon
+    Parameters:
+     - epsilon: synthesis error of the rotation (operator norm)
+     - model: name in SYNTHESIS_MODELS or a (slope, offset) pair, the cost being slope*log2(1/epsilon) + offset
+    Returns:
+     - t_cost: the T-count of the rotation, rounded up
+    '''
+    slope, offset = SYNTHESIS_MODELS[model] if isinstance(model, str) else model
+    return max(0, math.ceil(slope*math.log2(1/epsilon) + offset))
+
+def _op_resources(op: cirq.Operation) -> tuple:
+    # (qubits and measurement keys an operation occupies, control keys it only reads): as in a cirq.Moment, operations
+    # conditioned on the same key run in parallel after its measurement, and a measurement waits for the earlier readers
+    if isinstance(op, cirq.GateOperation) and not isinstance(op.gate, cirq.MeasurementGate):
+        return op.qubits, ()
+    return op.qubits + tuple(cirq.measurement_key_objs(op)), tuple(cirq.control_keys(op))
+
+def _operation_t_depth(op: cirq.Operation, num_controls: int, gate_t_depth, caches: tuple) -> int:
+    op = op.untagged
+    if isinstance(op, cirq.CircuitOperation):
+        circuit = op.circuit
+        if op.param_resolver.param_dict and cirq.is_parameterized(circuit):
+            circuit = cirq.resolve_parameters(circuit, op.param_resolver).freeze()
+        return abs(op.repetitions)*_circuit_t_depth(circuit, num_controls, gate_t_depth, caches)
+    if isinstance(op, cirq.ControlledOperation):
+        return _operation_t_depth(op.sub_operation, num_controls + len(op.controls), gate_t_depth, caches)
+    if isinstance(op, cirq.ClassicallyControlledOperation):
+        return _operation_t_depth(op.without_classical_controls(), num_controls, gate_t_depth, caches)
+    return gate_t_depth(_operation_counts(op, num_controls, caches[0]))
+
+def _circuit_t_depth(circuit: cirq.AbstractCircuit, num_controls: int, gate_t_depth, caches: tuple) -> int:
+    # T layer reached by each qubit (and key), a CircuitOperation being scheduled as one block on all its qubits
+    key = (circuit, num_controls) if isinstance(circuit, cirq.FrozenCircuit) else None
+    if key is not None and key in caches[1]:
+        return caches[1][key]
+    frontier = {}
+    readers = {}
+    for op in circuit.all_operations():
+        occupied, reads = _op_resources(op)
+        layer = max((frontier.get(r, 0) for r in occupied + reads), default=0)
+        if readers:
+            layer = max(layer, max(readers.get(r, 0) for r in occupied))
+        layer += _operation_t_depth(op, num_controls, gate_t_depth, caches)
+        for r in occupied:
+            frontier[r] = layer
+        for r in reads:
+            readers[r] = max(readers.get(r, 0), layer)
+    depth = max(list(frontier.values()) + list(readers.values()), default=0)
+    if key is not None:
+        caches[1][key] = depth
+    return depth
+
+def t_count_estimate(circuit: cirq.AbstractCircuit, epsilon: float = 1e-10, model="gridsynth",
+                     error_budget: float = None, toffoli_t_count: int = 7, toffoli_t_depth: int = 3,
+                     cache: dict = None) -> dict:
+    '''
+    Estimate the T-count and T-depth of the circuit in Clifford+T without transpiling it: Cliffords, T gates and
+    Toffolis are counted exactly on the circuit structure (see gate_counts) and every arbitrary rotation is given the
+    synthesis cost of rotation_t_cost. The T-depth is a critical path over the qubits where each gate takes the T
+    layers of its decomposition run sequentially (a synthesized rotation is one sequence of T gates), so it is an upper
+    bound for circuits with repeated or multi-controlled subcircuits.
+    Parameters:
+     - circuit: The circuit to estimate
+     - epsilon: synthesis error of each rotation
+     - model: rotation synthesis model, see rotation_t_cost
+     - error_budget: if given, total synthesis error shared evenly by the rotations (overrides epsilon)
+     - toffoli_t_count, toffoli_t_depth: T-count and T-depth of a Toffoli (7 and 3 without ancilla)
+     - cache: optional dict of per-subcircuit counts, as in gate_counts
+    Returns:
+     - estimate: dict with the T-count ("t_count"), the T-depth ("t_depth"), the number of rotations ("rotations"),
+       the T-count of each rotation ("rotation_t_cost"), the rotation precision ("epsilon") and the "toffoli", "t"
+       (explicit T gates), "clifford" and "qubits" counts of gate_counts
+    '''
+    cache = cache if cache is not None else {}
+    counts = gate_counts(circuit, cache)
+    if error_budget is not None:
+        epsilon = error_budget/max(counts["rotation"], 1)
+    rotation_cost = rotation_t_cost(epsilon, model)
+
+    def gate_t_depth(op_counts):
+        return op_counts["t"] + toffoli_t_depth*op_counts["toffoli"] + rotation_cost*op_counts["rotation"]
+
+    return {
+        "t_count": counts["t"] + toffoli_t_count*counts["toffoli"] + rotation_cost*counts["rotation"],
+        "t_depth": _circuit_t_depth(circuit, 0, gate_t_depth, (cache, {})),
+        "rotations": counts["rotation"],
+        "rotation_t_cost": rotation_cost,
+        "epsilon": epsilon,
+        "toffoli": counts["toffoli"],
+        "t": counts["t"],
+        "clifford": counts["clifford"],
+        "qubits": counts["qubits"],
+    }
+
+def _flat_operations(operations):
+    # operations one at a time, CircuitOperations unrolled one repetition at a time and controlled (or classically
+    # controlled) subcircuits expanded into controlled operations
+    for op in operations:
+        op = op.untagged
+        if isinstance(op, cirq.CircuitOperation):
+            body = op.replace(repetitions=1 if op.repetitions > 0 else -1, repetition_ids=None)
+            body = body.mapped_circuit(deep=False)
+            for _ in range(abs(op.repetitions)):
+                yield from _flat_operations(body.all_operations())
+        elif isinstance(op, cirq.ControlledOperation) and isinstance(op.sub_operation.untagged, cirq.CircuitOperation):
+            for sub_op in _flat_operations([op.sub_operation]):
+                yield sub_op.controlled_by(*op.controls, control_values=op.control_values)
+        elif (isinstance(op, cirq.ClassicallyControlledOperation)
+              and isinstance(op.without_classical_controls().untagged, cirq.CircuitOperation)):
+            for sub_op in _flat_operations([op.without_classical_controls()]):
+                yield sub_op.with_classical_controls(*op.classical_controls)
+        else:
+            yield op
+
+def circuit_depths(operations, toffoli_t_depth: int = 3, rotation_t_depth: int = 0, cache: dict = None) -> dict:
+    '''
+    Depth, Toffoli-depth and T-depth of a stream of operations in one pass, keeping only the layer reached by each
+    qubit (and measurement key): an operation starts after the last layer of its qubits. Every operation is one layer
+    of the depth, Toffoli and T gates are counted as in gate_counts (a c-controlled X is a ladder of Toffolis).
+    Parameters:
+     - operations: iterable of operations in circuit order (e.g. circuit.all_operations() or a generator),
+       CircuitOperations are unrolled on the fly
+     - toffoli_t_depth: T-depth of a Toffoli
+     - rotation_t_depth: T-depth of an arbitrary rotation (see rotation_t_cost), 0 to leave rotations out
+     - cache: optional dict of per-subcircuit counts, as in gate_counts
+    Returns:
+     - depths: dict with the "depth", "toffoli_depth" and "t_depth"
+    '''
+    cache = cache if cache is not None else {}
+    gate_costs = {}
+    frontier = {}
+    readers = {}
+    depths = (0, 0, 0)
+    for op in _flat_operations(operations):
+        occupied, reads = _op_resources(op)
+        if not occupied and not reads:
+            continue
+        gate = op.gate if isinstance(op, cirq.GateOperation) else None
+        costs = gate_costs.get(gate) if gate is not None else None
+        if costs is None:
+            counts = _operation_counts(op, 0, cache)
+            costs = (counts["toffoli"], counts["t"] + toffoli_t_depth*counts["toffoli"] + rotation_t_depth*counts["rotation"])
+            if gate is not None:
+                gate_costs[gate] = costs
+        start = (0, 0, 0)
+        for r in occupied + reads:
+            layer = frontier.get(r)
+            if layer is not None:
+                start = (max(start[0], layer[0]), max(start[1], layer[1]), max(start[2], layer[2]))
+        if readers:
+            for r in occupied:
+                layer = readers.get(r)
+                if layer is not None:
+                    start = (max(start[0], layer[0]), max(start[1], layer[1]), max(start[2], layer[2]))
+        layer = (start[0] + 1, start[1] + costs[0], start[2] + costs[1])
+        for r in occupied:
+            frontier[r] = layer
+        for r in reads:
+            last = readers.get(r, (0, 0, 0))
+            readers[r] = (max(last[0], layer[0]), max(last[1], layer[1]), max(last[2], layer[2]))
+        depths = (max(depths[0], layer[0]), max(depths[1], layer[1]), max(depths[2], layer[2]))
+    return {"depth": depths[0], "toffoli_depth": depths[1], "t_depth": depths[2]}
+
+def check_resource_model(model: dict, circuit: cirq.AbstractCircuit, cache: dict = None) -> dict:
+    '''
+    Cross-check a closed-form resource model (see utils.resource_model) against the counts of the built circuit: the
+    Toffoli count must be exact, the Toffoli-depth and the qubits may be upper bounds (blocks of a composed model are
+    added one after another and idle registers are counted).
+    Parameters:
+     - model: dict with the "toffoli", "toffoli_depth" and "qubits" of the model
+     - circuit: the circuit built for the same parameters
+     - cache: optional dict of per-subcircuit counts, as in gate_counts
+    Returns:
+     - measured: dict with the "toffoli", "toffoli_depth" and "qubits" of the circuit, a ValueError is raised when the
+       model does not hold
+    '''
+    cache = cache if cache is not None else {}
+    counts = gate_counts(circuit, cache=cache)
+    measured = {"toffoli": counts["toffoli"],
+                "toffoli_depth": circuit_depths(circuit.all_operations(), cache=cache)["toffoli_depth"],
+                "qubits": counts["qubits"]}
+    if (model["toffoli"] != measured["toffoli"] or model["toffoli_depth"] < measured["toffoli_depth"]
+            or model["qubits"] < measured["qubits"]):
+        raise ValueError("Resource model {} does not hold for the circuit {}".format(model, measured))
+    return measured
+
+def split_repetitions(circuit: cirq.Circuit) -> list:
+    '''
+    Split a circuit into segments that can be costed independently without unrolling repeated subcircuits
+    Parameters:
+     - circuit: The circuit to split
+    Returns:
+     - segments: list of (cirq.Circuit, repetitions). Every cirq.CircuitOperation with repetitions > 1 becomes
+       its own segment holding the body once; the operations in between are kept together with repetitions 1
+    '''
+    segments = []
+    current = cirq.Circuit()
     for moment in circuit:
+        plain_ops = []
         for op in moment:
-            if (str(op).startswith('T')):
-                T_gate_counter += 1
+            if isinstance(op, cirq.CircuitOperation) and abs(op.repetitions) > 1:
+                if plain_ops:
+                    current.append(cirq.Moment(plain_ops))
+                    plain_ops = []
+                if len(current):
+                    segments.append((current, 1))
+                    current = cirq.Circuit()
+                body = op.replace(repetitions=1 if op.repetitions > 0 else -1, repetition_ids=None)
+                segments.append((body.mapped_circuit(deep=False), abs(op.repetitions)))
+            else:
+                plain_ops.append(op)
+        if plain_ops:
+            current.append(cirq.Moment(plain_ops))
+    if len(current):
+        segments.append((current, 1))
+    return segments
 
-    return (T_gate_counter)
+def _unrolled_operations(operations):
+    # CircuitOperations of the top level unrolled one repetition at a time, as cirq.unroll_circuit_op(deep=False)
+    for op in operations:
+        if isinstance(op.untagged, cirq.CircuitOperation):
+            body = op.untagged.replace(repetitions=1 if op.untagged.repetitions > 0 else -1, repetition_ids=None)
+            body = body.mapped_circuit(deep=False)
+            for _ in range(abs(op.untagged.repetitions)):
+                yield from body.all_operations()
+        else:
+            yield op
 
-def generate_circuit_stats(circuit: cirq.Circuit, n:int, csv_out='scaling_data.csv', save_circuit=False) -> None:
+def decomposed_operations(circuit: cirq.Circuit, chunk_size: int = 64):
+    '''
+    Operations of qsp_decompose_once(cirq.unroll_circuit_op(circuit, deep=False)) as a generator: the unrolled
+    operations are decomposed 'chunk_size' at a time, so the decomposed circuit is never held in memory (chunks are
+    kept small since a wide multi-controlled gate alone decomposes into many operations).
+    Parameters:
+     - circuit: The circuit to decompose
+     - chunk_size: number of operations decomposed at once
+    Returns:
+     - a generator of the decomposed operations in circuit order
+    '''
+    chunk = []
+    for op in _unrolled_operations(circuit.all_operations()):
+        chunk.append(op)
+        if len(chunk) == chunk_size:
+            yield from qsp_decompose_once(cirq.Circuit(chunk)).all_operations()
+            chunk = []
+    if chunk:
+        yield from qsp_decompose_once(cirq.Circuit(chunk)).all_operations()
+
+CSV_HEADER = 'Input Size,Toff_Decomp_Time,Write_Out_Toff_Time,Ttl_Qubits,Toffoli_Gate_Count ,Circ_Depth_Toff,Toffoli_Depth,T_Depth'
+
+@profiled
+def compute_circuit_stats(circuit: cirq.Circuit, n: int, save_circuit=False, decompose=True,
+                          qasm_out='open_qasm_for_toffoli.qasm', cache: StatsCache = None) -> list:
     """
-    Produce resources estimation of the circuit based on system size n. The output file ('csv_out') will contain infomation of:
+    Produce resources estimation of the circuit based on system size n, as the values of the columns of CSV_HEADER:
     "Input size -- Toffoli Decomposition Time -- Time writing out Toffoli Circuit -- Total Qubits -- # Toffoli Gates 
-    -- Circuit Depth in toffoli decomposition)"
+    -- Circuit Depth in toffoli decomposition -- Toffoli Depth -- T Depth)"
+    The depths are critical paths over the qubits (see circuit_depths), the T depth counts a Toffoli as 3 T layers.
+    The circuit is decomposed once, in a single streaming pass shared by the counts and the OpenQASM export (see
+    _decomposed_stats), so the decomposed circuit is never held in memory.
 
     :param circuit: the circuit wished to validate
     :param n: input size
-    :param csv_out: the csv store
     :param save_circuit: whether save circuit or not (in OpenQASM 2.0 format)
+    :param decompose: decompose the circuit with qsp_decompose_once before counting. When False, the Toffolis are
+                      counted on the circuit structure with the cost model of gate_counts (no decomposition time) and
+                      the depth is the depth of the undecomposed circuit
+    :param qasm_out: file the decomposed circuit is streamed to when save_circuit is True, gzip-compressed when it
+                     ends with '.gz' (see utils.qasm_writer)
+    :param cache: optional utils.stats_cache.StatsCache, the row (and the OpenQASM file) of a circuit already
+                  estimated is taken from it instead of being recomputed
+    :return: the list of values of the row
     """
+    if cache is not None:
+        return _cached_circuit_stats(circuit, n, save_circuit, decompose, qasm_out, cache)
 
-    t_start_time = time.time()
+    with stage("count_qubits", n=n):
+        ttl_qubits, ctl_qubits, anc_qubits = count_qubits(circuit)
 
-    # Decompose circuit:
-    decomposed_circuit       = cirq.align_left((qsp_decompose_once(circuit)))
-    t_decomp_to_toffoli_time = time.time()
-    
+    if decompose:
+        # one streaming pass: every chunk is decomposed once, counted, and written out when save_circuit is set
+        with stage("decompose_count_write", n=n, circuit=circuit) as current:
+            if save_circuit:
+                with open_qasm(qasm_out) as out_file:
+                    writer = QasmWriter(out_file, qubits=sorted(circuit.all_qubits()))
+                    stats = _decomposed_stats(circuit, writer)
+                current.add(gates=writer.num_operations)
+            else:
+                stats = _decomposed_stats(circuit)
+        t_toff = stats["decompose_time"]
+        t_write_out_toff = stats["write_time"] if save_circuit else -1
+        num_Toff_gates = stats["toffoli"]
+        depth_toff, toffoli_depth, t_depth = stats["depth"], stats["toffoli_depth"], stats["t_depth"]
+        return [n, t_toff, t_write_out_toff, ttl_qubits, num_Toff_gates, depth_toff, toffoli_depth, t_depth]
 
-
-    if save_circuit:
-        # Save circuit to file in OpenQASM 2.0 format:
-        with open(f'open_qasm_for_toffoli.qasm', 'w') as f:
-            print_to_openqasm(f, decomposed_circuit)
-        t_write_toffoli_time = time.time()
-
-
-    # Lets write all this stuff out:
-    if os.path.exists(csv_out):
-        yes_header = False
-    else:
-        yes_header = True
-    out_file = open(csv_out, 'a')
-    if yes_header:
-        out_file.write('Input Size,Toff_Decomp_Time,Write_Out_Toff_Time,Ttl_Qubits,Toffoli_Gate_Count ,Circ_Depth_Toff\n')
-
-    # Calculate the times
-    t_toff   = (t_decomp_to_toffoli_time  - t_start_time)
-    # t_clifft = (t_decomp_to_cliffT_time   - t_decomp_to_toffoli_time)
+    # Count on the circuit structure: repeated subcircuits (e.g. compact rounds of amplification) are counted once
+    segments = split_repetitions(circuit)
+    t_write_out_toff = -1
     if save_circuit:
-        t_write_out_toff   = (t_write_toffoli_time - t_decomp_to_toffoli_time)
+        # Stream the decomposed circuit to file in OpenQASM 2.0 format:
+        with stage("write_qasm", n=n, path=qasm_out) as current:
+            t_start_time = time.time()
+            current.add(gates=write_qasm(decomposed_operations(circuit), qasm_out, qubits=sorted(circuit.all_qubits())))
+            t_write_out_toff = time.time() - t_start_time
+
+    with stage("count_Toff_gates", n=n):
+        num_Toff_gates = count_Toff_gates(circuit)
+
+    # segments are executed one after another, so their depths add up
+    with stage("circuit_depths", n=n):
+        segment_depths = [(circuit_depths(segment.all_operations()), repetitions) for segment, repetitions in segments]
+    depth_toff     = sum(repetitions*depths["depth"] for depths, repetitions in segment_depths)
+    toffoli_depth  = sum(repetitions*depths["toffoli_depth"] for depths, repetitions in segment_depths)
+    t_depth        = sum(repetitions*depths["t_depth"] for depths, repetitions in segment_depths)
+
+    return [n, 0, t_write_out_toff, ttl_qubits, num_Toff_gates, depth_toff, toffoli_depth, t_depth]
 
-    else:
-        t_write_out_toff   = -1
+def _decomposed_stats(circuit: cirq.Circuit, writer: QasmWriter = None, chunk_size: int = 64) -> dict:
+    '''
+    Toffoli count and depths of the decomposed circuit in a single pass. Each segment of split_repetitions is
+    unrolled and decomposed with qsp_decompose_once 'chunk_size' operations at a time, as decomposed_operations
+    does, so the counts are those of the written circuit. The decomposed chunks are counted, fed to
+    circuit_depths and written to 'writer' when given. Only the decomposition of one repeated body is kept, to write
+    its other repetitions, so the decomposed circuit is never held in memory.
+    Returns:
+     - stats: dict with the "toffoli" count, the "depth", "toffoli_depth" and "t_depth", the time spent decomposing
+       ("decompose_time") and writing ("write_time")
+    '''
+    stats = {"toffoli": 0, "depth": 0, "toffoli_depth": 0, "t_depth": 0, "decompose_time": 0.0, "write_time": 0.0}
 
+    def decomposed(segment, repetitions, body):
+        operations = _unrolled_operations(segment.all_operations())
+        while True:
+            chunk = list(itertools.islice(operations, chunk_size))
+            if not chunk:
+                return
+            t_start_time = time.time()
+            part = qsp_decompose_once(cirq.Circuit(chunk))
+            stats["decompose_time"] += time.time() - t_start_time
+            stats["toffoli"] += repetitions*count_Toff_gates(part)
+            if writer is not None:
+                t_start_time = time.time()
+                writer.write_all(part.all_operations())
+                stats["write_time"] += time.time() - t_start_time
+                if body is not None:
+                    body.append(part)
+            yield from part.all_operations()
 
-    
-    print_string = f'{n},{t_toff},{t_write_out_toff}'
+    for segment, repetitions in split_repetitions(circuit):
+        body = [] if repetitions > 1 else None
+        # segments are executed one after another, so their depths add up
+        depths = circuit_depths(decomposed(segment, repetitions, body))
+        for key in ("depth", "toffoli_depth", "t_depth"):
+            stats[key] += repetitions*depths[key]
+        if writer is not None and body:
+            t_start_time = time.time()
+            for _ in range(repetitions - 1):
+                for part in body:
+                    writer.write_all(part.all_operations())
+            stats["write_time"] += time.time() - t_start_time
+    return stats
 
-    ttl_qubits, ctl_qubits, anc_qubits = count_qubits(circuit)
-    num_Toff_gates = count_Toff_gates(decomposed_circuit)
+def _cached_circuit_stats(circuit: cirq.Circuit, n: int, save_circuit: bool, decompose: bool, qasm_out: str,
+                          cache: StatsCache) -> list:
+    # the entry holds the row without the input size and the time of writing out the OpenQASM file, if stored
+    with stage("stats_cache_lookup", n=n) as current:
+        key = cache.key(circuit, decompose=decompose)
+        entry = cache.get(key)
+        current.add(hit=entry is not None)
+    if entry is None:
+        row = compute_circuit_stats(circuit, n, save_circuit=save_circuit, decompose=decompose, qasm_out=qasm_out)
+        entry = {"row": row[1:2] + [-1] + row[3:], "write_time": row[2] if save_circuit else None}
+        if save_circuit:
+            cache.put_file(key, qasm_out)
+        cache.put(key, entry)
+        return row
 
-    print_string += f',{ttl_qubits}, {num_Toff_gates}'
+    # the times report the work of this run: nothing was decomposed, and the file is only written when not cached
+    row = [n] + entry["row"]
+    row[1] = -1
+    if save_circuit and (entry["write_time"] is None or not cache.get_file(key, qasm_out)):
+        t_start_time = time.time()
+        write_qasm(decomposed_operations(circuit), qasm_out, qubits=sorted(circuit.all_qubits()))
+        entry["write_time"] = time.time() - t_start_time
+        cache.put_file(key, qasm_out)
+        cache.put(key, entry)
+        row[2] = entry["write_time"]
+    return row
 
-    depth_toff   = len(cirq.align_left(decomposed_circuit))
-    print_string += f',{depth_toff}\n'
+def write_circuit_stats(row: list, csv_out='scaling_data.csv', header=CSV_HEADER) -> None:
+    """
+    Append one row to the csv file, writing the header first if the file is new. The row is written with a single
+    write and flushed to disk before returning, so an interrupted run never leaves a partial row behind a complete one.
+    A file with another header (e.g. written before the depth columns were added) is refused rather than mixed with
+    rows of a different layout.
 
-    out_file.write(print_string)
\ No newline at end of file
+    :param row: values of the columns
+    :param csv_out: the csv store
+    :param header: header line of the file
+    """
+    with open(csv_out, 'a+') as out_file:
+        line = ','.join(str(value) for value in row) + '\n'
+        if out_file.tell() == 0:
+            line = header + '\n' + line
+        else:
+            out_file.seek(0)
+            first_line = out_file.readline().rstrip('\n')
+            if first_line != header:
+                raise ValueError("{} has the header {!r} instead of {!r}, write the rows to another file".format(
+                    csv_out, first_line, header))
+        out_file.write(line)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+
+def generate_circuit_stats(circuit: cirq.Circuit, n:int, csv_out='scaling_data.csv', save_circuit=False,
+                           decompose=True, qasm_out='open_qasm_for_toffoli.qasm', cache: StatsCache = None) -> None:
+    """
+    Produce resources estimation of the circuit based on system size n and append it to 'csv_out' (see
+    compute_circuit_stats for the columns).
+
+    :param circuit: the circuit wished to validate
+    :param n: input size
+    :param csv_out: the csv store
+    :param save_circuit: whether save circuit or not (in OpenQASM 2.0 format)
+    :param decompose: decompose the circuit with qsp_decompose_once before counting (see compute_circuit_stats)
+    :param qasm_out: file the decomposed circuit is streamed to when save_circuit is True (see compute_circuit_stats)
+    :param cache: optional utils.stats_cache.StatsCache of rows already computed (see compute_circuit_stats)
+    """
+    write_circuit_stats(compute_circuit_stats(circuit, n, save_circuit=save_circuit, decompose=decompose,
+                                              qasm_out=qasm_out, cache=cache), csv_out)
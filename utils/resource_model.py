@@ -0,0 +1,40 @@
+"""
+Closed-form resource models of the circuit builders (see the resource_model methods of Adder, ControlAdder,
+Multiplier, ConstantMultiplier, Squarer, Comparator, the BlackBox models and Gaussian1DineqBased).
+
+A model is a dict with the Toffoli count ('toffoli'), the Toffoli-depth ('toffoli_depth'), the number of qubits of
+the circuit ('qubits') and the number of those qubits that are ancillae besides the registers of the caller
+('ancillae'). Counts follow the cost model of utils.resource_estimation.gate_counts (a c-controlled X is a ladder
+of 2c-3 Toffolis, a c-controlled phase needs 2(c-1) Toffolis for the AND of its controls) and the Toffoli-depth is the
+critical path of utils.resource_estimation.circuit_depths, so both can be cross-checked on built circuits with
+utils.resource_estimation.check_resource_model. Sequences of blocks add their depths, which is exact for blocks
+chained on shared registers and an upper bound otherwise.
+"""
+
+def resources(toffoli: int = 0, toffoli_depth: int = 0, qubits: int = 0, ancillae: int = 0) -> dict:
+  return {"toffoli": toffoli, "toffoli_depth": toffoli_depth, "qubits": qubits, "ancillae": ancillae}
+
+def mcx_toffolis(num_controls: int) -> int:
+  """ Toffolis of an X with 'num_controls' controls """
+  if num_controls <= 1:
+    return 0
+  return 1 if num_controls == 2 else 2*num_controls - 3
+
+def and_toffolis(num_controls: int) -> int:
+  """ Toffolis computing and uncomputing the AND of 'num_controls' controls (controlled phases and rotations) """
+  return 2*(num_controls - 1) if num_controls > 1 else 0
+
+def sequence(*blocks: dict) -> dict:
+  """
+  Blocks applied one after another: Toffolis and Toffoli-depths add up, ancillae are reused from one block to the
+  next (the peak is kept) and the qubits are those of the widest block.
+  """
+  return resources(toffoli=sum(block["toffoli"] for block in blocks),
+                   toffoli_depth=sum(block["toffoli_depth"] for block in blocks),
+                   qubits=max((block["qubits"] for block in blocks), default=0),
+                   ancillae=max((block["ancillae"] for block in blocks), default=0))
+
+def repeat(block: dict, repetitions: int) -> dict:
+  """ 'repetitions' applications of a block """
+  return resources(toffoli=repetitions*block["toffoli"], toffoli_depth=repetitions*block["toffoli_depth"],
+                   qubits=block["qubits"] if repetitions else 0, ancillae=block["ancillae"] if repetitions else 0)
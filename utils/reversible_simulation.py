@@ -0,0 +1,178 @@
+import cirq
+import numpy as np
+
+"""
+Classical simulator for reversible circuits (X, CNOT, Toffoli, multi-controlled X, SWAP, Fredkin and
+cirq.CircuitOperations of them), used to check the arithmetic blocks (Adder, ControlAdder, Multiplier, Comparator)
+at register widths far beyond the reach of a state vector simulation.
+
+Every qubit holds one bit per input assignment, packed 64 assignments per np.uint64 word, so each gate is a few
+vectorized bitwise operations over all the assignments at once. Diagonal gates (Z, CZ, CCZ and their powers) only
+change phases and are skipped; any other gate raises a ValueError.
+"""
+
+_DIAGONAL_GATES = (cirq.ZPowGate, cirq.CZPowGate, cirq.CCZPowGate, cirq.IdentityGate, cirq.GlobalPhaseGate)
+
+def _is_flip(gate) -> bool:
+  # an X power acting as a bit flip (exponent 1 mod 2, no global phase), or as the identity (exponent 0)
+  return gate.global_shift == 0 and not cirq.is_parameterized(gate) and gate.exponent % 2 in (0, 1)
+
+def _flatten(op: cirq.Operation, controls: list, instructions: list) -> None:
+  """
+  Append the instructions ('x' or 'swap', controls, targets) of 'op' to 'instructions'. Controls are
+  (qubit, value) pairs, the instruction is applied on the assignments where every control has its value.
+  """
+  op = op.untagged
+  if isinstance(op, cirq.CircuitOperation):
+    for sub_op in op.mapped_circuit(deep=False).all_operations():
+      _flatten(sub_op, controls, instructions)
+    return
+  if isinstance(op, cirq.ControlledOperation):
+    values = [cv[0] for cv in op.control_values]
+    if any(len(cv) != 1 for cv in op.control_values):
+      raise ValueError("Only one control value per control qubit is supported: {}".format(op))
+    _flatten(op.sub_operation, controls + list(zip(op.controls, values)), instructions)
+    return
+
+  gate = op.gate
+  if isinstance(gate, cirq.ControlledGate):
+    num_controls = gate.num_controls()
+    if any(len(cv) != 1 for cv in gate.control_values):
+      raise ValueError("Only one control value per control qubit is supported: {}".format(op))
+    values = [cv[0] for cv in gate.control_values]
+    _flatten(gate.sub_gate.on(*op.qubits[num_controls:]), controls + list(zip(op.qubits[:num_controls], values)),
+             instructions)
+  elif isinstance(gate, _DIAGONAL_GATES):
+    return
+  elif isinstance(gate, cirq.XPowGate) and _is_flip(gate):
+    if gate.exponent % 2 == 1:
+      instructions.append(('x', controls, list(op.qubits)))
+  elif isinstance(gate, cirq.CXPowGate) and _is_flip(gate):
+    if gate.exponent % 2 == 1:
+      instructions.append(('x', controls + [(op.qubits[0], 1)], [op.qubits[1]]))
+  elif isinstance(gate, cirq.CCXPowGate) and _is_flip(gate):
+    if gate.exponent % 2 == 1:
+      instructions.append(('x', controls + [(op.qubits[0], 1), (op.qubits[1], 1)], [op.qubits[2]]))
+  elif isinstance(gate, cirq.SwapPowGate) and _is_flip(gate):
+    if gate.exponent % 2 == 1:
+      instructions.append(('swap', controls, list(op.qubits)))
+  elif isinstance(gate, cirq.CSwapGate):
+    instructions.append(('swap', controls + [(op.qubits[0], 1)], list(op.qubits[1:])))
+  else:
+    raise ValueError("{} is not a classical reversible operation".format(op))
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+  """
+  Pack a boolean array of N assignments into ceil(N/64) np.uint64 words (assignment k is bit k%64 of word k//64).
+  """
+  bits = np.asarray(bits, dtype=bool)
+  padded = np.zeros(-(-len(bits)//64)*64, dtype=bool)
+  padded[:len(bits)] = bits
+  return np.packbits(padded, bitorder='little').view(np.uint64)
+
+def unpack_bits(words: np.ndarray, num_samples: int) -> np.ndarray:
+  """
+  Inverse of pack_bits, return the first 'num_samples' assignments as a boolean array.
+  """
+  return np.unpackbits(words.view(np.uint8), bitorder='little')[:num_samples].astype(bool)
+
+class ReversibleSimulator:
+  def __init__(self, circuit: cirq.Circuit) -> None:
+    """
+    :param circuit: circuit of classical reversible gates, compiled once into a list of bitwise instructions
+    """
+    self.circuit = circuit
+    self.qubits = sorted(circuit.all_qubits())
+    index = {qubit: i for i, qubit in enumerate(self.qubits)}
+    instructions = []
+    for op in circuit.all_operations():
+      _flatten(op, [], instructions)
+    self.instructions = [(kind, [(index[q], value) for q, value in controls], [index[q] for q in targets])
+                         for kind, controls, targets in instructions]
+
+  def run_packed(self, state: np.ndarray) -> np.ndarray:
+    """
+    Apply the circuit in place on 'state', a (number of qubits, number of words) np.uint64 array ordered as self.qubits.
+    """
+    ones = np.full(state.shape[1], np.iinfo(np.uint64).max, dtype=np.uint64)
+    for kind, controls, targets in self.instructions:
+      mask = ones
+      for q, value in controls:
+        mask = mask & (state[q] if value else ~state[q])
+      if kind == 'x':
+        state[targets[0]] ^= mask
+      else:
+        diff = (state[targets[0]] ^ state[targets[1]]) & mask
+        state[targets[0]] ^= diff
+        state[targets[1]] ^= diff
+    return state
+
+  def run(self, inputs: dict, num_samples: int) -> dict:
+    """
+    :param inputs: dict mapping qubits to boolean arrays of 'num_samples' input bits, missing qubits start in 0
+                   (see register_bits to build it from integer values)
+    :param num_samples: number of input assignments
+    :return: dict mapping every qubit of the circuit, and every qubit of 'inputs' (unchanged when the circuit does
+             not act on it), to its boolean array of output bits
+    """
+    num_words = -(-num_samples//64)
+    state = np.zeros((len(self.qubits), num_words), dtype=np.uint64)
+    for i, qubit in enumerate(self.qubits):
+      if qubit in inputs:
+        state[i] = pack_bits(inputs[qubit])
+    self.run_packed(state)
+    outputs = {qubit: np.asarray(bits, dtype=bool)[:num_samples] for qubit, bits in inputs.items()}
+    outputs.update((qubit, unpack_bits(state[i], num_samples)) for i, qubit in enumerate(self.qubits))
+    return outputs
+
+def register_bits(values: np.ndarray, register: list) -> dict:
+  """
+  Bits of integer 'values' (at most 64 bits) on 'register', register[0] being the least significant bit.
+
+  :return: dict mapping each qubit of the register to a boolean array, as expected by ReversibleSimulator.run
+  """
+  values = np.asarray(values, dtype=np.uint64)
+  return {qubit: ((values >> np.uint64(j)) & np.uint64(1)).astype(bool) for j, qubit in enumerate(register)}
+
+def read_register(bits: dict, register: list) -> np.ndarray:
+  """
+  Integer values of 'register' (register[0] the least significant bit) from the output of ReversibleSimulator.run,
+  as np.uint64 up to 64 qubits and as Python integers (object array) beyond. Qubits missing from 'bits' (never acted
+  on by the circuit nor given as inputs) read as 0.
+  """
+  num_samples = len(next(iter(bits.values())))
+  if len(register) <= 64:
+    values = np.zeros(num_samples, dtype=np.uint64)
+    for j, qubit in enumerate(register):
+      if qubit in bits:
+        values |= bits[qubit].astype(np.uint64) << np.uint64(j)
+    return values
+  values = np.zeros(num_samples, dtype=object)
+  for j, qubit in enumerate(register):
+    if qubit in bits:
+      values += bits[qubit].astype(object) << j
+  return values
+
+def exhaustive_values(widths: list) -> list:
+  """
+  Every assignment of registers of the given widths, as one np.uint64 array of 2^sum(widths) values per register.
+  """
+  total = sum(widths)
+  index = np.arange(2**total, dtype=np.uint64)
+  values, shift = [], 0
+  for width in widths:
+    values.append((index >> np.uint64(shift)) & np.uint64(2**width-1))
+    shift += width
+  return values
+
+def random_values(widths: list, num_samples: int, seed: int = None) -> list:
+  """
+  'num_samples' uniformly random assignments of registers of the given widths (at most 64 bits each).
+  """
+  rng = np.random.default_rng(seed)
+  values = []
+  for width in widths:
+    words = rng.integers(0, 2**32, size=(num_samples, 2), dtype=np.uint64)
+    value = (words[:, 0] << np.uint64(32)) | words[:, 1]
+    values.append(value & np.uint64(2**width-1) if width < 64 else value)
+  return values
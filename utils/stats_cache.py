@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import cirq
+
+"""
+Content-addressed on-disk cache of resource estimates (see utils.resource_estimation.compute_circuit_stats).
+
+Entries are keyed by a structural fingerprint of the circuit: a SHA-256 of its canonical operation stream (the repr
+of every operation, moment by moment, with the subcircuits of CircuitOperations fingerprinted once and referenced by
+their digest). The same model, black box, input size and number of iterations always build the same circuit, so a
+rerun finds its counts without decomposing anything. Every entry is a JSON file, optionally with a gzip-compressed
+OpenQASM file of the decomposed circuit. Files are written atomically (parallel workers may share a directory), reads
+refresh their modification time and the least recently used entries are evicted once the directory exceeds its size
+cap.
+"""
+
+# bump when the counts of compute_circuit_stats change for the same circuit, older entries are then never matched
+CACHE_VERSION = 1
+
+def circuit_fingerprint(circuit: cirq.AbstractCircuit, memo: dict = None) -> str:
+  """
+  SHA-256 hex digest of the canonical operation stream of the circuit.
+
+  :param circuit: the circuit to fingerprint
+  :param memo: digests of the frozen subcircuits already seen (filled in place)
+  """
+  memo = memo if memo is not None else {}
+  digest = hashlib.sha256()
+  for moment in circuit:
+    for op in moment:
+      untagged = op.untagged
+      if isinstance(untagged, cirq.CircuitOperation):
+        sub_key = id(untagged.circuit)
+        if sub_key not in memo:
+          # keep the subcircuit alive so that its id is not reused during the walk
+          memo[sub_key] = (circuit_fingerprint(untagged.circuit, memo), untagged.circuit)
+        token = "CircuitOperation({},{},{},{},{},{},{})".format(
+          memo[sub_key][0], untagged.repetitions, untagged.repetition_ids, sorted(untagged.qubit_map.items(), key=str),
+          sorted(untagged.measurement_key_map.items()), untagged.param_resolver.param_dict, op.tags)
+      else:
+        token = repr(op)
+      digest.update(token.encode())
+      digest.update(b";")
+    digest.update(b"|")
+  return digest.hexdigest()
+
+class StatsCache:
+  def __init__(self, directory: str = ".stats_cache", max_bytes: int = 1 << 30) -> None:
+    """
+    :param directory: cache directory, created when missing
+    :param max_bytes: size cap of the directory, the least recently used entries are evicted beyond it
+    """
+    self.directory = directory
+    self.max_bytes = max_bytes
+    os.makedirs(directory, exist_ok=True)
+
+  def key(self, circuit: cirq.AbstractCircuit, **params) -> str:
+    """ Key of the circuit for the estimation parameters 'params' (e.g. decompose=True) """
+    params = json.dumps(sorted(params.items()))
+    return hashlib.sha256("{}|{}|{}".format(CACHE_VERSION, params, circuit_fingerprint(circuit)).encode()).hexdigest()
+
+  def _path(self, key: str, suffix: str) -> str:
+    return os.path.join(self.directory, key + suffix)
+
+  def _touch(self, path: str) -> bool:
+    try:
+      os.utime(path)
+      return True
+    except FileNotFoundError:
+      return False
+
+  def get(self, key: str) -> dict:
+    """ Entry stored under 'key', or None """
+    path = self._path(key, ".json")
+    if not self._touch(path):
+      return None
+    try:
+      with open(path) as in_file:
+        return json.load(in_file)
+    except (FileNotFoundError, ValueError):
+      # evicted or replaced by another process meanwhile
+      return None
+
+  def put(self, key: str, entry: dict) -> None:
+    """ Store the JSON-serializable 'entry' under 'key' """
+    self._write(self._path(key, ".json"), lambda out_file: out_file.write(json.dumps(entry).encode()))
+
+  def get_file(self, key: str, path: str) -> bool:
+    """
+    Copy the OpenQASM file stored under 'key' to 'path' (decompressed unless 'path' ends with '.gz').
+    Return False when there is none.
+    """
+    cached = self._path(key, ".qasm.gz")
+    if not self._touch(cached):
+      return False
+    try:
+      if str(path).endswith('.gz'):
+        shutil.copyfile(cached, path)
+      else:
+        with gzip.open(cached, 'rb') as in_file, open(path, 'wb') as out_file:
+          shutil.copyfileobj(in_file, out_file)
+    except FileNotFoundError:
+      return False
+    return True
+
+  def put_file(self, key: str, path: str) -> None:
+    """ Store a copy of the OpenQASM file 'path' under 'key' (compressed when it is not) """
+    def copy(out_file):
+      if str(path).endswith('.gz'):
+        with open(path, 'rb') as in_file:
+          shutil.copyfileobj(in_file, out_file)
+      else:
+        with open(path, 'rb') as in_file, gzip.GzipFile(fileobj=out_file, mode='wb') as gz_file:
+          shutil.copyfileobj(in_file, gz_file)
+    self._write(self._path(key, ".qasm.gz"), copy)
+
+  def _write(self, path: str, write) -> None:
+    # write to a temporary file of the directory and rename it, readers never see a partial file
+    descriptor, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    try:
+      with os.fdopen(descriptor, 'wb') as out_file:
+        write(out_file)
+      os.replace(tmp_path, path)
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+    self.evict()
+
+  def evict(self) -> None:
+    """ Remove the least recently used entries until the directory is below max_bytes """
+    files = []
+    for entry in os.scandir(self.directory):
+      if entry.is_file() and not entry.name.endswith(".tmp"):
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size